@@ -1,17 +1,30 @@
-from fastapi import FastAPI, UploadFile, Form
-from fastapi.responses import JSONResponse
-import shutil
+from fastapi import FastAPI, UploadFile, Form, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 import os
 import json
 import requests
 import asyncio
 import logging
-from app.detector import processar_video
-from app.alerta_telegram import enviar_alerta_telegram, gerar_mensagem_padrao
+from app.detector import processar_video_stream, escolher_resolucao
+from app.modelos import obter_modelo, recarregar_modelo, estatisticas_modelos
+from app.alerta_telegram import DespachanteTelegram, gerar_mensagem_padrao, URL_API_TELEGRAM
+from app.email_alert import DespachanteEmail
+from app.rastreamento import eventos_representativos
 from datetime import datetime
-import base64
-import time
-from app.trainer import criar_config_yaml, treinar_modelo
+import uuid
+from app.trainer import executar_treinamento, caminho_treinamento, FORMATOS_EXPORTACAO
+from app.indice_dataset import indexar_dataset, verificar_dataset
+from app.backends import resolver_modelo, normalizar_backend, verificar_dependencias, BackendIndisponivel
+from app.jobs import GerenciadorJobs, CONCLUIDO
+from app.analise import executar_analise, inicializar_worker, MODOS_VIDEO
+from app.cache_resultados import CacheResultados, CACHE_RESULTADOS_ATIVO
+from app.ingestao import receber_upload, UploadRejeitado, TAMANHO_MAXIMO_UPLOAD_MB
+from app.transmissao import ProcessadorTransmissoes
+from app.registro_telegram import RegistroTelegram
+from app import metricas
+from app.perfis import CapturaPerfil, carregar_perfil
+from app.memoria import MEMORIA_LIMITADA
+from contextlib import nullcontext
 
 # Configurar logging
 logging.basicConfig(
@@ -25,8 +38,121 @@ MODELO_PATH = os.environ.get('MODELO_PATH')
 TOKEN_TELEGRAM = os.environ.get('TOKEN_TELEGRAM')
 URL_LAMBDA = os.environ.get('URL_LAMBDA')
 
+# Quantidade de processos worker que executam as análises de vídeo
+MAX_WORKERS_ANALISE = int(os.environ.get('MAX_WORKERS_ANALISE', 2))
+
+# Treinamentos executados ao mesmo tempo, em processos separados dos
+# workers de análise; os demais aguardam na fila
+MAX_TREINAMENTOS = int(os.environ.get('MAX_TREINAMENTOS', 1))
+
+# Threads do PyTorch por treinamento, para não tomar os núcleos das análises
+# (padrão: núcleos divididos entre os workers de análise e de treinamento)
+THREADS_TREINAMENTO = int(os.environ.get('THREADS_TREINAMENTO', 0)) or \
+    max(1, (os.cpu_count() or 1) // (MAX_WORKERS_ANALISE + MAX_TREINAMENTOS))
+
+# Segundos que o registro aguarda a mensagem do usuário chegar ao bot
+ESPERA_CONTATO_TELEGRAM_S = float(os.environ.get('ESPERA_CONTATO_TELEGRAM_S', 3))
+
 app = FastAPI()
 
+gerenciador_analises = GerenciadorJobs(
+    "analise",
+    max_workers=MAX_WORKERS_ANALISE,
+    inicializador=inicializar_worker,
+    argumentos_inicializador=(MODELO_PATH, max(1, (os.cpu_count() or 1) // MAX_WORKERS_ANALISE))
+)
+
+# Treinamentos em segundo plano, com as métricas de todas as épocas guardadas
+gerenciador_treinamentos = GerenciadorJobs(
+    "treinamento",
+    max_workers=MAX_TREINAMENTOS,
+    inicializador=inicializar_worker,
+    argumentos_inicializador=(None, THREADS_TREINAMENTO),
+    max_historico=50,
+    guardar_eventos=True
+)
+
+# Cache das detecções por conteúdo do vídeo e do modelo (contadores deste processo)
+cache_resultados = CacheResultados()
+
+# Envio dos alertas do Telegram em segundo plano, com conexões reaproveitadas
+despachante_telegram = DespachanteTelegram(TOKEN_TELEGRAM)
+
+# Envio dos alertas por e-mail em resumos, com conexões reaproveitadas
+despachante_email = DespachanteEmail(URL_LAMBDA)
+
+# Usuários registrados e contatos do bot (SQLite com cópia em memória)
+registro_telegram = RegistroTelegram(TOKEN_TELEGRAM)
+
+# Transmissões ao vivo, processadas na própria API com o modelo compartilhado;
+# criado na primeira transmissão
+processador_transmissoes = None
+
+
+@app.middleware("http")
+async def limitar_tamanho_upload(request: Request, call_next):
+    """
+    Rejeita os envios de vídeo maiores que o tamanho máximo pelo cabeçalho
+    Content-Length, antes de receber o corpo da requisição.
+    """
+    tamanho = request.headers.get("content-length", "")
+    # Margem para os demais campos do formulário multipart
+    limite = (TAMANHO_MAXIMO_UPLOAD_MB + 1) * 1024 * 1024
+    if request.method == "POST" and request.url.path.startswith("/analisar-video") \
+            and tamanho.isdigit() and int(tamanho) > limite:
+        return JSONResponse(
+            status_code=413,
+            content={"mensagem": f"O vídeo excede o tamanho máximo de {TAMANHO_MAXIMO_UPLOAD_MB:g} MB."}
+        )
+    return await call_next(request)
+
+
+@app.on_event("startup")
+def carregar_modelo_inicial():
+    """
+    Carrega e aquece o modelo padrão ao iniciar a API, para que a primeira
+    requisição não pague o custo de carga e de inicialização do grafo.
+    """
+    if MODELO_PATH and os.path.exists(MODELO_PATH):
+        try:
+            registro = obter_modelo(resolver_modelo(MODELO_PATH), aquecer=True)
+            logger.info(
+                f"Modelo inicial pronto: carga {registro.tempo_carga:.2f}s, "
+                f"aquecimento {registro.tempo_aquecimento:.2f}s"
+            )
+        except Exception as e:
+            logger.error(f"Erro ao carregar o modelo inicial: {str(e)}")
+    else:
+        logger.warning(f"Modelo não encontrado em {MODELO_PATH}; será carregado na primeira requisição")
+
+
+@app.on_event("startup")
+async def iniciar_despachante_telegram():
+    await despachante_telegram.iniciar()
+
+
+@app.on_event("startup")
+def iniciar_registro_telegram():
+    try:
+        registro_telegram.iniciar()
+    except Exception as e:
+        logger.error(f"Erro ao abrir o registro do Telegram: {str(e)}")
+
+
+@app.on_event("shutdown")
+async def encerrar_despachantes():
+    await despachante_telegram.encerrar()
+    await despachante_email.encerrar()
+
+
+@app.on_event("shutdown")
+def encerrar_workers():
+    gerenciador_analises.encerrar()
+    gerenciador_treinamentos.encerrar()
+    if processador_transmissoes is not None:
+        processador_transmissoes.encerrar()
+    registro_telegram.encerrar()
+
 
 # Função para enviar mensagem ao usuário e capturar o chat_id automaticamente
 def registrar_telegram_usuario(usuario_telegram):
@@ -35,7 +161,7 @@ def registrar_telegram_usuario(usuario_telegram):
     """
     try:
         # Enviar mensagem para o usuário, isso vai fazer o Telegram registrar o chat_id
-        url = f"https://api.telegram.org/bot{TOKEN_TELEGRAM}/sendMessage"
+        url = f"{URL_API_TELEGRAM}/bot{TOKEN_TELEGRAM}/sendMessage"
         parametros = {
             'chat_id': usuario_telegram,  # Nome de usuário no Telegram
             'text': "Olá! Seu chat ID foi registrado com sucesso. Agora você pode enviar vídeos para análise!"
@@ -65,31 +191,12 @@ def registrar_telegram_usuario(usuario_telegram):
 def obter_chat_id(username):
     """
     Obtém o chat_id de um usuário específico através do nome de usuário do Telegram.
-    Utiliza o método getUpdates para procurar pelo username e obter o chat_id associado.
+    Consulta o índice de contatos do bot, mantido a partir do getUpdates pelo
+    registro do Telegram, aguardando alguns segundos se a mensagem do usuário
+    ainda não tiver chegado.
     """
     try:
-
-        # Usar o getUpdates para capturar as mensagens enviadas para o bot
-        url = f"https://api.telegram.org/bot{TOKEN_TELEGRAM}/getUpdates"
-        response = requests.get(url, timeout=30)
-        
-        # Verificar se a resposta foi bem-sucedida
-        data = response.json()
-        
-        # Verificar se há mensagens e procurar pelo username
-        if data["ok"] and len(data["result"]) > 0:
-            for update in data["result"]:
-                message = update.get("message", {})
-                chat = message.get("chat", {})
-                from_user = message.get("from", {})
-                
-                # Verificar se o username corresponde ao fornecido
-                if from_user.get("username") == username:
-                    chat_id = chat.get("id")
-                    return chat_id
-        
-        # Se não encontrar o username, retornar None
-        return None
+        return registro_telegram.buscar_contato(username, tempo_limite=ESPERA_CONTATO_TELEGRAM_S)
 
     except Exception as e:
         logger.error(f"Erro ao obter chat_id para {username}: {str(e)}")
@@ -109,195 +216,242 @@ def registrar_telegram(usuario_telegram: str = Form(...)):
         if chat_id is None:
             return JSONResponse(status_code=400, content={"mensagem": "Não foi possível obter o chat_id. Verifique se o bot recebeu a mensagem."})
 
-        # Verificar se o arquivo já existe. Caso contrário, criá-lo
-        try:
-            with open("usuarios_telegram.json", "r") as file:
-                usuarios = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            usuarios = {}
-
         # Armazenar o chat_id associado ao usuário
-        usuarios[usuario_telegram] = chat_id
-        
-        # Salvar novamente os dados no arquivo
-        with open("usuarios_telegram.json", "w") as file:
-            json.dump(usuarios, file)
-        
+        registro_telegram.registrar(usuario_telegram, chat_id)
+
         return {"mensagem": f"Usuário {usuario_telegram} registrado com sucesso!", "chat_id": chat_id}
     except Exception as e:
         logger.error(f"Erro no registro do Telegram: {str(e)}")
         return JSONResponse(status_code=500, content={"erro": str(e)})
     
+async def receber_video_analise(video):
+    """
+    Recebe o vídeo enviado e cria o diretório para os frames com detecções.
+
+    O vídeo é copiado uma única vez para um caminho único, com o hash
+    calculado durante a cópia, e rejeitado com `UploadRejeitado` se for grande demais
+    ou não puder ser decodificado.
+
+    Returns:
+        tuple: (informações do vídeo recebido, diretório dos frames, identificador da análise)
+    """
+    # Criar diretórios necessários
+    os.makedirs("c:/temp/videos/output", exist_ok=True)
+
+    recebido = await receber_upload(video)
+
+    # Criar diretório para salvar os frames com detecções; o sufixo aleatório
+    # evita que análises simultâneas do mesmo vídeo compartilhem o diretório
+    identificador = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:8]}"
+    frames_dir = f"videos/frames/{identificador}_{os.path.splitext(os.path.basename(video.filename))[0]}"
+    os.makedirs(frames_dir, exist_ok=True)
+
+    return recebido, frames_dir, identificador
+
+
+def perfil_solicitado(request, perfilar):
+    """O perfil da análise é pedido pelo campo `perfilar` ou pelo cabeçalho X-Perfilar."""
+    return perfilar or request.headers.get("x-perfilar", "").lower() in ("1", "true", "sim")
+
+def formatar_evento_sse(evento):
+    """Formata um evento do processamento no padrão Server-Sent Events."""
+    return f"event: {evento['tipo']}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+async def enviar_alertas_analise(resposta, eventos, video_nome, alertar_telegram=False, chat_id_telegram=None,
+                                 alertar_email=False, destinatario_email=""):
+    """
+    Envia os alertas de uma análise concluída por e-mail e/ou Telegram e
+    registra o resultado dos envios na resposta.
+
+    Os alertas são enviados por evento (detecções agrupadas pelo rastreador),
+    com o melhor frame de cada um, e não por caixa detectada. Os alertas do
+    Telegram são enfileirados no `despachante_telegram` e entregues em segundo
+    plano, sem atrasar a resposta.
+    As chamadas HTTP bloqueantes rodam em threads para não travar o event loop.
+    """
+    objeto_detectado = len(eventos) > 0
+
+    # Enviar por e-mail um resumo com as miniaturas das ocorrências, se solicitado
+    if alertar_email and objeto_detectado:
+        try:
+            envio = await despachante_email.enviar_resumos(destinatario_email, video_nome, eventos)
+            if envio["enviados"] == envio["resumos"]:
+                resposta["alerta_email"] = f"Resumo enviado por e-mail ({envio['resumos']} mensagem(ns))."
+            else:
+                resposta["alerta_email"] = f"Falha ao enviar e-mail: {envio['enviados']} de {envio['resumos']} resumos enviados."
+        except Exception as e:
+            logger.error(f"Erro ao enviar e-mail: {str(e)}")
+            resposta["alerta_email"] = f"Falha ao enviar e-mail: {str(e)}"
+
+    if alertar_telegram and objeto_detectado:
+        # Para limitar a quantidade de alertas em vídeos com muitas detecções
+        max_alertas = 10  # Limite de alertas para não sobrecarregar o usuário
+
+        # Se houver muitos eventos, alertar os de maior confiança, na ordem do vídeo
+        eventos_selecionados = eventos_representativos(eventos, max_alertas)
+
+        for evento in eventos_selecionados:
+            # Gerar mensagem para este evento, com o seu melhor frame
+            mensagem = gerar_mensagem_padrao(
+                video_nome=video_nome,
+                objeto_detectado=True,
+                confianca=evento["confianca_maxima"],
+                frame_num=evento["melhor_frame"],
+                inicio=evento["inicio"],
+                fim=evento["fim"]
+            )
+            await despachante_telegram.enfileirar(chat_id_telegram, mensagem, foto_path=evento.get("frame_path"))
+
+        # Se houver mais eventos do que o limite, enviar um alerta resumido
+        if len(eventos) > max_alertas:
+            mensagem_resumo = (
+                f"<b>⚠️ RESUMO DE ALERTAS</b>: Foram detectadas {len(eventos)} ocorrências de objetos cortantes "
+                f"no vídeo <code>{video_nome}</code>. Mostrando as {max_alertas} de maior confiança."
+            )
+            await despachante_telegram.enfileirar(chat_id_telegram, mensagem_resumo)
+
+        # Adicionar resumo à resposta
+        resposta["alerta_telegram"] = f"{len(eventos_selecionados)} alertas enfileirados para envio via Telegram."
+
+    elif alertar_telegram and not objeto_detectado:
+        # Enviar mensagem de que nenhum objeto foi detectado
+        mensagem = gerar_mensagem_padrao(video_nome, False)
+        await despachante_telegram.enfileirar(chat_id_telegram, mensagem)
+        resposta["alerta_telegram"] = "Mensagem de 'nenhuma detecção' enfileirada para envio via Telegram."
+
+    return resposta
+
 @app.post("/analisar-video")
 async def analisar_video(
+    request: Request,
     video: UploadFile,
     alertar_telegram: bool = Form(...),  # Adicionado parâmetro para enviar alerta via Telegram
     alertar_email: bool = Form(False),  # Parâmetro para enviar por e-mail
     usuario_telegram: str = Form(...),   # Nome de usuário do Telegram
     gerar_video: bool = Form(...),      # Se deve gerar vídeo processado
     limiar_confianca: float = Form(0.25), # Limiar de confiança para a detecção
-    destinatario_email: str = Form(default="")  # Remetente do e-mail
+    destinatario_email: str = Form(default=""),  # Remetente do e-mail
+    tamanho_lote: int = Form(default=None),  # Frames por chamada de inferência (opcional)
+    analisar_a_cada: int = Form(default=1),  # Inferir apenas um a cada N frames
+    filtro_movimento: bool = Form(default=False),  # Ignorar frames sem movimento
+    segmentos: int = Form(default=1),  # Segmentos do vídeo processados em paralelo
+    assincrono: bool = Form(default=False),  # Retornar o id do job sem aguardar a análise
+    usar_cache: bool = Form(default=CACHE_RESULTADOS_ATIVO),  # Reaproveitar detecções do mesmo vídeo e modelo
+    backend: str = Form(default=None),  # Backend de inferência: torch, onnxruntime ou openvino
+    int8: bool = Form(default=None),  # Usar o modelo exportado quantizado em INT8
+    resolucao: str = Form(default=None),  # Resolução de inferência: 320, 480, 640 ou auto
+    modo_video: str = Form(default="completo"),  # Vídeo gerado: completo ou clipes (apenas os eventos)
+    video_destaques: bool = Form(default=True),  # No modo clipes, gerar também um vídeo com todos os clipes
+    perfilar: bool = Form(default=False),  # Gravar o perfil da análise (consultado em /perfis/{perfil_id})
+    memoria_limitada: bool = Form(default=MEMORIA_LIMITADA)  # Memória constante em vídeos muito longos
 ):
 
     try:
+        try:
+            backend, int8 = normalizar_backend(backend, int8, MODELO_PATH)
+            escolher_resolucao(resolucao)
+            if modo_video not in MODOS_VIDEO:
+                raise ValueError(f"Modo de vídeo inválido: {modo_video} (opções: {', '.join(MODOS_VIDEO)})")
+            if memoria_limitada and segmentos > 1:
+                raise ValueError("O modo de memória limitada processa o vídeo em um único segmento")
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"mensagem": str(e)})
 
+        chat_id_telegram = None
         if alertar_telegram:
-            # Buscar o chat_id do usuário no arquivo JSON
-            try:
-                with open("usuarios_telegram.json", "r") as file:
-                    usuarios = json.load(file)
-                chat_id_telegram = usuarios.get(usuario_telegram)
-            except (FileNotFoundError, json.JSONDecodeError):
-                return JSONResponse(status_code=400, content={"mensagem": "Usuário não registrado. Registre-se primeiro no bot."})
-
+            # Buscar o chat_id do usuário no registro
+            chat_id_telegram = registro_telegram.obter_chat_id(usuario_telegram)
             if not chat_id_telegram:
                 return JSONResponse(status_code=400, content={"mensagem": "Usuário não registrado. Registre-se primeiro no bot."})
 
-        # Criar diretórios necessários
-        os.makedirs("videos/input", exist_ok=True)
-        os.makedirs("c:/temp/videos/output", exist_ok=True)
-        
-        # Criar diretório para salvar os frames com detecções
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        frames_dir = f"videos/frames/{timestamp}_{video.filename.split('.')[0]}"
-        os.makedirs(frames_dir, exist_ok=True)
-
-        # Salvar o vídeo recebido
-        input_path = f"videos/input/{video.filename}"
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(video.file, buffer)
-
-        output_path = f"c:/temp/videos/output/processado_{timestamp}_{video.filename}" if gerar_video else None
-
-        # Processar o vídeo e detectar objetos cortantes
-        video_processado, deteccoes = processar_video(
-            modelo_path=MODELO_PATH, 
-            input_path=input_path, 
-            output_path=output_path,
-            limiar_confianca=limiar_confianca,
-            salvar_frames=True,
-            frames_dir=frames_dir
-        )
+        try:
+            recebido, frames_dir, identificador = await receber_video_analise(video)
+        except UploadRejeitado as e:
+            return JSONResponse(status_code=e.status_code, content={"mensagem": str(e)})
 
-        # Verificar se algum objeto foi detectado
-        objeto_detectado = len(deteccoes) > 0
-        
-        resposta = {
-            "objeto_detectado": objeto_detectado,
-            "total_deteccoes": len(deteccoes)
-        }
+        video_nome = os.path.basename(video.filename)
+        output_path = f"c:/temp/videos/output/processado_{identificador}_{video_nome}" if gerar_video else None
+        perfil_id = identificador if perfil_solicitado(request, perfilar) else None
 
-        # Enviar alertas via Telegram para cada detecção
-        alertas_enviados = 0
-        falhas_envio = 0
-
-        # Enviar e-mail com os frames detectados, se solicitado
-        if alertar_email and objeto_detectado:
-            for deteccao in deteccoes:
-                frame_path = deteccao.get("frame_path")
-                
-                # Converter o frame para base64
-                with open(frame_path, "rb") as img_file:
-                    imagem_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    imagem_base64 = f"data:image/png;base64,{imagem_base64}" 
-
-                # Montar o payload para o envio via API Lambda
-                payload = {
-                    "email": destinatario_email,
-                    "mensagem": "Olá, segue em anexo uma imagem registrada por nossos sistemas de vigilância.",
-                    "imagemBase64": imagem_base64
-                }
-
-                # Enviar o e-mail via Lambda API
-                response = requests.post(URL_LAMBDA, json=payload)
-
-                # Adicionar um tempo de espera de 3 segundos antes de continuar
-                time.sleep(3)
-
-                # Verificar o sucesso do envio
-                if response.status_code == 200:
-                    resposta["alerta_email"] = f"E-mail enviado com sucesso com os frames detectados."
-                else:
-                    resposta["alerta_email"] = f"Falha ao enviar e-mail. Status: {response.status_code}"
+        # No modo "auto", reduzir a resolução quando há análises aguardando na fila
+        metadados = recebido["metadados"]
+        resolucao = escolher_resolucao(resolucao, metadados["largura"], metadados["altura"],
+                                       gerenciador_analises.profundidade_fila())
 
-        
-        if alertar_telegram and objeto_detectado:
-            # Para limitar a quantidade de alertas em vídeos com muitas detecções
-            max_alertas = 10  # Limite de alertas para não sobrecarregar o usuário
-            
-            # Se houver muitas detecções, escolher frames mais espaçados
-            if len(deteccoes) > max_alertas:
-                # Selecionar detecções distribuídas uniformemente
-                indices = [int(i * len(deteccoes) / max_alertas) for i in range(max_alertas)]
-                deteccoes_selecionadas = [deteccoes[i] for i in indices]
-            else:
-                deteccoes_selecionadas = deteccoes
-            
-            for idx, deteccao in enumerate(deteccoes_selecionadas):
-                frame_num = deteccao.get("frame_num")
-                confianca = deteccao.get("confianca")
-                frame_path = deteccao.get("frame_path")
-                
-                # Gerar mensagem para esta detecção específica
-                mensagem = gerar_mensagem_padrao(
-                    video_nome=video.filename,
-                    objeto_detectado=True,
-                    confianca=confianca,
-                    frame_num=frame_num
-                )
-                
-                # Enviar alerta com o frame capturado
-                sucesso = enviar_alerta_telegram(
-                    chat_id=chat_id_telegram,
-                    token=TOKEN_TELEGRAM,
-                    mensagem=mensagem,
-                    foto_path=frame_path
-                )
-                
-                if sucesso:
-                    alertas_enviados += 1
-                else:
-                    falhas_envio += 1
-                
-                # Aguardar um pouco entre os envios para evitar limitação de taxa
-                if idx < len(deteccoes_selecionadas) - 1:
-                    await asyncio.sleep(1)
-            
-            # Se houver mais detecções do que o limite, enviar um alerta resumido
-            if len(deteccoes) > max_alertas:
-                mensagem_resumo = (
-                    f"<b>⚠️ RESUMO DE ALERTAS</b>: Foram detectados um total de {len(deteccoes)} objetos cortantes "
-                    f"no vídeo <code>{video.filename}</code>. Mostrando {max_alertas} detecções representativas."
-                )
-                enviar_alerta_telegram(
-                    chat_id=chat_id_telegram,
-                    token=TOKEN_TELEGRAM,
-                    mensagem=mensagem_resumo
-                )
-            
-            # Adicionar resumo à resposta
-            resposta["alerta_telegram"] = f"{alertas_enviados} de {len(deteccoes_selecionadas)} alertas enviados com sucesso via Telegram."
-            if falhas_envio > 0:
-                resposta["falhas_telegram"] = f"{falhas_envio} alertas falharam ao enviar."
-                
-        elif alertar_telegram and not objeto_detectado:
-            # Enviar mensagem de que nenhum objeto foi detectado
-            mensagem = gerar_mensagem_padrao(video.filename, False)
-            sucesso = enviar_alerta_telegram(
-                chat_id=chat_id_telegram, 
-                token=TOKEN_TELEGRAM, 
-                mensagem=mensagem
+        async def finalizar(job, resultado):
+            eventos = resultado["eventos"]
+            if "cache" in resultado["estatisticas"]:
+                cache_resultados.registrar_consulta(resultado["estatisticas"]["cache"]["acerto"])
+            # Histogramas das etapas medidos no worker
+            metricas.registrar_processamento(resultado["estatisticas"].pop("metricas", None))
+
+            # Verificar se algum objeto foi detectado
+            objeto_detectado = len(eventos) > 0
+
+            resposta = {
+                "objeto_detectado": objeto_detectado,
+                "total_deteccoes": resultado["total_deteccoes"],
+                "total_eventos": len(eventos),
+                "eventos": eventos,
+                "resolucao_inferencia": resultado["estatisticas"].get("resolucao_inferencia"),
+                "ms_inferencia_por_frame": resultado["estatisticas"].get("ms_inferencia_por_frame"),
+                "estatisticas": resultado["estatisticas"]
+            }
+
+            await enviar_alertas_analise(
+                resposta, eventos, video_nome,
+                alertar_telegram=alertar_telegram,
+                chat_id_telegram=chat_id_telegram,
+                alertar_email=alertar_email,
+                destinatario_email=destinatario_email
             )
-            
-            if sucesso:
-                resposta["alerta_telegram"] = "Mensagem de 'nenhuma detecção' enviada com sucesso."
-            else:
-                resposta["alerta_telegram"] = "Falha ao enviar mensagem via Telegram."
 
-        if gerar_video and video_processado:
-            resposta["video_processado"] = video_processado
+            if gerar_video and resultado["video_processado"]:
+                resposta["video_processado"] = resultado["video_processado"]
+            if gerar_video and "clipes" in resultado:
+                resposta["clipes"] = resultado["clipes"]
+            if perfil_id:
+                resposta["perfil_id"] = perfil_id
+            if resultado.get("deteccoes_path"):
+                resposta["deteccoes_path"] = resultado["deteccoes_path"]
 
-        return resposta
+            return resposta
+
+        # Processar o vídeo e detectar objetos cortantes em um worker
+        job = gerenciador_analises.submeter(
+            executar_analise,
+            parametros={"video": video_nome, "limiar_confianca": limiar_confianca, "gerar_video": gerar_video,
+                        "backend": backend, "int8": int8, "resolucao": resolucao, "modo_video": modo_video,
+                        "metadados": metadados, "perfil_id": perfil_id, "memoria_limitada": memoria_limitada},
+            finalizar=finalizar,
+            modelo_path=MODELO_PATH,
+            input_path=recebido["caminho"],
+            output_path=output_path,
+            frames_dir=frames_dir,
+            limiar_confianca=limiar_confianca,
+            tamanho_lote=tamanho_lote,
+            analisar_a_cada=analisar_a_cada,
+            filtro_movimento=filtro_movimento,
+            segmentos=segmentos,
+            usar_cache=usar_cache,
+            hash_conteudo=recebido["hash"],
+            backend=backend,
+            int8=int8,
+            resolucao=resolucao,
+            modo_video=modo_video,
+            video_destaques=video_destaques,
+            perfil_id=perfil_id,
+            memoria_limitada=memoria_limitada
+        )
+
+        if assincrono:
+            return JSONResponse(status_code=202, content=job.resumo())
+
+        await gerenciador_analises.aguardar(job)
+        if job.status != CONCLUIDO:
+            return JSONResponse(status_code=500, content={"erro": job.erro or f"Análise {job.status}", "job_id": job.id})
+
+        return job.resultado
     except Exception as e:
         import traceback
         stack_trace = traceback.format_exc()
@@ -306,21 +460,383 @@ async def analisar_video(
             status_code=500, 
             content={"erro": str(e), "detalhes": stack_trace}
         )
-    
+
+@app.get("/jobs")
+def listar_jobs():
+    """Lista os jobs de análise recentes, sem os resultados."""
+    return {
+        "jobs": [job.resumo(incluir_resultado=False) for job in gerenciador_analises.listar()],
+        "fila": gerenciador_analises.profundidade_fila(),
+        "em_execucao": gerenciador_analises.em_execucao()
+    }
+
+@app.get("/jobs/{job_id}")
+def consultar_job(job_id: str):
+    """Retorna o status, o progresso e, se concluído, o resultado de um job."""
+    job = gerenciador_analises.obter(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Job não encontrado."})
+    return job.resumo()
+
+@app.delete("/jobs/{job_id}")
+def cancelar_job(job_id: str):
+    """Cancela um job pendente ou em execução."""
+    job = gerenciador_analises.obter(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Job não encontrado."})
+    if not gerenciador_analises.cancelar(job_id):
+        return JSONResponse(status_code=409, content={"mensagem": f"Job já finalizado com status {job.status}."})
+    return job.resumo(incluir_resultado=False)
+
+@app.post("/analisar-video/stream")
+async def analisar_video_stream(
+    request: Request,
+    video: UploadFile,
+    gerar_video: bool = Form(False),        # Se deve gerar vídeo processado
+    limiar_confianca: float = Form(0.25),   # Limiar de confiança para a detecção
+    tamanho_lote: int = Form(default=None), # Frames por chamada de inferência (opcional)
+    analisar_a_cada: int = Form(default=1), # Inferir apenas um a cada N frames
+    filtro_movimento: bool = Form(default=False),  # Ignorar frames sem movimento
+    intervalo_progresso: int = Form(default=30),   # Frames entre eventos de progresso
+    backend: str = Form(default=None),      # Backend de inferência: torch, onnxruntime ou openvino
+    int8: bool = Form(default=None),        # Usar o modelo exportado quantizado em INT8
+    resolucao: str = Form(default=None),    # Resolução de inferência: 320, 480, 640 ou auto
+    perfilar: bool = Form(default=False),   # Gravar o perfil da análise (consultado em /perfis/{perfil_id})
+    memoria_limitada: bool = Form(default=MEMORIA_LIMITADA)  # Memória constante em vídeos muito longos
+):
+    """
+    Analisa o vídeo enviando os resultados em tempo real via Server-Sent Events.
+
+    Eventos enviados: 'inicio', 'progresso' (frames processados, percentual e
+    frames por segundo), 'frame' (apenas frames com detecções, com as caixas),
+    'fim' (resumo e estatísticas) ou 'erro'. Com perfil, o id vem no
+    cabeçalho X-Perfil-Id da resposta.
+    """
+    try:
+        backend, int8 = normalizar_backend(backend, int8, MODELO_PATH)
+        escolher_resolucao(resolucao)
+        recebido, frames_dir, identificador = await receber_video_analise(video)
+        resolucao = escolher_resolucao(resolucao, recebido["metadados"]["largura"], recebido["metadados"]["altura"],
+                                       gerenciador_analises.profundidade_fila())
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"mensagem": str(e)})
+    except UploadRejeitado as e:
+        return JSONResponse(status_code=e.status_code, content={"mensagem": str(e)})
+    except Exception as e:
+        logger.error(f"Erro ao salvar o vídeo: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+    input_path = recebido["caminho"]
+    output_path = f"c:/temp/videos/output/processado_{identificador}_{os.path.basename(video.filename)}" if gerar_video else None
+    perfil_id = identificador if perfil_solicitado(request, perfilar) else None
+
+    def eventos():
+        captura = CapturaPerfil(perfil_id, {'video': os.path.basename(video.filename), 'tamanho_lote': tamanho_lote,
+                                            'stream': True}) if perfil_id else nullcontext()
+        try:
+            with captura:
+                for evento in processar_video_stream(
+                    MODELO_PATH,
+                    input_path,
+                    intervalo_progresso=intervalo_progresso,
+                    output_path=output_path,
+                    limiar_confianca=limiar_confianca,
+                    salvar_frames=True,
+                    frames_dir=frames_dir,
+                    tamanho_lote=tamanho_lote,
+                    analisar_a_cada=analisar_a_cada,
+                    filtro_movimento=filtro_movimento,
+                    backend=backend,
+                    int8=int8,
+                    resolucao=resolucao,
+                    linha_tempo=bool(perfil_id),
+                    memoria_limitada=memoria_limitada
+                ):
+                    # Frames sem detecções são resumidos pelos eventos de progresso
+                    if evento['tipo'] == 'frame' and not evento['total_deteccoes']:
+                        continue
+                    if evento['tipo'] == 'fim':
+                        metricas.registrar_processamento(evento['estatisticas'].pop('metricas', None), origem='stream')
+                        if perfil_id:
+                            captura.linha_tempo = evento['estatisticas'].pop('linha_tempo', None)
+                    yield formatar_evento_sse(evento)
+        except Exception as e:
+            logger.error(f"Erro ao analisar vídeo (stream): {str(e)}")
+            yield formatar_evento_sse({'tipo': 'erro', 'erro': str(e)})
+
+    cabecalhos = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if perfil_id:
+        cabecalhos["X-Perfil-Id"] = perfil_id
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers=cabecalhos
+    )
+
+def obter_processador_transmissoes(loop):
+    """
+    Cria o processador de transmissões na primeira chamada. Os alertas são
+    entregues pelo despachante do Telegram, no loop de eventos da API, com os
+    mesmos limites de envio e métricas dos alertas das análises.
+    """
+    global processador_transmissoes
+    if processador_transmissoes is None:
+        processador_transmissoes = ProcessadorTransmissoes(resolver_modelo(MODELO_PATH),
+                                                           despachante=despachante_telegram, loop=loop)
+    return processador_transmissoes
+
+@app.post("/transmissoes")
+async def adicionar_transmissao(
+    url: str = Form(...),  # URL RTSP/HTTP, índice da webcam ou caminho de um vídeo no servidor
+    nome: str = Form(default=None),  # Nome exibido nos alertas
+    usuario_telegram: str = Form(default=None),  # Usuário que recebe os alertas (opcional)
+    limiar_confianca: float = Form(0.25),  # Limiar de confiança para a detecção
+    tempo_real: bool = Form(default=None),  # Ler no ritmo do FPS (padrão: apenas para arquivos)
+    repetir: bool = Form(default=False)  # Recomeçar o vídeo local ao chegar ao fim
+):
+    """
+    Inicia o processamento contínuo de uma transmissão ao vivo. Os eventos
+    detectados geram alertas no Telegram enquanto a transmissão acontece.
+    """
+    try:
+        chat_id_telegram = None
+        if usuario_telegram:
+            chat_id_telegram = registro_telegram.obter_chat_id(usuario_telegram)
+            if not chat_id_telegram:
+                return JSONResponse(status_code=400, content={"mensagem": "Usuário não registrado. Registre-se primeiro no bot."})
+
+        processador = obter_processador_transmissoes(asyncio.get_running_loop())
+        # A primeira transmissão carrega e aquece o modelo
+        fonte = await asyncio.to_thread(
+            processador.adicionar, url, nome=nome, chat_id=chat_id_telegram, limiar_confianca=limiar_confianca,
+            tempo_real=tempo_real, repetir=repetir
+        )
+        return JSONResponse(status_code=201, content=fonte.resumo())
+    except Exception as e:
+        logger.error(f"Erro ao iniciar a transmissão: {str(e)}")
+        return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.get("/transmissoes")
+def listar_transmissoes():
+    """Retorna as transmissões com os frames processados e descartados, as latências e os eventos."""
+    if processador_transmissoes is None:
+        return {"transmissoes": []}
+    return processador_transmissoes.estatisticas()
+
+@app.get("/transmissoes/{fonte_id}")
+def consultar_transmissao(fonte_id: str):
+    fonte = processador_transmissoes.obter(fonte_id) if processador_transmissoes is not None else None
+    if fonte is None:
+        return JSONResponse(status_code=404, content={"mensagem": f"Transmissão {fonte_id} não encontrada"})
+    return fonte.resumo()
+
+@app.delete("/transmissoes/{fonte_id}")
+async def encerrar_transmissao(fonte_id: str):
+    fonte = None
+    if processador_transmissoes is not None:
+        fonte = await asyncio.to_thread(processador_transmissoes.remover, fonte_id)
+    if fonte is None:
+        return JSONResponse(status_code=404, content={"mensagem": f"Transmissão {fonte_id} não encontrada"})
+    return fonte.resumo()
+
+@app.get("/cache")
+def consultar_cache():
+    """Retorna a ocupação do cache de resultados e os acertos e falhas desde o início da API."""
+    return cache_resultados.estatisticas()
+
+@app.get("/alertas/telegram")
+def consultar_alertas_telegram():
+    """
+    Retorna os alertas do Telegram enviados, com falha, retentados e aguardando
+    na fila, e o estado do registro de usuários.
+    """
+    return {**despachante_telegram.estatisticas(), 'registro': registro_telegram.estatisticas()}
+
+@metricas.registro.ao_coletar
+def coletar_metricas_estado():
+    metricas.JOBS_NA_FILA.definir(gerenciador_analises.profundidade_fila(), tipo=gerenciador_analises.nome)
+    metricas.JOBS_EM_EXECUCAO.definir(gerenciador_analises.em_execucao(), tipo=gerenciador_analises.nome)
+    metricas.JOBS_NA_FILA.definir(gerenciador_treinamentos.profundidade_fila(), tipo=gerenciador_treinamentos.nome)
+    metricas.JOBS_EM_EXECUCAO.definir(gerenciador_treinamentos.em_execucao(), tipo=gerenciador_treinamentos.nome)
+    metricas.ALERTAS_NA_FILA.definir(despachante_telegram.estatisticas()['na_fila'], canal='telegram')
+    metricas.TRANSMISSOES_ATIVAS.definir(
+        len(processador_transmissoes.fontes) if processador_transmissoes is not None else 0)
+
+@app.get("/metrics")
+def exportar_metricas():
+    """
+    Métricas da API no formato de texto do Prometheus: histogramas de duração
+    por etapa do processamento, dos alertas e dos jobs, contadores de frames,
+    detecções e alertas, e o tamanho atual das filas.
+    """
+    return PlainTextResponse(metricas.registro.gerar_texto(), media_type="text/plain; version=0.0.4")
+
+@app.get("/perfis/{perfil_id}")
+def consultar_perfil(perfil_id: str, formato: str = "json"):
+    """
+    Retorna o perfil de uma análise pedida com `perfilar`: em JSON (funções
+    mais amostradas e linha do tempo dos estágios por lote de frames) ou em
+    pilhas "folded" para gerar o flamegraph (flamegraph.pl, speedscope).
+    """
+    try:
+        conteudo = carregar_perfil(perfil_id, formato)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"mensagem": str(e)})
+    if conteudo is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Perfil não encontrado. Ele é gravado ao fim da análise."})
+    if formato == "folded":
+        return PlainTextResponse(conteudo)
+    return Response(conteudo, media_type="application/json")
+
+@app.get("/modelos")
+def listar_modelos():
+    """Retorna os modelos carregados no processo e seus tempos de carga e aquecimento."""
+    return estatisticas_modelos()
+
+def submeter_treinamento(dataset_path, nome, epochs, exportar, int8, imgsz=640, batch=16, continuar=False,
+                         retomar=False):
+    """Submete um treinamento ao gerenciador de treinamentos."""
+    async def finalizar(job, resultado):
+        if resultado.get("modelo_salvo_em"):
+            # Substituir no pool a versão antiga do modelo pela recém-treinada;
+            # a carga e o aquecimento rodam em uma thread, fora do event loop
+            await asyncio.to_thread(recarregar_modelo, resultado["modelo_salvo_em"])
+        return {"mensagem": "Treinamento concluído com sucesso.", **resultado}
+
+    return gerenciador_treinamentos.submeter(
+        executar_treinamento,
+        parametros={"dataset_path": dataset_path, "treinamento": nome, "epochs": epochs, "imgsz": imgsz,
+                    "batch": batch, "exportar": exportar, "int8": int8, "continuar": continuar, "retomar": retomar},
+        finalizar=finalizar,
+        dataset_path=dataset_path,
+        nome=nome,
+        epochs=epochs,
+        imgsz=imgsz,
+        batch=batch,
+        modelo_base=MODELO_PATH if continuar else None,
+        continuar=continuar,
+        retomar=retomar,
+        modelo_destino=MODELO_PATH,
+        exportar=exportar,
+        int8=int8
+    )
+
 @app.post("/treinar-modelo")
 def treinar_modelo_api(
      dataset_path: str = Form(...),
-     epochs: int = Form(default=80)
+     epochs: int = Form(default=80),
+     exportar: str = Form(default=""),  # Formatos separados por vírgula: onnx, openvino
+     int8: bool = Form(default=False),  # Quantizar os modelos exportados em INT8
+     imgsz: int = Form(default=640),    # Tamanho das imagens de treinamento
+     batch: int = Form(default=16),     # Imagens por lote
+     continuar: bool = Form(default=False)  # Continuar o treinamento do modelo atual em vez do yolov8n.pt
  ):
+     """
+     Inicia o treinamento em segundo plano e retorna o job (202). As métricas de
+     cada época são acompanhadas em /treinamentos/{job_id}/eventos; o modelo
+     treinado substitui o modelo atual ao final.
+     """
      try:
-         config_path = criar_config_yaml(dataset_path)
-         resultados = treinar_modelo(config_path, epochs=epochs)
- 
-         modelo_treinado_path = os.path.join("runs", "detect", "objeto_cortante_detector", "weights", "best.pt")
-         if os.path.exists(modelo_treinado_path):
-             os.makedirs("models", exist_ok=True)
-             shutil.copy(modelo_treinado_path, MODELO_PATH)
- 
-         return {"mensagem": "Treinamento concluído com sucesso.", "modelo_salvo_em": MODELO_PATH}
+         formatos = [f.strip().lower() for f in exportar.split(",") if f.strip()]
+         invalidos = [f for f in formatos if f not in FORMATOS_EXPORTACAO]
+         if invalidos:
+             return JSONResponse(status_code=400, content={"mensagem": f"Formatos de exportação inválidos: {', '.join(invalidos)}"})
+         try:
+             for formato in formatos:
+                 verificar_dependencias(formato, int8)
+         except BackendIndisponivel as e:
+             return JSONResponse(status_code=400, content={"mensagem": str(e)})
+         if continuar and not (MODELO_PATH and os.path.exists(MODELO_PATH)):
+             return JSONResponse(status_code=400, content={"mensagem": "Não há modelo atual para continuar o treinamento."})
+
+         # Verificar o dataset antes de enfileirar o treinamento; o índice dos
+         # rótulos é reaproveitado pelo worker
+         resumo_dataset = indexar_dataset(dataset_path)
+         problemas = verificar_dataset(resumo_dataset)
+         if problemas:
+             return JSONResponse(status_code=400, content={"mensagem": "Dataset inválido para o treinamento.",
+                                                           "problemas": problemas, "dataset": resumo_dataset})
+
+         nome = f"treino_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:8]}"
+         job = submeter_treinamento(dataset_path, nome, epochs, formatos, int8, imgsz, batch, continuar=continuar)
+         return JSONResponse(status_code=202, content={**job.resumo(), "treinamento": nome,
+                                                       "fila": gerenciador_treinamentos.profundidade_fila()})
      except Exception as e:
-         return JSONResponse(status_code=500, content={"erro": str(e)})
\ No newline at end of file
+         return JSONResponse(status_code=500, content={"erro": str(e)})
+
+@app.get("/treinamentos")
+def listar_treinamentos():
+    """Lista os treinamentos recentes, sem os resultados."""
+    return {
+        "treinamentos": [job.resumo(incluir_resultado=False) for job in gerenciador_treinamentos.listar()],
+        "fila": gerenciador_treinamentos.profundidade_fila(),
+        "em_execucao": gerenciador_treinamentos.em_execucao(),
+        "limite_simultaneos": gerenciador_treinamentos.max_workers
+    }
+
+@app.get("/treinamentos/{job_id}")
+def consultar_treinamento(job_id: str):
+    """Retorna o status, as métricas de cada época e, se concluído, o resultado de um treinamento."""
+    job = gerenciador_treinamentos.obter(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Treinamento não encontrado."})
+    return {**job.resumo(), "treinamento": job.parametros["treinamento"],
+            "epocas": [evento for evento in job.eventos if evento.get("tipo") == "epoca"]}
+
+@app.get("/treinamentos/{job_id}/eventos")
+def acompanhar_treinamento(job_id: str):
+    """
+    Acompanha um treinamento via Server-Sent Events: 'inicio', um evento
+    'epoca' por época (perdas, mAP, precisão, recall e tempo da época, desde a
+    primeira) e 'fim' com o status e o resultado.
+    """
+    job = gerenciador_treinamentos.obter(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Treinamento não encontrado."})
+
+    async def eventos():
+        async for evento in gerenciador_treinamentos.acompanhar(job, intervalo=1.0):
+            yield formatar_evento_sse(evento)
+        yield formatar_evento_sse({**job.resumo(), "tipo": "fim"})
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/treinamentos/{job_id}")
+def cancelar_treinamento(job_id: str):
+    """Cancela um treinamento; em execução, ele para ao fim do lote atual e pode ser retomado."""
+    job = gerenciador_treinamentos.obter(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"mensagem": "Treinamento não encontrado."})
+    if not gerenciador_treinamentos.cancelar(job_id):
+        return JSONResponse(status_code=409, content={"mensagem": f"Treinamento já finalizado com status {job.status}."})
+    return job.resumo(incluir_resultado=False)
+
+@app.post("/treinamentos/{nome}/retomar")
+def retomar_treinamento(nome: str, dataset_path: str = Form(default=None)):
+    """
+    Retoma um treinamento cancelado ou interrompido (inclusive por um
+    reinício da API) a partir da última época salva. `nome` é o nome do
+    treinamento ou o id do job que o executou.
+    """
+    job_anterior = gerenciador_treinamentos.obter(nome)
+    if job_anterior is not None:
+        if not job_anterior.finalizado:
+            return JSONResponse(status_code=409, content={"mensagem": "O treinamento ainda está em execução."})
+        nome = job_anterior.parametros["treinamento"]
+        parametros = job_anterior.parametros
+    else:
+        parametros = {}
+    dataset_path = dataset_path or parametros.get("dataset_path")
+    try:
+        if not dataset_path:
+            raise ValueError("Informe o dataset_path do treinamento")
+        if not os.path.exists(os.path.join(caminho_treinamento(nome), "weights", "last.pt")):
+            return JSONResponse(status_code=404, content={"mensagem": f"Nenhuma época salva do treinamento {nome}."})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"mensagem": str(e)})
+
+    job = submeter_treinamento(dataset_path, nome, parametros.get("epochs"), parametros.get("exportar", []),
+                               parametros.get("int8", False), retomar=True)
+    return JSONResponse(status_code=202, content={**job.resumo(), "treinamento": nome,
+                                                  "fila": gerenciador_treinamentos.profundidade_fila()})
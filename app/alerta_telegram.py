@@ -1,9 +1,13 @@
 import requests
 import time
+import random
+import asyncio
 import logging
 import os
 from requests.exceptions import RequestException
 
+from app import metricas
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -12,6 +16,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# URL base da API do Telegram (pode apontar para um servidor local de testes)
+URL_API_TELEGRAM = os.environ.get('URL_API_TELEGRAM', 'https://api.telegram.org').rstrip('/')
+
+# Limites de envio do Telegram: cerca de 30 mensagens por segundo no total e
+# 1 mensagem por segundo por chat (com pequenas rajadas toleradas)
+TELEGRAM_MENSAGENS_POR_SEGUNDO = float(os.environ.get('TELEGRAM_MENSAGENS_POR_SEGUNDO', 30))
+TELEGRAM_MENSAGENS_POR_SEGUNDO_CHAT = float(os.environ.get('TELEGRAM_MENSAGENS_POR_SEGUNDO_CHAT', 1))
+TELEGRAM_RAJADA_CHAT = int(os.environ.get('TELEGRAM_RAJADA_CHAT', 3))
+
+# Envios simultâneos do despachante assíncrono (conexões mantidas no pool)
+TELEGRAM_ENVIOS_SIMULTANEOS = int(os.environ.get('TELEGRAM_ENVIOS_SIMULTANEOS', 4))
+
+# Alertas aguardando envio; acima disso, `enfileirar` aguarda espaço na fila
+TELEGRAM_CAPACIDADE_FILA = int(os.environ.get('TELEGRAM_CAPACIDADE_FILA', 1000))
+
 def enviar_alerta_telegram(chat_id, token, mensagem, foto_path=None, max_retries=3, delay=2):
     """
     Envia um alerta para o Telegram com retentativas em caso de falha.
@@ -35,7 +54,7 @@ def enviar_alerta_telegram(chat_id, token, mensagem, foto_path=None, max_retries
                 return False
             
             # Enviar a mensagem
-            url = f"https://api.telegram.org/bot{token}/sendMessage"
+            url = f"{URL_API_TELEGRAM}/bot{token}/sendMessage"
             parametros = {
                 'chat_id': chat_id,
                 'text': mensagem,
@@ -55,7 +74,7 @@ def enviar_alerta_telegram(chat_id, token, mensagem, foto_path=None, max_retries
             # Enviar a foto se houver
             if foto_path and os.path.exists(foto_path):
                 try:
-                    url = f"https://api.telegram.org/bot{token}/sendPhoto"
+                    url = f"{URL_API_TELEGRAM}/bot{token}/sendPhoto"
                     with open(foto_path, 'rb') as photo:
                         files = {'photo': photo}
                         parametros = {'chat_id': chat_id}
@@ -90,7 +109,11 @@ def enviar_alerta_telegram(chat_id, token, mensagem, foto_path=None, max_retries
             else:
                 return False
 
-def gerar_mensagem_padrao(video_nome, objeto_detectado, confianca=None, frame_num=None):
+def _formatar_tempo(segundos):
+    minutos, segundos = divmod(int(segundos), 60)
+    return f"{minutos:02d}:{segundos:02d}"
+
+def gerar_mensagem_padrao(video_nome, objeto_detectado, confianca=None, frame_num=None, inicio=None, fim=None):
     """
     Gera uma mensagem formatada para o alerta do Telegram.
     
@@ -99,6 +122,8 @@ def gerar_mensagem_padrao(video_nome, objeto_detectado, confianca=None, frame_nu
         objeto_detectado: Se foi detectado um objeto
         confianca: Percentual de confiança da detecção
         frame_num: Número do frame onde o objeto foi detectado
+        inicio: Instante (em segundos) em que o objeto apareceu no vídeo
+        fim: Instante (em segundos) em que o objeto deixou de ser detectado
     
     Returns:
         str: Mensagem formatada
@@ -106,6 +131,230 @@ def gerar_mensagem_padrao(video_nome, objeto_detectado, confianca=None, frame_nu
     if objeto_detectado:
         confianca_str = f" (Confiança: {confianca*100:.1f}%)" if confianca is not None else ""
         frame_str = f" - Frame #{frame_num}" if frame_num is not None else ""
-        return f"<b>⚠️ ALERTA</b>: Objeto cortante detectado!\n\nVídeo: <code>{video_nome}</code>{frame_str}{confianca_str}"
+        intervalo_str = ""
+        if inicio is not None:
+            intervalo_str = f"\nVisível de {_formatar_tempo(inicio)} a {_formatar_tempo(fim if fim is not None else inicio)}"
+        return (f"<b>⚠️ ALERTA</b>: Objeto cortante detectado!\n\nVídeo: <code>{video_nome}</code>{frame_str}{confianca_str}"
+                f"{intervalo_str}")
     else:
-        return f"✅ Sem objetos cortantes detectados no vídeo: <code>{video_nome}</code>"
\ No newline at end of file
+        return f"✅ Sem objetos cortantes detectados no vídeo: <code>{video_nome}</code>"
+
+class BaldeTokens:
+    """
+    Limitador de taxa por balde de tokens: permite rajadas de até `capacidade`
+    envios e, em seguida, `taxa` envios por segundo.
+    """
+
+    def __init__(self, taxa, capacidade=1):
+        self.taxa = float(taxa)
+        self.capacidade = float(max(1, capacidade))
+        self.tokens = self.capacidade
+        self.atualizado = time.monotonic()
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+
+    async def aguardar(self):
+        """Aguarda até haver um token disponível e o consome."""
+        while True:
+            self._reabastecer()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.taxa)
+
+    def bloquear(self, segundos):
+        """Esvazia o balde por `segundos` (ex.: após um `retry_after` do Telegram)."""
+        self._reabastecer()
+        self.tokens = min(self.tokens, 0) - segundos * self.taxa
+
+
+class DespachanteTelegram:
+    """
+    Envia alertas ao Telegram de forma assíncrona, sem bloquear as requisições
+    da API.
+
+    Os alertas entram em uma fila e são entregues em segundo plano por tarefas
+    que compartilham um cliente HTTP com pool de conexões. Os envios respeitam
+    um balde de tokens global e um por chat, e as falhas temporárias são
+    retentadas com espera exponencial com jitter, respeitando o `retry_after`
+    informado pelo Telegram nas respostas 429. Os alertas de um mesmo chat são
+    entregues na ordem em que foram enfileirados.
+    """
+
+    def __init__(self, token, url_base=None, max_tentativas=5, atraso_base=1.0, atraso_maximo=30.0,
+                 envios_simultaneos=None, capacidade_fila=None):
+        """
+        Args:
+            token: Token do bot do Telegram
+            url_base: URL base da API (padrão: URL_API_TELEGRAM)
+            max_tentativas: Número máximo de tentativas por requisição
+            atraso_base: Espera (em segundos) antes da primeira retentativa
+            atraso_maximo: Espera máxima entre tentativas
+            envios_simultaneos: Tarefas de envio (padrão: TELEGRAM_ENVIOS_SIMULTANEOS)
+            capacidade_fila: Alertas aguardando envio (padrão: TELEGRAM_CAPACIDADE_FILA)
+        """
+        self.token = token
+        self.url_base = (url_base or URL_API_TELEGRAM).rstrip('/')
+        self.max_tentativas = max_tentativas
+        self.atraso_base = atraso_base
+        self.atraso_maximo = atraso_maximo
+        self.envios_simultaneos = envios_simultaneos or TELEGRAM_ENVIOS_SIMULTANEOS
+        self.capacidade_fila = capacidade_fila or TELEGRAM_CAPACIDADE_FILA
+        self.balde_global = BaldeTokens(TELEGRAM_MENSAGENS_POR_SEGUNDO, capacidade=TELEGRAM_MENSAGENS_POR_SEGUNDO)
+        self.baldes_chat = {}
+        self.locks_chat = {}
+        self.cliente = None
+        self.fila = None
+        self.tarefas = []
+        self.contadores = {'enviados': 0, 'falhas': 0, 'retentativas': 0}
+
+    async def iniciar(self):
+        """Cria o cliente HTTP e as tarefas de envio (no event loop atual)."""
+        import httpx
+
+        if self.cliente is not None:
+            return
+        self.cliente = httpx.AsyncClient(
+            base_url=f"{self.url_base}/bot{self.token}",
+            timeout=httpx.Timeout(30.0, write=60.0),
+            limits=httpx.Limits(max_connections=self.envios_simultaneos,
+                                max_keepalive_connections=self.envios_simultaneos),
+        )
+        self.fila = asyncio.Queue(maxsize=self.capacidade_fila)
+        self.tarefas = [asyncio.create_task(self._processar_fila()) for _ in range(self.envios_simultaneos)]
+
+    async def encerrar(self, tempo_limite=10.0):
+        """
+        Aguarda (até `tempo_limite` segundos) a entrega dos alertas na fila e
+        libera as conexões.
+        """
+        if self.cliente is None:
+            return
+        try:
+            await asyncio.wait_for(self.fila.join(), tempo_limite)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.fila.qsize()} alertas do Telegram descartados no encerramento")
+        for tarefa in self.tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self.tarefas, return_exceptions=True)
+        await self.cliente.aclose()
+        self.cliente = None
+        self.tarefas = []
+
+    def estatisticas(self):
+        """Contadores de envio e alertas aguardando na fila."""
+        return dict(self.contadores, na_fila=self.fila.qsize() if self.fila else 0)
+
+    def _balde_chat(self, chat_id):
+        balde = self.baldes_chat.get(chat_id)
+        if balde is None:
+            balde = self.baldes_chat[chat_id] = BaldeTokens(TELEGRAM_MENSAGENS_POR_SEGUNDO_CHAT,
+                                                            capacidade=TELEGRAM_RAJADA_CHAT)
+        return balde
+
+    def _atraso_retentativa(self, tentativa):
+        # Espera exponencial com jitter completo
+        return random.uniform(0, min(self.atraso_maximo, self.atraso_base * 2 ** tentativa))
+
+    async def _requisitar(self, metodo, chat_id, dados, arquivos=None):
+        """
+        Executa um método da API com limitação de taxa e retentativas.
+
+        Returns:
+            bool: True se o Telegram confirmou o envio
+        """
+        balde_chat = self._balde_chat(chat_id)
+        for tentativa in range(self.max_tentativas):
+            await self.balde_global.aguardar()
+            await balde_chat.aguardar()
+            espera = None
+            try:
+                resposta = await self.cliente.post(f"/{metodo}", data=dados, files=arquivos)
+                corpo = resposta.json() if resposta.headers.get('content-type', '').startswith('application/json') else {}
+                if resposta.status_code == 200 and corpo.get('ok'):
+                    return True
+                if resposta.status_code == 429:
+                    # Limite excedido: aguardar o tempo indicado antes de qualquer
+                    # novo envio para o chat
+                    espera = float(corpo.get('parameters', {}).get('retry_after', 1))
+                    balde_chat.bloquear(espera)
+                elif resposta.status_code < 500:
+                    logger.error(f"Telegram recusou {metodo} para {chat_id}: {resposta.status_code} {corpo}")
+                    return False
+                logger.warning(f"Tentativa {tentativa+1}/{self.max_tentativas} de {metodo} falhou: "
+                               f"{resposta.status_code}")
+            except Exception as e:
+                logger.warning(f"Tentativa {tentativa+1}/{self.max_tentativas} de {metodo} falhou: {str(e)}")
+
+            if tentativa < self.max_tentativas - 1:
+                self.contadores['retentativas'] += 1
+                metricas.RETENTATIVAS_ALERTA.incrementar(canal='telegram')
+                await asyncio.sleep(espera if espera is not None else self._atraso_retentativa(tentativa))
+        logger.error(f"Falha ao executar {metodo} para {chat_id} após {self.max_tentativas} tentativas")
+        return False
+
+    async def enviar(self, chat_id, mensagem, foto_path=None):
+        """
+        Envia imediatamente um alerta (mensagem e, se houver, a foto).
+
+        Returns:
+            bool: True se a mensagem foi enviada; a falha no envio da foto não
+            invalida o alerta, como em `enviar_alerta_telegram`
+        """
+        if not chat_id:
+            logger.error("Chat ID inválido")
+            return False
+        inicio = time.perf_counter()
+        async with self.locks_chat.setdefault(chat_id, asyncio.Lock()):
+            sucesso = await self._requisitar('sendMessage', chat_id,
+                                             {'chat_id': chat_id, 'text': mensagem, 'parse_mode': 'HTML'})
+            if sucesso and foto_path:
+                if os.path.exists(foto_path):
+                    conteudo = await asyncio.to_thread(_ler_arquivo, foto_path)
+                    if not await self._requisitar('sendPhoto', chat_id, {'chat_id': chat_id},
+                                                  {'photo': (os.path.basename(foto_path), conteudo)}):
+                        logger.warning(f"Erro ao enviar foto: {foto_path}")
+                else:
+                    logger.warning(f"Arquivo de imagem não encontrado: {foto_path}")
+
+        self.contadores['enviados' if sucesso else 'falhas'] += 1
+        metricas.ALERTAS.incrementar(canal='telegram', resultado='enviado' if sucesso else 'falha')
+        metricas.DURACAO_ALERTA.observar(time.perf_counter() - inicio, canal='telegram')
+        if sucesso:
+            logger.info(f"Alerta enviado com sucesso para {chat_id}")
+        return sucesso
+
+    async def enfileirar(self, chat_id, mensagem, foto_path=None):
+        """
+        Coloca um alerta na fila de envio em segundo plano.
+
+        Returns:
+            asyncio.Future: Resolvida com o resultado de `enviar` após a entrega
+        """
+        if self.cliente is None:
+            await self.iniciar()
+        futuro = asyncio.get_running_loop().create_future()
+        await self.fila.put((chat_id, mensagem, foto_path, futuro))
+        return futuro
+
+    async def _processar_fila(self):
+        while True:
+            chat_id, mensagem, foto_path, futuro = await self.fila.get()
+            try:
+                sucesso = await self.enviar(chat_id, mensagem, foto_path)
+                if not futuro.done():
+                    futuro.set_result(sucesso)
+            except Exception as e:
+                logger.error(f"Erro inesperado ao enviar alerta: {str(e)}")
+                if not futuro.done():
+                    futuro.set_result(False)
+            finally:
+                self.fila.task_done()
+
+
+def _ler_arquivo(caminho):
+    with open(caminho, 'rb') as arquivo:
+        return arquivo.read()
@@ -0,0 +1,216 @@
+import os
+import time
+import logging
+from contextlib import nullcontext
+from app.detector import processar_video, renderizar_deteccoes, escolher_resolucao
+from app.modelos import obter_modelo, hash_arquivo
+from app.rastreamento import agrupar_eventos, agrupar_eventos_em_ordem
+from app.deteccoes import DeteccoesEmDisco
+from app.clipes import exportar_clipes
+from app.backends import resolver_modelo, normalizar_backend
+from app.perfis import CapturaPerfil
+from app.cache_resultados import CacheResultados, hash_video, chave_resultado, CONFIANCA_MINIMA_CACHE
+
+logger = logging.getLogger(__name__)
+
+# Modos do vídeo de saída: o vídeo inteiro anotado ou apenas clipes dos eventos
+MODOS_VIDEO = ('completo', 'clipes')
+
+
+def inicializar_worker(modelo_path, threads_por_worker=None):
+    """
+    Prepara um processo worker de análise: limita as threads do PyTorch para que
+    os workers não disputem os mesmos núcleos e carrega o modelo padrão no
+    backend de inferência padrão.
+
+    Args:
+        modelo_path: Caminho do modelo carregado e aquecido no worker
+        threads_por_worker: Threads de inferência por worker (padrão: núcleos
+            disponíveis divididos pela quantidade de workers)
+    """
+    if threads_por_worker:
+        try:
+            import torch
+            torch.set_num_threads(int(threads_por_worker))
+        except ImportError:
+            pass
+
+    if modelo_path and os.path.exists(modelo_path):
+        try:
+            obter_modelo(resolver_modelo(modelo_path), aquecer=True)
+        except Exception as e:
+            logger.error(f"Erro ao carregar o modelo no worker: {str(e)}")
+
+
+def _responder_do_cache(armazem, input_path, output_path, frames_dir, limiar_confianca, resolucao):
+    # Filtra as detecções em cache pelo limiar pedido e redesenha os frames
+    # (e o vídeo, se solicitado) sem executar o modelo
+    inicio = time.perf_counter()
+    armazem = armazem.filtrar_confianca(limiar_confianca)
+    if output_path or len(armazem):
+        renderizar_deteccoes(input_path, armazem, output_path=output_path, frames_dir=frames_dir)
+    return armazem.para_lista(), {
+        'frames_inferidos': 0,
+        'resolucao_inferencia': resolucao,
+        'ms_inferencia_por_frame': None,
+        'tempo_total': round(time.perf_counter() - inicio, 3),
+    }
+
+
+def _montar_resultado(input_path, video_processado, deteccoes, estatisticas, clipes_path=None, video_destaques=True):
+    # Agrupa as detecções em eventos e, no modo de clipes, grava os trechos
+    # dos eventos e o vídeo de destaques
+    em_disco = isinstance(deteccoes, DeteccoesEmDisco)
+    # As detecções em disco estão na ordem dos frames e são lidas em blocos
+    eventos = agrupar_eventos_em_ordem(deteccoes) if em_disco else agrupar_eventos(deteccoes)
+    resultado = {
+        'video_processado': video_processado,
+        'deteccoes': deteccoes,
+        'total_deteccoes': len(deteccoes),
+        'eventos': eventos,
+        'estatisticas': estatisticas,
+    }
+    if clipes_path:
+        inicio = time.perf_counter()
+        destaques_path = clipes_path if video_destaques else None
+        clipes = exportar_clipes(input_path, deteccoes, eventos, os.path.splitext(clipes_path)[0] + '_clipes',
+                                 destaques_path=destaques_path)
+        resultado['video_processado'] = destaques_path if clipes else None
+        resultado['clipes'] = clipes
+        estatisticas['tempo_clipes'] = round(time.perf_counter() - inicio, 3)
+    if em_disco:
+        # A lista completa não volta ao processo da API: apenas o diário
+        resultado['deteccoes'] = None
+        resultado['deteccoes_path'] = deteccoes.caminho
+    return resultado
+
+
+def executar_analise(modelo_path, input_path, output_path=None, frames_dir=None, limiar_confianca=0.25,
+                     tamanho_lote=None, analisar_a_cada=1, filtro_movimento=False, segmentos=1, usar_cache=False,
+                     hash_conteudo=None, backend=None, int8=None, resolucao=None, modo_video='completo',
+                     video_destaques=True, perfil_id=None, memoria_limitada=False, cancelar=None, progresso=None):
+    """
+    Executa a detecção de um vídeo dentro de um worker do gerenciador de jobs.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        input_path: Caminho para o vídeo de entrada
+        output_path: Caminho para salvar o vídeo processado (opcional)
+        frames_dir: Diretório para salvar os frames com detecções
+        limiar_confianca: Limiar de confiança para considerar uma detecção
+        tamanho_lote: Quantidade de frames enviados ao modelo por chamada
+        analisar_a_cada: Executa a inferência apenas em um a cada N frames
+        filtro_movimento: Se deve ignorar frames sem movimento
+        segmentos: Quantidade de segmentos processados em paralelo (1 processa
+            o vídeo inteiro neste worker)
+        usar_cache: Se deve consultar o cache de resultados (mesmo vídeo e
+            modelo) antes de inferir e guardar nele as detecções
+        hash_conteudo: SHA-256 do vídeo, se já calculado no recebimento
+        backend: Backend de inferência ('torch', 'onnxruntime' ou 'openvino')
+        int8: Se os backends exportados devem usar o modelo quantizado
+        resolucao: Lado maior da entrada do modelo (ex.: 320, 480, 640) ou
+            "auto" (padrão: resolução padrão do modelo)
+        modo_video: 'completo' grava em `output_path` o vídeo inteiro anotado;
+            'clipes' grava apenas trechos anotados em torno dos eventos (em
+            `<output_path sem extensão>_clipes/`)
+        video_destaques: No modo 'clipes', se deve gravar em `output_path` um
+            vídeo de destaques com todos os trechos em sequência
+        perfil_id: Se informado, grava sob esse id um perfil por amostragem
+            da análise e a linha do tempo dos estágios (ver `app.perfis`)
+        memoria_limitada: Processa o vídeo com memória limitada (ver
+            `processar_video`); as detecções ficam no diário em disco
+            (`deteccoes_path`) e o cache de resultados não é usado
+        cancelar: Event sinalizado quando o job é cancelado
+        progresso: Função que recebe os eventos de progresso
+
+    Returns:
+        dict: Caminho do vídeo processado, lista de detecções (None no modo
+        de memória limitada), total de detecções, eventos (as detecções
+        agrupadas pelo rastreador), clipes (no modo 'clipes') e estatísticas
+    """
+    # Sem perfil, nenhum custo: o amostrador e a linha do tempo nem são criados
+    captura = CapturaPerfil(perfil_id, {'video': os.path.basename(input_path), 'segmentos': segmentos,
+                                        'tamanho_lote': tamanho_lote}) if perfil_id else nullcontext()
+    with captura:
+        backend, int8 = normalizar_backend(backend, int8, modelo_path)
+        if modo_video not in MODOS_VIDEO:
+            raise ValueError(f"Modo de vídeo inválido: {modo_video} (opções: {', '.join(MODOS_VIDEO)})")
+        if memoria_limitada and segmentos and segmentos > 1:
+            raise ValueError("O modo de memória limitada processa o vídeo em um único segmento")
+        # No modo de clipes, o vídeo só é gravado depois, a partir dos eventos
+        clipes_path = output_path if modo_video == 'clipes' else None
+        if clipes_path:
+            output_path = None
+        if resolucao is not None and str(resolucao).lower() == 'auto':
+            # Sem a fila da API, o modo "auto" considera apenas o tamanho do vídeo
+            from app.ingestao import sondar_video
+            metadados = sondar_video(input_path) or {}
+            resolucao = escolher_resolucao(resolucao, metadados.get('largura'), metadados.get('altura'))
+        else:
+            resolucao = escolher_resolucao(resolucao)
+        cache = chave = None
+        # O cache guarda todas as detecções em memória; no modo de memória
+        # limitada elas ficam apenas no diário
+        if usar_cache and not memoria_limitada:
+            cache = CacheResultados()
+            chave = chave_resultado(hash_conteudo or hash_video(input_path), hash_arquivo(modelo_path),
+                                    analisar_a_cada=analisar_a_cada, filtro_movimento=filtro_movimento,
+                                    backend=backend, int8=int8, resolucao=resolucao)
+            armazem = cache.carregar(chave)
+            if armazem is not None and limiar_confianca >= CONFIANCA_MINIMA_CACHE:
+                deteccoes, estatisticas = _responder_do_cache(armazem, input_path, output_path, frames_dir,
+                                                              limiar_confianca, resolucao)
+                estatisticas['cache'] = {'acerto': True, 'chave': chave}
+                return _montar_resultado(input_path, output_path, deteccoes, estatisticas, clipes_path, video_destaques)
+
+        estatisticas = {}
+        processar = processar_video
+        opcoes = {}
+        if segmentos and segmentos > 1:
+            # Import tardio: o módulo de segmentos importa este módulo
+            from app.segmentos import processar_video_segmentado
+            processar = processar_video_segmentado
+            opcoes['num_segmentos'] = segmentos
+        else:
+            opcoes['memoria_limitada'] = bool(memoria_limitada)
+        if cache is not None:
+            # Armazenar as detecções a partir do menor limiar aceito, para que
+            # qualquer limiar maior seja atendido depois apenas pelo cache
+            opcoes['confianca_armazenada'] = CONFIANCA_MINIMA_CACHE
+            opcoes['exportar_deteccoes'] = cache.caminho_temporario(chave)
+
+        try:
+            video_processado, deteccoes = processar(
+                modelo_path=modelo_path,
+                input_path=input_path,
+                output_path=output_path,
+                limiar_confianca=limiar_confianca,
+                salvar_frames=True,
+                frames_dir=frames_dir,
+                tamanho_lote=tamanho_lote,
+                estatisticas=estatisticas,
+                analisar_a_cada=analisar_a_cada,
+                filtro_movimento=filtro_movimento,
+                cancelar=cancelar,
+                ao_progredir=progresso,
+                backend=backend,
+                int8=int8,
+                resolucao=resolucao,
+                linha_tempo=bool(perfil_id),
+                **opcoes
+            )
+            if perfil_id:
+                captura.linha_tempo = estatisticas.pop('linha_tempo', None)
+
+            if cache is not None:
+                try:
+                    cache.registrar(chave, opcoes['exportar_deteccoes'])
+                except OSError as e:
+                    logger.warning(f"Não foi possível gravar o resultado no cache: {str(e)}")
+                estatisticas['cache'] = {'acerto': False, 'chave': chave}
+        finally:
+            # Descartar a entrada incompleta de uma análise cancelada ou com erro
+            if cache is not None and os.path.exists(opcoes['exportar_deteccoes']):
+                os.remove(opcoes['exportar_deteccoes'])
+
+        return _montar_resultado(input_path, video_processado, deteccoes, estatisticas, clipes_path, video_destaques)
@@ -0,0 +1,218 @@
+import os
+import logging
+import importlib.util
+
+from app.trainer import caminho_exportado, exportar_modelo, exportacao_atualizada
+
+logger = logging.getLogger(__name__)
+
+# Backend de inferência -> formato de exportação do modelo (None: o próprio .pt)
+BACKENDS = {
+    'torch': None,
+    'onnxruntime': 'onnx',
+    'openvino': 'openvino',
+}
+
+# Backend usado quando a requisição não escolhe um
+BACKEND_PADRAO = os.environ.get('BACKEND_INFERENCIA', 'torch').lower()
+
+# Se os backends exportados devem usar o modelo quantizado em INT8 por padrão
+INT8_PADRAO = os.environ.get('INFERENCIA_INT8', '0').lower() in ('1', 'true', 'sim')
+
+# data.yaml do dataset usado para calibrar a quantização INT8 exportada sob demanda
+DATASET_CALIBRACAO = os.environ.get('DATASET_CALIBRACAO')
+
+# Pacotes opcionais exigidos por formato exportado (exportação e inferência),
+# e os adicionais da quantização INT8
+DEPENDENCIAS_FORMATO = {
+    'onnx': ('onnx', 'onnxslim', 'onnxruntime'),
+    'openvino': ('openvino',),
+}
+DEPENDENCIAS_INT8 = {
+    'onnx': (),
+    'openvino': ('nncf',),
+}
+
+
+class BackendIndisponivel(ValueError):
+    """Lançada quando falta um pacote opcional exigido pelo backend ou formato escolhido."""
+
+    def __init__(self, formato, pacote):
+        super().__init__(f"O formato {formato} requer o pacote '{pacote}', que não está instalado "
+                         f"(pip install {pacote}).")
+        self.formato = formato
+        self.pacote = pacote
+
+
+def verificar_dependencias(formato, int8=False):
+    """
+    Confere se os pacotes opcionais do formato exportado estão instalados.
+
+    Args:
+        formato: 'onnx' ou 'openvino' (None para o .pt, que não exige nada além do ultralytics)
+        int8: Se a quantização INT8 também será usada
+
+    Raises:
+        BackendIndisponivel: Com o nome do primeiro pacote ausente
+    """
+    if formato is None:
+        return
+    for pacote in DEPENDENCIAS_FORMATO[formato] + (DEPENDENCIAS_INT8[formato] if int8 else ()):
+        if importlib.util.find_spec(pacote) is None:
+            raise BackendIndisponivel(formato, pacote)
+
+
+def normalizar_backend(backend=None, int8=None, modelo_path=None):
+    """
+    Aplica os padrões e valida a escolha de backend.
+
+    Args:
+        backend: 'torch', 'onnxruntime' ou 'openvino' (padrão: BACKEND_INFERENCIA)
+        int8: Se deve usar o modelo quantizado (padrão: INFERENCIA_INT8)
+        modelo_path: Modelo .pt que será usado; com INT8 e sem
+            DATASET_CALIBRACAO, o modelo quantizado precisa já estar exportado
+
+    Returns:
+        tuple: (backend, int8); int8 é sempre False no backend torch
+
+    Raises:
+        ValueError: Backend inválido, INT8 sem modelo exportado nem
+            DATASET_CALIBRACAO, ou `BackendIndisponivel` se faltar um pacote
+            opcional do backend
+    """
+    backend = (backend or BACKEND_PADRAO).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de inferência inválido: {backend} (opções: {', '.join(BACKENDS)})")
+    if BACKENDS[backend] is None:
+        return backend, False
+    int8 = INT8_PADRAO if int8 is None else bool(int8)
+    verificar_dependencias(BACKENDS[backend], int8)
+    if int8 and not DATASET_CALIBRACAO:
+        # Sem data.yaml de calibração só é possível usar um INT8 já exportado
+        exportado = modelo_path and os.path.exists(modelo_path) and exportacao_atualizada(
+            caminho_exportado(modelo_path, BACKENDS[backend], True), modelo_path)
+        if not exportado:
+            raise ValueError(f"O modelo INT8 do backend {backend} não está exportado e a exportação sob demanda "
+                             f"requer DATASET_CALIBRACAO (data.yaml usado na calibração)")
+    return backend, int8
+
+
+def resolver_modelo(modelo_path, backend=None, int8=None, exportar=True):
+    """
+    Retorna o caminho do modelo a carregar para o backend escolhido. O
+    ultralytics carrega `.pt`, `.onnx` e diretórios OpenVINO com a mesma
+    interface, então as detecções chegam ao restante do pipeline no mesmo
+    formato, qualquer que seja o backend.
+
+    Args:
+        modelo_path: Caminho do modelo .pt treinado
+        backend: 'torch', 'onnxruntime' ou 'openvino' (padrão: BACKEND_INFERENCIA)
+        int8: Se deve usar o modelo quantizado (padrão: INFERENCIA_INT8);
+            ignorado no backend torch
+        exportar: Se deve exportar o modelo quando o arquivo do backend não
+            existir ou for mais antigo que o .pt
+
+    Returns:
+        str: Caminho do modelo para `obter_modelo`
+
+    Raises:
+        BackendIndisponivel: Se faltar um pacote opcional do backend
+    """
+    backend, int8 = normalizar_backend(backend, int8, modelo_path)
+    formato = BACKENDS[backend]
+    if formato is None:
+        return modelo_path
+
+    exportado = caminho_exportado(modelo_path, formato, int8)
+    if exportacao_atualizada(exportado, modelo_path):
+        return exportado
+    if not exportar:
+        raise FileNotFoundError(f"Modelo {backend} não exportado: {exportado}")
+
+    # A exportação é serializada entre os processos por um arquivo de lock;
+    # quem esperava reaproveita o modelo exportado pelo outro processo
+    logger.info(f"Exportando {modelo_path} para o backend {backend}{' (INT8)' if int8 else ''}")
+    try:
+        exportar_modelo(modelo_path, formato, int8=int8, config_path=DATASET_CALIBRACAO, se_desatualizado=True)
+    except ImportError as e:
+        # Pacote importado apenas durante a exportação (ex.: dependência do onnxslim)
+        raise BackendIndisponivel(formato, e.name or str(e)) from e
+    return exportado
+
+
+def comparar_backends(modelo_path, config_path, backends=None, int8=False, imgsz=640, video=None):
+    """
+    Compara a precisão (mAP no split de validação) e a velocidade de cada
+    backend com o modelo PyTorch original.
+
+    Args:
+        modelo_path: Caminho do modelo .pt treinado
+        config_path: data.yaml do dataset
+        backends: Backends a comparar (torch é sempre incluído como referência)
+        int8: Se deve comparar também os modelos quantizados em INT8
+        imgsz: Tamanho de entrada da validação
+        video: Vídeo opcional para medir também os frames por segundo de
+            `processar_video` com cada backend
+
+    Returns:
+        list: Um dicionário por backend com mAP50, mAP50-95, a variação do mAP
+        em relação ao torch, o tempo de inferência por imagem e a aceleração
+    """
+    from ultralytics import YOLO
+
+    backends = ['torch'] + [b for b in (backends or BACKENDS) if b != 'torch']
+    variantes = [(backend, False) for backend in backends]
+    if int8:
+        variantes += [(backend, True) for backend in backends if backend != 'torch']
+
+    referencia = None
+    comparacao = []
+    for backend, quantizado in variantes:
+        formato = BACKENDS[backend]
+        caminho = caminho_exportado(modelo_path, formato, quantizado) if formato else modelo_path
+        if formato and not exportacao_atualizada(caminho, modelo_path):
+            # Calibrar a quantização com o mesmo dataset usado na validação
+            exportar_modelo(modelo_path, formato, int8=quantizado, config_path=config_path, imgsz=imgsz)
+        metricas = YOLO(caminho, task='detect').val(data=config_path, imgsz=imgsz, batch=1, device='cpu',
+                                                    plots=False, verbose=False)
+        linha = {
+            'backend': backend,
+            'int8': quantizado,
+            'modelo': caminho,
+            'map50': round(float(metricas.box.map50), 4),
+            'map50_95': round(float(metricas.box.map), 4),
+            'ms_inferencia': round(float(metricas.speed['inference']), 2),
+        }
+        if video:
+            from app.detector import processar_video
+            estatisticas = {}
+            _, deteccoes = processar_video(modelo_path, video, estatisticas=estatisticas, backend=backend,
+                                           int8=quantizado, ao_progredir=lambda evento: None)
+            linha['fps_video'] = estatisticas['fps_processamento']
+            linha['deteccoes_video'] = len(deteccoes)
+
+        if referencia is None:
+            referencia = linha
+        linha['variacao_map50'] = round(linha['map50'] - referencia['map50'], 4)
+        linha['variacao_map50_95'] = round(linha['map50_95'] - referencia['map50_95'], 4)
+        linha['aceleracao'] = round(referencia['ms_inferencia'] / linha['ms_inferencia'], 2) \
+            if linha['ms_inferencia'] > 0 else None
+        comparacao.append(linha)
+    return comparacao
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compara precisão e velocidade dos backends de inferência.")
+    parser.add_argument("data", help="data.yaml do dataset (usa o split de validação)")
+    parser.add_argument("--modelo", default=os.environ.get('MODELO_PATH', 'models/objeto_cortante.pt'))
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    parser.add_argument("--int8", action="store_true", help="Incluir os modelos quantizados em INT8")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--video", help="Vídeo opcional para medir os frames por segundo")
+    args = parser.parse_args()
+
+    print(json.dumps(comparar_backends(args.modelo, args.data, args.backends, args.int8, args.imgsz, args.video),
+                     indent=2))
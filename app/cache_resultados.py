@@ -0,0 +1,193 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+
+from app.deteccoes import ArmazemDeteccoes
+
+logger = logging.getLogger(__name__)
+
+# Diretório das detecções em cache
+CACHE_RESULTADOS_DIR = os.environ.get('CACHE_RESULTADOS_DIR', 'cache/resultados')
+
+# Espaço máximo ocupado pelo cache em disco; as entradas usadas há mais tempo
+# são removidas quando o limite é ultrapassado
+CACHE_RESULTADOS_MAX_MB = float(os.environ.get('CACHE_RESULTADOS_MAX_MB', 1024))
+
+# Menor limiar de confiança aceito pela API (mínimo do slider do frontend). As
+# detecções são armazenadas a partir dele, então qualquer limiar maior é
+# respondido apenas filtrando o cache
+CONFIANCA_MINIMA_CACHE = float(os.environ.get('CONFIANCA_MINIMA_CACHE', 0.1))
+
+# Se a análise deve consultar e alimentar o cache por padrão
+CACHE_RESULTADOS_ATIVO = os.environ.get('CACHE_RESULTADOS', '1').lower() not in ('0', 'false', 'nao', 'não')
+
+
+def hash_video(caminho):
+    """
+    Calcula o SHA-256 do conteúdo de um vídeo, lendo-o em blocos.
+    """
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def chave_resultado(hash_video, hash_modelo, **variante):
+    """
+    Monta a chave de uma entrada do cache a partir do conteúdo do vídeo, do
+    modelo e das opções que alteram quais frames são inferidos.
+
+    Args:
+        hash_video: SHA-256 do vídeo
+        hash_modelo: SHA-256 do arquivo do modelo
+        **variante: Opções que mudam as detecções (ex.: analisar_a_cada)
+    """
+    conteudo = json.dumps({'video': hash_video, 'modelo': hash_modelo, **variante}, sort_keys=True)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+
+class CacheResultados:
+    """
+    Cache em disco das detecções de um vídeo, endereçado pelo conteúdo.
+
+    Cada entrada é um `.npz` do `ArmazemDeteccoes` com as detecções acima de
+    `CONFIANCA_MINIMA_CACHE`. O cache é compartilhado pelos processos worker
+    apenas pelo sistema de arquivos: as gravações são atômicas (arquivo
+    temporário + rename) e a ordem de uso (LRU) é o mtime de cada entrada,
+    atualizado a cada leitura.
+    """
+
+    def __init__(self, diretorio=None, max_bytes=None):
+        """
+        Args:
+            diretorio: Diretório das entradas (padrão: CACHE_RESULTADOS_DIR)
+            max_bytes: Tamanho máximo do cache (padrão: CACHE_RESULTADOS_MAX_MB)
+        """
+        self.diretorio = diretorio or CACHE_RESULTADOS_DIR
+        self.max_bytes = int(max_bytes if max_bytes is not None else CACHE_RESULTADOS_MAX_MB * 1024 * 1024)
+        self.acertos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, f"{chave}.npz")
+
+    def caminho_temporario(self, chave):
+        """
+        Caminho único para gravar uma entrada antes de registrá-la com `registrar`.
+        """
+        os.makedirs(self.diretorio, exist_ok=True)
+        return os.path.join(self.diretorio, f".{chave}.{uuid.uuid4().hex}.tmp.npz")
+
+    def carregar(self, chave):
+        """
+        Carrega as detecções de uma entrada, marcando-a como usada recentemente.
+
+        Returns:
+            ArmazemDeteccoes: Detecções em cache, ou None se a entrada não existir
+        """
+        caminho = self._caminho(chave)
+        try:
+            armazem = ArmazemDeteccoes.carregar_npz(caminho)
+            os.utime(caminho)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Entrada de cache inválida removida ({chave}): {str(e)}")
+            self._remover(caminho)
+            return None
+        # Os frames salvos na execução original podem não existir mais
+        armazem.frame_paths = {}
+        return armazem
+
+    def registrar(self, chave, caminho_temporario):
+        """
+        Move para o cache uma entrada gravada em `caminho_temporario` e remove
+        as entradas menos usadas se o limite de tamanho for ultrapassado.
+        """
+        os.replace(caminho_temporario, self._caminho(chave))
+        self.limitar()
+
+    def salvar(self, chave, armazem):
+        """
+        Grava as detecções de `armazem` no cache.
+        """
+        temporario = self.caminho_temporario(chave)
+        try:
+            armazem.salvar_npz(temporario)
+            self.registrar(chave, temporario)
+        finally:
+            self._remover(temporario)
+
+    def _entradas(self):
+        entradas = []
+        try:
+            nomes = os.listdir(self.diretorio)
+        except FileNotFoundError:
+            return entradas
+        for nome in nomes:
+            if not nome.endswith('.npz') or nome.startswith('.'):
+                continue
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, caminho))
+        return entradas
+
+    def _remover(self, caminho):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+    def limitar(self):
+        """
+        Remove as entradas usadas há mais tempo até o cache caber em `max_bytes`.
+
+        Returns:
+            int: Quantidade de entradas removidas
+        """
+        entradas = sorted(self._entradas())
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        removidas = 0
+        for _, tamanho, caminho in entradas:
+            if total <= self.max_bytes:
+                break
+            self._remover(caminho)
+            total -= tamanho
+            removidas += 1
+        if removidas:
+            logger.info(f"Cache de resultados: {removidas} entradas removidas (LRU)")
+        return removidas
+
+    def registrar_consulta(self, acerto):
+        """
+        Contabiliza uma consulta ao cache. As consultas acontecem nos workers;
+        o processo da API contabiliza o resultado informado por cada análise.
+        """
+        with self._lock:
+            if acerto:
+                self.acertos += 1
+            else:
+                self.falhas += 1
+
+    def estatisticas(self):
+        """
+        Retorna a ocupação do cache e os contadores de acertos e falhas.
+        """
+        entradas = self._entradas()
+        consultas = self.acertos + self.falhas
+        return {
+            'entradas': len(entradas),
+            'tamanho_bytes': sum(tamanho for _, tamanho, _ in entradas),
+            'max_bytes': self.max_bytes,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': round(self.acertos / consultas, 3) if consultas else None,
+        }
@@ -0,0 +1,197 @@
+import os
+import shutil
+import logging
+import subprocess
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Segundos de vídeo incluídos antes do início e depois do fim de cada evento
+CLIPE_PRE_ROLL_S = float(os.environ.get('CLIPE_PRE_ROLL_S', 2))
+CLIPE_POS_ROLL_S = float(os.environ.get('CLIPE_POS_ROLL_S', 2))
+
+# Codificador dos vídeos gerados: 'auto' (ffmpeg se instalado), 'ffmpeg' ou 'opencv'
+CODIFICADOR_VIDEO = os.environ.get('CODIFICADOR_VIDEO', 'auto').lower()
+
+# Preset de velocidade e qualidade (CRF) do libx264 quando o ffmpeg é usado
+FFMPEG_PRESET = os.environ.get('FFMPEG_PRESET', 'veryfast')
+FFMPEG_CRF = int(os.environ.get('FFMPEG_CRF', 23))
+
+
+class EscritorVideo:
+    """
+    Grava frames BGR em um vídeo, com a mesma interface do `cv2.VideoWriter`
+    (`write`/`release`).
+
+    Com o ffmpeg instalado, os frames brutos são enviados por pipe a um
+    processo libx264 com preset rápido: a codificação roda fora do processo
+    Python e gera H.264 bem menor que o mp4v. Sem o ffmpeg, usa o
+    `cv2.VideoWriter` com mp4v.
+    """
+
+    def __init__(self, caminho, fps, tamanho, codificador=None):
+        """
+        Args:
+            caminho: Caminho do vídeo de saída
+            fps: Frames por segundo
+            tamanho: Tupla (largura, altura) dos frames
+            codificador: 'auto', 'ffmpeg' ou 'opencv' (padrão: CODIFICADOR_VIDEO)
+        """
+        codificador = (codificador or CODIFICADOR_VIDEO).lower()
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self.caminho = caminho
+        self.processo = None
+        self.writer = None
+
+        ffmpeg = shutil.which('ffmpeg') if codificador in ('auto', 'ffmpeg') else None
+        if codificador == 'ffmpeg' and not ffmpeg:
+            raise RuntimeError("CODIFICADOR_VIDEO=ffmpeg, mas o ffmpeg não foi encontrado no PATH")
+        if ffmpeg:
+            largura, altura = tamanho
+            self.processo = subprocess.Popen(
+                [ffmpeg, '-y', '-loglevel', 'error',
+                 '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{largura}x{altura}', '-r', str(fps or 30), '-i', '-',
+                 '-an', '-c:v', 'libx264', '-preset', FFMPEG_PRESET, '-crf', str(FFMPEG_CRF),
+                 # yuv420p exige dimensões pares
+                 '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', '-movflags', '+faststart', caminho],
+                stdin=subprocess.PIPE
+            )
+        else:
+            self.writer = cv2.VideoWriter(caminho, cv2.VideoWriter_fourcc(*'mp4v'), fps, tamanho)
+
+    def write(self, frame):
+        if self.processo is not None:
+            self.processo.stdin.write(np.ascontiguousarray(frame).tobytes())
+        else:
+            self.writer.write(frame)
+
+    def release(self):
+        if self.processo is not None:
+            self.processo.stdin.close()
+            if self.processo.wait() != 0:
+                logger.error(f"ffmpeg terminou com código {self.processo.returncode} ao gravar {self.caminho}")
+        else:
+            self.writer.release()
+
+
+def intervalos_eventos(eventos, fps, total_frames=None, pre_roll=None, pos_roll=None):
+    """
+    Converte os eventos em intervalos de frames com a margem antes e depois de
+    cada evento, juntando os intervalos que se sobrepõem.
+
+    Returns:
+        list: Tuplas (frame_inicial, frame_final exclusivo, ids dos eventos)
+    """
+    pre_roll = CLIPE_PRE_ROLL_S if pre_roll is None else pre_roll
+    pos_roll = CLIPE_POS_ROLL_S if pos_roll is None else pos_roll
+    fps = fps if fps and fps > 0 else 30
+    intervalos = []
+    for evento in sorted(eventos, key=lambda e: e['frame_inicial']):
+        inicio = max(0, evento['frame_inicial'] - int(round(pre_roll * fps)))
+        fim = evento['frame_final'] + 1 + int(round(pos_roll * fps))
+        if total_frames:
+            fim = min(fim, total_frames)
+        if intervalos and inicio <= intervalos[-1][1]:
+            anterior = intervalos[-1]
+            intervalos[-1] = (anterior[0], max(anterior[1], fim), anterior[2] + [evento['evento_id']])
+        else:
+            intervalos.append((inicio, fim, [evento['evento_id']]))
+    return intervalos
+
+
+def _desenhar(frame, deteccoes, cores):
+    from ultralytics.utils.plotting import Annotator, colors
+
+    anotador = Annotator(frame, example=str(list(cores)))
+    for deteccao in deteccoes:
+        indice = cores.setdefault(deteccao['classe'], len(cores))
+        anotador.box_label(deteccao['coordenadas'], f"{deteccao['classe']} {deteccao['confianca']:.2f}",
+                           color=colors(indice, True))
+    return anotador.result()
+
+
+def exportar_clipes(input_path, deteccoes, eventos, destino_dir, destaques_path=None, pre_roll=None, pos_roll=None):
+    """
+    Grava apenas trechos curtos anotados em torno dos eventos, em vez de
+    recodificar o vídeo inteiro. Só os frames dos trechos são decodificados
+    (a leitura é posicionada no início de cada trecho).
+
+    Args:
+        input_path: Caminho para o vídeo de entrada
+        deteccoes: Detecções do vídeo ordenadas por frame (formato retornado
+            por `processar_video`); são lidas uma única vez, em sequência
+        eventos: Eventos das detecções (ver `app.rastreamento.agrupar_eventos`)
+        destino_dir: Diretório onde os clipes são gravados
+        destaques_path: Caminho opcional de um vídeo com todos os clipes em sequência
+        pre_roll: Segundos antes de cada evento (padrão: CLIPE_PRE_ROLL_S)
+        pos_roll: Segundos depois de cada evento (padrão: CLIPE_POS_ROLL_S)
+
+    Returns:
+        list: Um dicionário por clipe com caminho, inicio, fim (em segundos),
+        frame_inicial, frame_final e os ids dos eventos incluídos
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError(f"Não foi possível abrir o vídeo: {input_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    tamanho = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # As detecções são consumidas junto com os frames dos trechos, sem montar
+    # um índice de todas elas (podem vir de um `DeteccoesEmDisco`)
+    pendentes = iter(deteccoes)
+    proxima = next(pendentes, None)
+    cores = {}
+
+    intervalos = intervalos_eventos(eventos, fps, total_frames, pre_roll, pos_roll)
+    destaques = EscritorVideo(destaques_path, fps, tamanho) if destaques_path and intervalos else None
+    os.makedirs(destino_dir, exist_ok=True)
+
+    clipes = []
+    posicao = 0
+    try:
+        for i, (inicio, fim, ids) in enumerate(intervalos):
+            # Trechos próximos: avançar sem decodificar; distantes: reposicionar
+            if 0 <= inicio - posicao <= (fps or 30):
+                while posicao < inicio and cap.grab():
+                    posicao += 1
+            else:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, inicio)
+                posicao = inicio
+
+            caminho = os.path.join(destino_dir, f"clipe_{i + 1:03d}.mp4")
+            escritor = EscritorVideo(caminho, fps, tamanho)
+            try:
+                while posicao < fim:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    do_frame = []
+                    while proxima is not None and proxima['frame_num'] <= posicao:
+                        if proxima['frame_num'] == posicao:
+                            do_frame.append(proxima)
+                        proxima = next(pendentes, None)
+                    if do_frame:
+                        frame = _desenhar(frame, do_frame, cores)
+                    escritor.write(frame)
+                    if destaques is not None:
+                        destaques.write(frame)
+                    posicao += 1
+            finally:
+                escritor.release()
+
+            clipes.append({
+                'caminho': caminho,
+                'inicio': round(inicio / fps, 3) if fps > 0 else 0,
+                'fim': round(posicao / fps, 3) if fps > 0 else 0,
+                'frame_inicial': inicio,
+                'frame_final': posicao - 1,
+                'eventos': ids,
+            })
+    finally:
+        cap.release()
+        if destaques is not None:
+            destaques.release()
+    return clipes
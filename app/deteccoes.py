@@ -0,0 +1,349 @@
+import os
+import json
+import numpy as np
+
+# Registro compacto de uma detecção (uma caixa em um frame)
+DTYPE_DETECCAO = np.dtype([
+    ('frame_num', np.int64),
+    ('tempo', np.float64),
+    ('classe_id', np.int32),
+    ('confianca', np.float32),
+    ('x1', np.int32),
+    ('y1', np.int32),
+    ('x2', np.int32),
+    ('y2', np.int32),
+])
+
+# Detecções mantidas em memória pelo `DiarioDeteccoes` antes de irem para o disco
+DIARIO_REGISTROS_MEMORIA = int(os.environ.get('DIARIO_REGISTROS_MEMORIA', 65536))
+
+
+class ArmazemDeteccoes:
+    """
+    Armazena as detecções de um vídeo em um array estruturado do NumPy (uma
+    coluna por campo), em vez de um dicionário Python por caixa.
+
+    As caixas de cada frame são copiadas do `Boxes` do ultralytics em uma única
+    transferência (`boxes.data`), e a conversão para a lista de dicionários
+    usada pela API só acontece quando solicitada.
+    """
+
+    def __init__(self, nomes=None, capacidade_inicial=1024):
+        """
+        Args:
+            nomes: Dicionário {classe_id: nome da classe} do modelo
+            capacidade_inicial: Quantidade de registros pré-alocados
+        """
+        self.nomes = dict(nomes or {})
+        self.frame_paths = {}  # frame_num -> caminho do frame salvo
+        self._dados = np.empty(max(1, capacidade_inicial), dtype=DTYPE_DETECCAO)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def registros(self):
+        """Array estruturado com as detecções armazenadas (sem cópia)."""
+        return self._dados[:self._n]
+
+    def _reservar(self, quantidade):
+        necessario = self._n + quantidade
+        if necessario > len(self._dados):
+            novo = np.empty(max(necessario, 2 * len(self._dados)), dtype=DTYPE_DETECCAO)
+            novo[:self._n] = self._dados[:self._n]
+            self._dados = novo
+
+    def adicionar(self, frame_num, tempo, classes, confiancas, coordenadas):
+        """
+        Adiciona as detecções de um frame a partir de arrays já na CPU.
+
+        Args:
+            frame_num: Índice do frame
+            tempo: Instante do frame em segundos
+            classes: Array (n,) com os ids de classe
+            confiancas: Array (n,) com as confianças
+            coordenadas: Array (n, 4) com as caixas em x1, y1, x2, y2
+
+        Returns:
+            int: Quantidade de detecções adicionadas
+        """
+        quantidade = len(classes)
+        if quantidade == 0:
+            return 0
+        self._reservar(quantidade)
+        bloco = self._dados[self._n:self._n + quantidade]
+        bloco['frame_num'] = frame_num
+        bloco['tempo'] = tempo
+        bloco['classe_id'] = classes
+        bloco['confianca'] = confiancas
+        coordenadas = np.asarray(coordenadas).astype(np.int32)
+        bloco['x1'] = coordenadas[:, 0]
+        bloco['y1'] = coordenadas[:, 1]
+        bloco['x2'] = coordenadas[:, 2]
+        bloco['y2'] = coordenadas[:, 3]
+        self._n += quantidade
+        return quantidade
+
+    def adicionar_resultado(self, resultado, frame_num, tempo, frame_path=None):
+        """
+        Adiciona as caixas de um resultado do YOLO com uma única cópia
+        dispositivo -> CPU.
+
+        Returns:
+            int: Quantidade de detecções adicionadas
+        """
+        boxes = resultado.boxes
+        if boxes is None or len(boxes) == 0:
+            return 0
+        if not self.nomes:
+            self.nomes = dict(resultado.names)
+
+        # Colunas de boxes.data: x1, y1, x2, y2, [track_id], conf, cls
+        dados = boxes.data.cpu().numpy()
+        if frame_path:
+            self.frame_paths[frame_num] = frame_path
+        return self.adicionar(frame_num, tempo, dados[:, -1].astype(np.int32), dados[:, -2], dados[:, :4])
+
+    def descartar_frame_paths(self, caminhos):
+        """Remove dos frames salvos os caminhos dados (ex.: gravações que falharam)."""
+        self.frame_paths = {f: p for f, p in self.frame_paths.items() if p not in caminhos}
+
+    def para_lista(self, inicio=0, fim=None):
+        """
+        Converte as detecções para a lista de dicionários retornada pela API.
+
+        Args:
+            inicio: Índice da primeira detecção a converter
+            fim: Índice final (exclusivo); None converte até a última
+        """
+        return self._para_lista(self.registros[inicio:fim])
+
+    def _para_lista(self, registros):
+        frame_nums = registros['frame_num'].tolist()
+        tempos = registros['tempo'].tolist()
+        classes = registros['classe_id'].tolist()
+        confiancas = registros['confianca'].tolist()
+        coordenadas = np.stack([registros['x1'], registros['y1'], registros['x2'], registros['y2']], axis=1).tolist()
+        return [
+            {
+                'frame_num': frame_num,
+                'tempo': tempo,
+                'classe': self.nomes.get(classe_id, "objeto_cortante"),
+                'confianca': confianca,
+                'coordenadas': coords,
+                'frame_path': self.frame_paths.get(frame_num),
+            }
+            for frame_num, tempo, classe_id, confianca, coords in zip(frame_nums, tempos, classes, confiancas, coordenadas)
+        ]
+
+    def filtrar(self, mascara):
+        """
+        Retorna um novo armazém apenas com as detecções selecionadas pela máscara.
+        """
+        registros = self.registros[mascara]
+        armazem = ArmazemDeteccoes(self.nomes, capacidade_inicial=len(registros))
+        armazem._dados[:len(registros)] = registros
+        armazem._n = len(registros)
+        frames = set(registros['frame_num'].tolist())
+        armazem.frame_paths = {f: p for f, p in self.frame_paths.items() if f in frames}
+        return armazem
+
+    def filtrar_confianca(self, limiar):
+        """
+        Retorna um novo armazém apenas com as detecções de confiança acima de
+        `limiar` (mesmo critério do NMS do YOLO).
+        """
+        return self.filtrar(self.registros['confianca'] > np.float32(limiar))
+
+    @classmethod
+    def concatenar(cls, armazens):
+        """
+        Junta vários armazéns (ex.: os segmentos de um vídeo) em um só, na ordem dada.
+        """
+        armazens = list(armazens)
+        total = sum(len(armazem) for armazem in armazens)
+        resultado = cls(next((a.nomes for a in armazens if a.nomes), None), capacidade_inicial=total)
+        for armazem in armazens:
+            resultado._dados[resultado._n:resultado._n + len(armazem)] = armazem.registros
+            resultado._n += len(armazem)
+            resultado.frame_paths.update(armazem.frame_paths)
+        return resultado
+
+    def salvar_npz(self, caminho):
+        """
+        Salva as detecções, os nomes das classes e os caminhos dos frames em um
+        arquivo `.npz` comprimido.
+        """
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        np.savez_compressed(
+            caminho,
+            deteccoes=self.registros,
+            nomes=np.array(json.dumps({str(k): v for k, v in self.nomes.items()})),
+            frame_paths=np.array(json.dumps({str(k): v for k, v in self.frame_paths.items()})),
+        )
+        return caminho
+
+    @classmethod
+    def carregar_npz(cls, caminho):
+        """
+        Carrega um armazém salvo por `salvar_npz`.
+        """
+        with np.load(caminho) as dados:
+            registros = dados['deteccoes']
+            nomes = {int(k): v for k, v in json.loads(str(dados['nomes'])).items()}
+            frame_paths = {int(k): v for k, v in json.loads(str(dados['frame_paths'])).items()}
+        armazem = cls(nomes, capacidade_inicial=len(registros))
+        armazem._dados[:len(registros)] = registros
+        armazem._n = len(registros)
+        armazem.frame_paths = frame_paths
+        return armazem
+
+    def salvar_parquet(self, caminho):
+        """
+        Salva as detecções em Parquet (requer o pacote `pyarrow`), com uma
+        coluna por campo e os nomes das classes já resolvidos.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("A exportação para Parquet requer o pacote 'pyarrow' (pip install pyarrow)")
+
+        registros = self.registros
+        colunas = {nome: registros[nome] for nome in DTYPE_DETECCAO.names}
+        colunas['classe'] = [self.nomes.get(c, "objeto_cortante") for c in registros['classe_id'].tolist()]
+        colunas['frame_path'] = [self.frame_paths.get(f) for f in registros['frame_num'].tolist()]
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        pq.write_table(pa.table(colunas), caminho)
+        return caminho
+
+    def exportar(self, caminho):
+        """
+        Exporta as detecções de acordo com a extensão do arquivo (.npz ou .parquet).
+        """
+        extensao = os.path.splitext(caminho)[1].lower()
+        if extensao == '.npz':
+            return self.salvar_npz(caminho)
+        if extensao in ('.parquet', '.pq'):
+            return self.salvar_parquet(caminho)
+        raise ValueError(f"Formato de exportação não suportado: {extensao}")
+
+
+class DiarioDeteccoes(ArmazemDeteccoes):
+    """
+    Armazém que grava as detecções incrementalmente em um arquivo (log só de
+    acréscimos, um registro `DTYPE_DETECCAO` após o outro) e mantém em
+    memória apenas as últimas `capacidade` detecções, para que a memória não
+    cresça com a duração do vídeo.
+
+    O arquivo pode ser lido com `np.fromfile(caminho, dtype=DTYPE_DETECCAO)`;
+    ao fechar, os nomes das classes e os caminhos dos frames vão para
+    `<caminho>.json`. `registros`, `filtrar` e `exportar` carregam todas as
+    detecções; `iterar` as lê em blocos.
+    """
+
+    def __init__(self, caminho, nomes=None, capacidade=None):
+        """
+        Args:
+            caminho: Arquivo do log de detecções (sobrescrito se existir)
+            nomes: Dicionário {classe_id: nome da classe} do modelo
+            capacidade: Detecções em memória antes da gravação (padrão: DIARIO_REGISTROS_MEMORIA)
+        """
+        self.capacidade = max(1, int(capacidade or DIARIO_REGISTROS_MEMORIA))
+        super().__init__(nomes, capacidade_inicial=self.capacidade)
+        self.caminho = caminho
+        self.gravados = 0
+        os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+        self._arquivo = open(caminho, 'wb')
+
+    def __len__(self):
+        return self.gravados + self._n
+
+    def _reservar(self, quantidade):
+        # Gravar o buffer em vez de crescê-lo; ele só cresce se um único
+        # frame tiver mais detecções que a capacidade
+        if self._n + quantidade > len(self._dados):
+            self.descarregar()
+        super()._reservar(quantidade)
+
+    def descarregar(self):
+        """Acrescenta ao arquivo as detecções em memória."""
+        if self._n and not self._arquivo.closed:
+            self._arquivo.write(self._dados[:self._n].tobytes())
+            self._arquivo.flush()
+            self.gravados += self._n
+            self._n = 0
+
+    def fechar(self):
+        """Grava as detecções pendentes e os metadados em `<caminho>.json`."""
+        if self._arquivo.closed:
+            return
+        self.descarregar()
+        self._arquivo.close()
+        with open(self.caminho + '.json', 'w') as arquivo:
+            json.dump({
+                'total': self.gravados,
+                'nomes': {str(k): v for k, v in self.nomes.items()},
+                'frame_paths': {str(k): v for k, v in self.frame_paths.items()},
+            }, arquivo)
+
+    def iterar_blocos(self, tamanho_bloco=None):
+        """
+        Lê as detecções em blocos de até `tamanho_bloco` registros (padrão:
+        a capacidade), na ordem em que foram adicionadas.
+        """
+        tamanho_bloco = tamanho_bloco or self.capacidade
+        if self.gravados:
+            gravados = np.memmap(self.caminho, dtype=DTYPE_DETECCAO, mode='r', shape=(self.gravados,))
+            for inicio in range(0, self.gravados, tamanho_bloco):
+                yield np.array(gravados[inicio:inicio + tamanho_bloco])
+            del gravados
+        if self._n:
+            yield self._dados[:self._n].copy()
+
+    def iterar(self, limiar=None):
+        """Produz as detecções (dicionários de `para_lista`) acima de `limiar`, lendo o arquivo em blocos."""
+        for bloco in self.iterar_blocos():
+            if limiar is not None:
+                bloco = bloco[bloco['confianca'] > np.float32(limiar)]
+            yield from self._para_lista(bloco)
+
+    @property
+    def registros(self):
+        """Todas as detecções, lidas do arquivo (prefira `iterar_blocos`)."""
+        blocos = list(self.iterar_blocos(max(1, self.gravados)))
+        return np.concatenate(blocos) if blocos else np.empty(0, dtype=DTYPE_DETECCAO)
+
+    def para_lista(self, inicio=0, fim=None):
+        # As detecções recentes (ex.: do último frame) ainda estão em memória
+        if inicio >= self.gravados and (fim is None or fim >= inicio):
+            fim = self._n if fim is None else fim - self.gravados
+            return self._para_lista(self._dados[inicio - self.gravados:fim])
+        return super().para_lista(inicio, fim)
+
+
+class DeteccoesEmDisco:
+    """
+    Lista somente leitura das detecções de um `DiarioDeteccoes` acima de um
+    limiar, lidas do arquivo a cada iteração em vez de mantidas em memória.
+    """
+
+    def __init__(self, diario, limiar=None):
+        self.diario = diario
+        self.limiar = limiar
+        self._total = None
+
+    @property
+    def caminho(self):
+        return self.diario.caminho
+
+    def __iter__(self):
+        return self.diario.iterar(self.limiar)
+
+    def __len__(self):
+        if self._total is None:
+            limiar = np.float32(self.limiar) if self.limiar is not None else None
+            self._total = sum(int(np.count_nonzero(bloco['confianca'] > limiar)) if limiar is not None else len(bloco)
+                              for bloco in self.diario.iterar_blocos())
+        return self._total
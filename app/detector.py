@@ -1,114 +1,754 @@
 import cv2
 import os
-from ultralytics import YOLO
+import math
+import time
+from app.modelos import obter_modelo
+from app.backends import resolver_modelo
+from app.movimento import FiltroMovimento
+from app.pipeline import Pipeline
+from app.deteccoes import ArmazemDeteccoes, DiarioDeteccoes, DeteccoesEmDisco
+from app.rastreamento import agrupar_eventos, agrupar_eventos_em_ordem
+from app.memoria import PoolFrames, MonitorMemoria, MEMORIA_LIMITADA, MEMORIA_INTERVALO_VERIFICACAO
+from app.snapshots import GravadorSnapshots
+from app.clipes import EscritorVideo
 import numpy as np
 from datetime import datetime
 
-def processar_video(modelo_path, input_path, output_path=None, limiar_confianca=0.25, salvar_frames=False, frames_dir=None):
+# Quantidade padrão de frames enviados ao modelo em cada chamada de inferência
+TAMANHO_LOTE_PADRAO = int(os.environ.get('TAMANHO_LOTE_INFERENCIA', 1))
+
+# Se os estágios de decodificação, inferência, anotação e codificação devem
+# rodar em threads separadas por padrão
+PIPELINE_PADRAO = os.environ.get('PIPELINE_ESTAGIOS', '1').lower() not in ('0', 'false', 'nao', 'não')
+
+# Quantidade máxima de lotes aguardando em cada fila entre estágios
+CAPACIDADE_FILA_PADRAO = int(os.environ.get('CAPACIDADE_FILA_PIPELINE', 4))
+
+# Perfis de resolução de inferência (lado maior, em pixels) usados pelo modo "auto"
+RESOLUCOES_INFERENCIA = (320, 480, 640)
+
+# No modo "auto", a resolução desce um perfil a cada N jobs aguardando na fila
+JOBS_POR_NIVEL_RESOLUCAO = int(os.environ.get('JOBS_POR_NIVEL_RESOLUCAO', 2))
+
+
+def escolher_resolucao(perfil, largura=None, altura=None, profundidade_fila=0):
     """
-    Processa um vídeo para detectar objetos cortantes usando YOLO.
-    
+    Converte o perfil de resolução pedido no tamanho de entrada do modelo.
+
     Args:
-        modelo_path: Caminho para o modelo treinado
-        input_path: Caminho para o vídeo de entrada
-        output_path: Caminho para salvar o vídeo processado (opcional)
-        limiar_confianca: Limiar de confiança para considerar uma detecção
-        salvar_frames: Se deve salvar os frames onde foram detectados objetos
-        frames_dir: Diretório para salvar os frames com detecções
-    
+        perfil: None (padrão do modelo), um tamanho (ex.: 320, 480, 640) ou "auto"
+        largura: Largura do vídeo, usada no modo "auto"
+        altura: Altura do vídeo, usada no modo "auto"
+        profundidade_fila: Jobs aguardando processamento, usada no modo "auto"
+
     Returns:
-        tuple: (caminho do vídeo processado, lista de detecções)
+        int: Lado maior da entrada do modelo (múltiplo de 32), ou None para
+        manter o padrão do modelo
     """
-    # Carregar modelo YOLO
-    modelo = YOLO(modelo_path)
-    
+    if perfil is None or str(perfil).strip() == '':
+        return None
+    if str(perfil).strip().lower() == 'auto':
+        # Menor perfil que cobre o vídeo (não ampliar vídeos pequenos), descendo
+        # um perfil a cada JOBS_POR_NIVEL_RESOLUCAO jobs na fila
+        lado = max(largura or 0, altura or 0)
+        nivel = next((i for i, r in enumerate(RESOLUCOES_INFERENCIA) if 0 < lado <= r), len(RESOLUCOES_INFERENCIA) - 1)
+        nivel = max(0, nivel - int(profundidade_fila or 0) // max(1, JOBS_POR_NIVEL_RESOLUCAO))
+        return RESOLUCOES_INFERENCIA[nivel]
+    try:
+        valor = int(perfil)
+    except (TypeError, ValueError):
+        raise ValueError(f"Resolução de inferência inválida: {perfil} (use um tamanho em pixels ou 'auto')")
+    if valor < 32:
+        raise ValueError(f"Resolução de inferência inválida: {perfil} (mínimo 32)")
+    # A entrada precisa ser múltipla do stride máximo do modelo
+    return int(math.ceil(valor / 32) * 32)
+
+
+def _ler_lotes(cap, tamanho_lote, frame_inicial=0, frame_final=None, pool=None):
+    """
+    Lê os frames do vídeo agrupando-os em lotes de até `tamanho_lote` frames.
+
+    Args:
+        cap: VideoCapture já posicionado em `frame_inicial`
+        tamanho_lote: Quantidade máxima de frames por lote
+        frame_inicial: Índice (no vídeo completo) do primeiro frame lido
+        frame_final: Índice do frame em que a leitura para (exclusivo); None lê até o fim
+        pool: `PoolFrames` opcional com buffers livres para a leitura dos frames
+
+    Yields:
+        list: Lista de tuplas (frame_num, frame), na ordem do vídeo
+    """
+    lote = []
+    frame_num = frame_inicial
+    while cap.isOpened() and (frame_final is None or frame_num < frame_final):
+        buffer = pool.obter() if pool is not None else None
+        ret, frame = cap.read(buffer) if buffer is not None else cap.read()
+        if not ret:
+            break
+        lote.append((frame_num, frame))
+        frame_num += 1
+        if len(lote) >= tamanho_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class ProcessamentoCancelado(Exception):
+    """Lançada quando o processamento é interrompido pelo sinal de cancelamento."""
+
+
+class _ProcessamentoVideo:
+    """
+    Estado de um processamento de vídeo, dividido nos estágios do pipeline:
+    decodificação (com o filtro de movimento), inferência, anotação/gravação de
+    frames e codificação do vídeo de saída.
+
+    Cada estágio é chamado por uma única thread e na ordem dos frames, então o
+    estado de um estágio (ex.: `ultimo_resultado` da anotação) não precisa de
+    sincronização.
+    """
+
+    def __init__(self, modelo, cap, out, output_path, fps, total_frames, limiar_confianca, salvar_frames, frames_dir,
+                 tamanho_lote, filtro, detalhar_eventos=False, frame_inicial=0, frame_final=None,
+                 confianca_armazenada=None, resolucao=None, diario=None, monitor=None):
+        self.modelo = modelo
+        self.cap = cap
+        self.out = out
+        self.output_path = output_path
+        self.fps = fps
+        self.total_frames = total_frames
+        self.limiar_confianca = limiar_confianca
+        # A inferência pode usar um limiar menor que o da requisição para
+        # armazenar também as detecções fracas (cache de resultados); o que é
+        # desenhado, salvo e retornado continua filtrado por `limiar_confianca`
+        self.confianca_inferencia = limiar_confianca
+        if confianca_armazenada is not None:
+            self.confianca_inferencia = min(limiar_confianca, confianca_armazenada)
+        self.salvar_frames = salvar_frames
+        self.frames_dir = frames_dir
+        # Gravação dos frames com detecções fora do laço, sem quase duplicados
+        self.snapshots = GravadorSnapshots(frames_dir) if salvar_frames and frames_dir else None
+        self.tamanho_lote = tamanho_lote
+        self.filtro = filtro
+        self.detalhar_eventos = detalhar_eventos
+        self.resolucao = resolucao  # Lado maior da entrada do modelo (None: padrão do modelo)
+        self.frame_inicial = frame_inicial
+        self.frame_final = frame_final
+
+        # Armazém colunar com as informações de cada detecção. No modo de
+        # memória limitada, as detecções vão para um diário em disco e os
+        # buffers dos frames são reaproveitados entre os lotes
+        self.memoria_limitada = diario is not None
+        self.deteccoes = diario if diario is not None else ArmazemDeteccoes(getattr(modelo.modelo, 'names', None))
+        self.pool = PoolFrames() if self.memoria_limitada else None
+        self.monitor = monitor
+        self.frames_processados = 0
+        self.deteccoes_visiveis = 0  # Detecções acima de `limiar_confianca`
+        self.tempo_inferencia = 0.0  # Tempo total das chamadas ao modelo
+        self.frames_inferidos = 0
+        self.already_detected_frames = set()  # Para evitar detecções duplicadas no mesmo frame
+        self.ultimo_resultado = None  # Resultado do último frame inferido, reaproveitado nos frames ignorados
+
+    def decodificar(self):
+        """
+        Lê os lotes de frames e marca, com o filtro de movimento, quais devem
+        passar pela inferência.
+
+        Yields:
+            list: Lista de tuplas (frame_num, frame, inferir)
+        """
+        for lote in _ler_lotes(self.cap, self.tamanho_lote, self.frame_inicial, self.frame_final, self.pool):
+            if self.filtro:
+                yield [(frame_num, frame, self.filtro.deve_inferir(frame_num, frame)) for frame_num, frame in lote]
+            else:
+                yield [(frame_num, frame, True) for frame_num, frame in lote]
+
+    def inferir(self, lote):
+        """
+        Executa a detecção em todos os frames selecionados do lote de uma só vez.
+
+        Returns:
+            list: Lista de tuplas (frame_num, frame, resultado); o resultado é
+            None para os frames ignorados pelo filtro
+        """
+        # Os frames de um mesmo vídeo têm o mesmo tamanho, então o letterbox do
+        # lote é o mesmo da inferência frame a frame e cada resultado
+        # corresponde, na ordem, ao frame de mesmo índice
+        a_inferir = [(frame_num, frame) for frame_num, frame, inferir in lote if inferir]
+        resultados_lote = {}
+        if a_inferir:
+            frames = [frame for _, frame in a_inferir]
+            opcoes = {'imgsz': self.resolucao} if self.resolucao else {}
+            inicio = time.perf_counter()
+            resultados = self.modelo.prever(frames if len(frames) > 1 else frames[0], conf=self.confianca_inferencia,
+                                            **opcoes)
+            self.tempo_inferencia += time.perf_counter() - inicio
+            self.frames_inferidos += len(frames)
+            resultados_lote = {frame_num: resultado for (frame_num, _), resultado in zip(a_inferir, resultados)}
+        return [(frame_num, frame, resultados_lote.get(frame_num)) for frame_num, frame, _ in lote]
+
+    def anotar(self, lote):
+        """
+        Desenha as caixas, grava os frames com detecções e registra as detecções.
+
+        Returns:
+            list: Tuplas (frame anotado, evento do frame), na ordem do lote. O
+            frame anotado é None quando não há vídeo de saída.
+        """
+        itens = []
+        for frame_num, frame, resultado in lote:
+            tempo = frame_num / self.fps if self.fps > 0 else 0
+            inicio_frame = len(self.deteccoes)
+
+            # Caixas exibidas: as do resultado acima do limiar da requisição
+            visivel = resultado
+            if resultado is not None and self.confianca_inferencia < self.limiar_confianca:
+                visivel = resultado[resultado.boxes.conf > self.limiar_confianca]
+
+            frame_path = None
+            if resultado is None:
+                # Frame ignorado: repetir no vídeo de saída as caixas do último
+                # frame inferido, sem gerar novas detecções
+                if self.out and self.ultimo_resultado is not None and len(self.ultimo_resultado.boxes) > 0:
+                    frame_anotado = self._desenhar(self.ultimo_resultado, frame)
+                else:
+                    frame_anotado = frame
+            elif len(visivel.boxes) > 0:
+                # Frame contém detecções; salvá-lo, se solicitado e se não for
+                # quase idêntico a um frame salvo recentemente
+                salvar = (self.snapshots is not None and frame_num not in self.already_detected_frames
+                          and self.snapshots.deve_salvar(frame, tempo, visivel.boxes.xyxy.cpu().numpy()))
+
+                # Desenhar as caixas apenas se o frame for usado
+                frame_anotado = self._desenhar(visivel, frame) if self.out or salvar else frame
+
+                if salvar:
+                    # No modo de memória limitada o frame anotado é o buffer do
+                    # pool, reaproveitado antes da gravação em segundo plano
+                    frame_path = self.snapshots.salvar(
+                        frame_num, frame_anotado.copy() if self.memoria_limitada else frame_anotado)
+                    self.already_detected_frames.add(frame_num)
+            else:
+                # Sem detecções, usar o frame original
+                frame_anotado = frame
+
+            if resultado is not None:
+                # Copiar todas as caixas deste frame para o armazém de uma só vez
+                self.deteccoes.adicionar_resultado(resultado, frame_num, tempo, frame_path)
+                self.ultimo_resultado = visivel
+
+            evento = {
+                'tipo': 'frame',
+                'frame_num': frame_num,
+                'tempo': tempo,
+                'inferido': resultado is not None,
+                'total_deteccoes': len(visivel.boxes) if visivel is not None else 0,
+            }
+            if self.detalhar_eventos and evento['total_deteccoes']:
+                limiar = np.float32(self.limiar_confianca)
+                evento['deteccoes'] = [d for d in self.deteccoes.para_lista(inicio_frame) if d['confianca'] > limiar]
+
+            self.deteccoes_visiveis += evento['total_deteccoes']
+            itens.append((frame_anotado if self.out else None, evento))
+            if self.pool is not None and not self.out:
+                self.pool.devolver(frame)
+            self.frames_processados += 1
+        return itens
+
+    def _desenhar(self, resultado, frame):
+        """
+        Desenha as caixas do resultado no frame. `Results.plot` copia o frame
+        a cada chamada; no modo de memória limitada as caixas são desenhadas
+        no próprio buffer, que já foi usado pela inferência.
+        """
+        if not self.memoria_limitada:
+            return resultado.plot(img=frame)
+
+        from ultralytics.utils.plotting import Annotator, colors
+
+        anotador = Annotator(frame, example=resultado.names)
+        caixas = zip(resultado.boxes.xyxy.cpu().numpy(), resultado.boxes.conf.cpu().numpy().tolist(),
+                     resultado.boxes.cls.cpu().numpy().astype(int).tolist())
+        # Mesma ordem do `plot` (da última caixa para a primeira), para o mesmo resultado nas sobreposições
+        for caixa, confianca, classe_id in reversed(list(caixas)):
+            anotador.box_label(caixa, f"{resultado.names[classe_id]} {confianca:.2f}", color=colors(classe_id, True))
+        return anotador.result()
+
+    def codificar(self, itens):
+        """
+        Escreve os frames anotados no vídeo de saída.
+
+        Returns:
+            list: Tuplas (None, evento do frame), liberando os frames escritos
+        """
+        for frame_anotado, _ in itens:
+            self.out.write(frame_anotado)
+            if self.pool is not None:
+                self.pool.devolver(frame_anotado)
+        return [(None, evento) for _, evento in itens]
+
+    def resolucao_efetiva(self):
+        """
+        Lado maior da entrada usada pelo modelo: a resolução pedida ou, sem
+        ela, a do predictor do ultralytics após a primeira inferência.
+        """
+        if self.resolucao:
+            return self.resolucao
+        predictor = getattr(self.modelo.modelo, 'predictor', None)
+        imgsz = getattr(getattr(predictor, 'args', None), 'imgsz', None)
+        return max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz
+
+    def lista_deteccoes(self):
+        """
+        Retorna a lista de detecções acima de `limiar_confianca`. No modo de
+        memória limitada, retorna um iterável que lê o diário em disco.
+        """
+        if self.memoria_limitada:
+            limiar = self.limiar_confianca if self.confianca_inferencia < self.limiar_confianca else None
+            return DeteccoesEmDisco(self.deteccoes, limiar)
+        if self.confianca_inferencia < self.limiar_confianca:
+            return self.deteccoes.filtrar_confianca(self.limiar_confianca).para_lista()
+        return self.deteccoes.para_lista()
+
+    def liberar(self):
+        self.cap.release()
+        if self.out:
+            self.out.release()
+        if self.snapshots:
+            # Os frames precisam estar no disco antes dos alertas; os que não
+            # foram gravados deixam de constar nas detecções
+            self.snapshots.concluir(self.deteccoes)
+        if self.memoria_limitada:
+            self.deteccoes.fechar()
+        if self.monitor is not None:
+            self.monitor.parar()
+
+    def estatisticas_memoria(self):
+        if self.monitor is None:
+            return None
+        return {
+            **self.monitor.relatorio(),
+            **self.pool.estatisticas(),
+            'deteccoes_em_disco': len(self.deteccoes),
+            'diario': self.deteccoes.caminho,
+        }
+
+
+def _preparar_processamento(modelo_path, input_path, output_path=None, limiar_confianca=0.25, salvar_frames=False,
+                            frames_dir=None, tamanho_lote=None, analisar_a_cada=1, filtro_movimento=False,
+                            limiar_movimento=None, pipeline=None, capacidade_fila=None, detalhar_eventos=False,
+                            frame_inicial=0, frame_final=None, confianca_armazenada=None, backend=None, int8=None,
+                            resolucao=None, linha_tempo=False, memoria_limitada=None, orcamento_memoria_mb=None,
+                            diario_deteccoes=None):
+    """
+    Abre o vídeo e monta o processamento e o pipeline de estágios. Com
+    `frame_inicial`/`frame_final` apenas esse trecho do vídeo é processado,
+    mantendo a numeração global dos frames.
+
+    Returns:
+        tuple: (_ProcessamentoVideo, Pipeline)
+    """
+    tamanho_lote = max(1, int(tamanho_lote or TAMANHO_LOTE_PADRAO))
+    pipeline = PIPELINE_PADRAO if pipeline is None else pipeline
+
+    # Obter o modelo YOLO do pool do processo (carregado uma única vez), no
+    # formato do backend de inferência escolhido
+    modelo = obter_modelo(resolver_modelo(modelo_path, backend, int8))
+
     # Abrir o vídeo
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         raise ValueError(f"Não foi possível abrir o vídeo: {input_path}")
-    
+
     # Obter propriedades do vídeo
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
+
+    # Posicionar a leitura no início do trecho solicitado
+    frame_inicial = max(0, int(frame_inicial or 0))
+    if frame_inicial:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_inicial)
+    if frame_final is not None or frame_inicial:
+        total_frames = max(0, (frame_final if frame_final is not None else total_frames) - frame_inicial)
+
+    resolucao = escolher_resolucao(resolucao, width, height)
+
     # Configurar o writer do vídeo se output_path for fornecido
     out = None
     if output_path:
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-    
-    # Lista para armazenar informações sobre cada detecção
-    deteccoes = []
-    
-    # Processar cada frame
-    frame_num = 0
-    already_detected_frames = set()  # Para evitar detecções duplicadas no mesmo frame
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Executar a detecção no frame atual
-        resultados = modelo(frame, conf=limiar_confianca)
-        
-        # Verificar se algum objeto foi detectado neste frame
-        if len(resultados[0].boxes) > 0:
-            # Frame contém detecções
-            frame_anotado = resultados[0].plot()
-            
-            # Salvar o frame com detecções, se solicitado
-            frame_path = None
-            if salvar_frames and frames_dir and frame_num not in already_detected_frames:
-                os.makedirs(frames_dir, exist_ok=True)
-                frame_path = os.path.join(frames_dir, f"frame_{frame_num:06d}.jpg")
-                cv2.imwrite(frame_path, frame_anotado)
-                already_detected_frames.add(frame_num)
-                
-            # Obter informações detalhadas sobre cada detecção neste frame
-            for box in resultados[0].boxes:
-                # Extrair coordenadas da caixa
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                
-                # Extrair confiança
-                confianca = float(box.conf[0].cpu().numpy())
-                
-                # Extrair classe (se aplicável)
-                if hasattr(box, 'cls'):
-                    classe_id = int(box.cls[0].cpu().numpy())
-                    classe_nome = resultados[0].names[classe_id]
-                else:
-                    classe_nome = "objeto_cortante"
-                
-                # Adicionar esta detecção à lista
-                deteccoes.append({
-                    'frame_num': frame_num,
-                    'tempo': frame_num / fps if fps > 0 else 0,
-                    'classe': classe_nome,
-                    'confianca': confianca,
-                    'coordenadas': [int(x1), int(y1), int(x2), int(y2)],
-                    'frame_path': frame_path
-                })
-        else:
-            # Sem detecções, usar o frame original
-            frame_anotado = frame
-        
-        # Escrever o frame processado no vídeo de saída, se solicitado
-        if out:
-            out.write(frame_anotado)
-        
-        frame_num += 1
-        
-        # Feedback de progresso a cada 100 frames
-        if frame_num % 100 == 0:
-            print(f"Processando frame {frame_num}/{total_frames} ({frame_num/total_frames*100:.1f}%)")
-    
-    # Liberar recursos
-    cap.release()
+        out = EscritorVideo(output_path, fps, (width, height))
+
+    # Filtro opcional que evita a inferência em frames sem mudança
+    filtro = None
+    if filtro_movimento or analisar_a_cada > 1:
+        filtro = FiltroMovimento(analisar_a_cada=analisar_a_cada, detectar_movimento=filtro_movimento,
+                                 limiar_movimento=limiar_movimento)
+
+    diario = monitor = None
+    if MEMORIA_LIMITADA if memoria_limitada is None else memoria_limitada:
+        if not diario_deteccoes:
+            base = frames_dir or os.path.dirname(os.path.abspath(output_path or input_path))
+            diario_deteccoes = os.path.join(base, f"deteccoes_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.bin")
+        diario = DiarioDeteccoes(diario_deteccoes, getattr(modelo.modelo, 'names', None))
+        monitor = MonitorMemoria(orcamento_memoria_mb)
+
+    processamento = _ProcessamentoVideo(modelo, cap, out, output_path, fps, total_frames, limiar_confianca,
+                                        salvar_frames, frames_dir, tamanho_lote, filtro, detalhar_eventos,
+                                        frame_inicial, frame_final, confianca_armazenada, resolucao,
+                                        diario, monitor)
+    estagios = [('inferencia', processamento.inferir), ('anotacao', processamento.anotar)]
     if out:
-        out.release()
-    
-    return output_path, deteccoes
\ No newline at end of file
+        estagios.append(('codificacao', processamento.codificar))
+    # Na linha do tempo, cada lote é identificado pelo primeiro e pelo último frame
+    execucao = Pipeline(processamento.decodificar(), estagios,
+                        capacidade=capacidade_fila or CAPACIDADE_FILA_PADRAO, paralelo=pipeline,
+                        linha_tempo=linha_tempo, rotular=lambda lote: [lote[0][0], lote[-1][0]])
+    return processamento, execucao
+
+
+def _executar_processamento(processamento, execucao, estatisticas=None, intervalo_progresso=100, cancelar=None):
+    """
+    Executa o pipeline e produz os eventos do processamento: início, um evento
+    por frame, progresso a cada `intervalo_progresso` frames e fim.
+
+    Se `cancelar` (um Event) for sinalizado, o pipeline é interrompido e
+    `ProcessamentoCancelado` é lançada.
+    """
+    inicio = time.perf_counter()
+    total_frames = processamento.total_frames
+    yield {
+        'tipo': 'inicio',
+        'total_frames': total_frames,
+        'fps_video': processamento.fps,
+    }
+
+    monitor = processamento.monitor
+    if monitor is not None:
+        monitor.iniciar()
+
+    frames = 0
+    try:
+        for itens in execucao:
+            if cancelar is not None and cancelar.is_set():
+                raise ProcessamentoCancelado(f"Processamento cancelado após {frames} frames")
+            for _, evento in itens:
+                yield evento
+                frames += 1
+                if monitor is not None and frames % MEMORIA_INTERVALO_VERIFICACAO == 0:
+                    monitor.verificar()
+                if intervalo_progresso and frames % intervalo_progresso == 0:
+                    decorrido = time.perf_counter() - inicio
+                    yield {
+                        'tipo': 'progresso',
+                        'frames_processados': frames,
+                        'total_frames': total_frames,
+                        'percentual': round(frames / total_frames * 100, 1) if total_frames > 0 else None,
+                        'fps_processamento': round(frames / decorrido, 2) if decorrido > 0 else 0,
+                        'total_deteccoes': processamento.deteccoes_visiveis,
+                    }
+    finally:
+        # Liberar recursos
+        processamento.liberar()
+
+    tempo_total = time.perf_counter() - inicio
+    filtro = processamento.filtro
+    resumo = {
+        'frames': frames,
+        'frames_inferidos': filtro.frames_inferidos if filtro else frames,
+        'frames_ignorados': filtro.frames_ignorados if filtro else 0,
+        'tamanho_lote': processamento.tamanho_lote,
+        'resolucao_inferencia': processamento.resolucao_efetiva(),
+        'ms_inferencia_por_frame': round(processamento.tempo_inferencia * 1000 / processamento.frames_inferidos, 2)
+                                   if processamento.frames_inferidos else None,
+        'tempo_total': round(tempo_total, 3),
+        'fps_processamento': round(frames / tempo_total, 2) if tempo_total > 0 else 0,
+        'pipeline': execucao.tempos(),
+        'snapshots': processamento.snapshots.estatisticas() if processamento.snapshots else None,
+    }
+    if monitor is not None:
+        resumo['memoria'] = processamento.estatisticas_memoria()
+    # Histogramas das etapas, somados às métricas da API (ver `app.metricas.registrar_processamento`)
+    etapas = execucao.series()
+    if processamento.snapshots:
+        etapas['snapshot'] = processamento.snapshots.serie_gravacao.para_dict()
+    resumo['metricas'] = {'etapas': etapas, 'frames': frames, 'deteccoes': processamento.deteccoes_visiveis}
+    linha_tempo = execucao.obter_linha_tempo()
+    if linha_tempo is not None:
+        resumo['linha_tempo'] = linha_tempo
+    if estatisticas is not None:
+        estatisticas.update(resumo)
+
+    yield {
+        'tipo': 'fim',
+        'video_processado': processamento.output_path,
+        'total_deteccoes': processamento.deteccoes_visiveis,
+        'estatisticas': resumo,
+    }
+
+
+def processar_video(modelo_path, input_path, output_path=None, limiar_confianca=0.25, salvar_frames=False, frames_dir=None,
+                    tamanho_lote=None, estatisticas=None, analisar_a_cada=1, filtro_movimento=False,
+                    limiar_movimento=None, pipeline=None, capacidade_fila=None, exportar_deteccoes=None,
+                    cancelar=None, ao_progredir=None, frame_inicial=0, frame_final=None, confianca_armazenada=None,
+                    backend=None, int8=None, resolucao=None, linha_tempo=False, memoria_limitada=None,
+                    orcamento_memoria_mb=None, diario_deteccoes=None):
+    """
+    Processa um vídeo para detectar objetos cortantes usando YOLO.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        input_path: Caminho para o vídeo de entrada
+        output_path: Caminho para salvar o vídeo processado (opcional)
+        limiar_confianca: Limiar de confiança para considerar uma detecção
+        salvar_frames: Se deve salvar os frames onde foram detectados objetos
+        frames_dir: Diretório para salvar os frames com detecções
+        tamanho_lote: Quantidade de frames enviados ao modelo por chamada
+            (padrão: variável de ambiente TAMANHO_LOTE_INFERENCIA ou 1)
+        estatisticas: Dicionário opcional preenchido com as métricas da execução
+            (frames processados, inferidos e ignorados, tempo total, frames por
+            segundo e tempos ocupado/ocioso de cada estágio)
+        analisar_a_cada: Executa a inferência apenas em um a cada N frames
+        filtro_movimento: Se deve ignorar frames sem mudança significativa em
+            relação ao último frame analisado (vídeos de câmeras estáticas)
+        limiar_movimento: Fração mínima de pixels alterados para inferir o frame
+        pipeline: Se decodificação, inferência, anotação e codificação devem
+            rodar em threads separadas ligadas por filas limitadas
+            (padrão: variável de ambiente PIPELINE_ESTAGIOS ou ativado)
+        capacidade_fila: Quantidade máxima de lotes em cada fila do pipeline
+        exportar_deteccoes: Caminho opcional (.npz ou .parquet) para salvar as
+            detecções em formato colunar para análise offline
+        cancelar: Event opcional; quando sinalizado, interrompe o processamento
+            com `ProcessamentoCancelado`
+        ao_progredir: Função opcional chamada com cada evento de progresso (por
+            padrão o progresso é impresso no console)
+        frame_inicial: Primeiro frame a processar (os índices e tempos das
+            detecções continuam relativos ao vídeo completo)
+        frame_final: Frame em que o processamento para (exclusivo)
+        confianca_armazenada: Confiança mínima das detecções exportadas em
+            `exportar_deteccoes`; se menor que `limiar_confianca`, a inferência
+            usa esse valor e apenas o vídeo, os frames salvos e a lista
+            retornada são filtrados por `limiar_confianca`
+        backend: Backend de inferência: 'torch', 'onnxruntime' ou 'openvino'
+            (padrão: variável de ambiente BACKEND_INFERENCIA ou torch)
+        int8: Se os backends exportados devem usar o modelo quantizado em INT8
+        resolucao: Lado maior da entrada do modelo (ex.: 320, 480, 640) ou
+            "auto" para escolher pelo tamanho do vídeo; menor resolução troca
+            precisão em objetos pequenos por mais frames por segundo
+            (padrão: resolução padrão do modelo)
+        linha_tempo: Se `estatisticas['linha_tempo']` deve receber o início e a
+            duração de cada lote em cada estágio (ver `Pipeline.obter_linha_tempo`)
+        memoria_limitada: Se a memória deve ficar limitada independentemente
+            da duração do vídeo: as detecções vão para um diário em disco, os
+            buffers dos frames são reaproveitados e o processamento é
+            interrompido com `MemoriaExcedida` se passar do orçamento
+            (padrão: variável de ambiente MEMORIA_LIMITADA ou desativado)
+        orcamento_memoria_mb: Crescimento máximo da memória no modo de memória
+            limitada (padrão: variável de ambiente MEMORIA_ORCAMENTO_MB)
+        diario_deteccoes: Arquivo do diário de detecções no modo de memória
+            limitada (padrão: um arquivo novo em `frames_dir` ou ao lado do vídeo)
+
+    Returns:
+        tuple: (caminho do vídeo processado, lista de detecções). No modo de
+        memória limitada, a lista é um `DeteccoesEmDisco`, iterável na ordem
+        dos frames
+    """
+    processamento, execucao = _preparar_processamento(
+        modelo_path, input_path, output_path=output_path, limiar_confianca=limiar_confianca,
+        salvar_frames=salvar_frames, frames_dir=frames_dir, tamanho_lote=tamanho_lote,
+        analisar_a_cada=analisar_a_cada, filtro_movimento=filtro_movimento, limiar_movimento=limiar_movimento,
+        pipeline=pipeline, capacidade_fila=capacidade_fila, frame_inicial=frame_inicial, frame_final=frame_final,
+        confianca_armazenada=confianca_armazenada, backend=backend, int8=int8, resolucao=resolucao,
+        linha_tempo=linha_tempo, memoria_limitada=memoria_limitada, orcamento_memoria_mb=orcamento_memoria_mb,
+        diario_deteccoes=diario_deteccoes
+    )
+
+    for evento in _executar_processamento(processamento, execucao, estatisticas, cancelar=cancelar):
+        if evento['tipo'] != 'progresso':
+            continue
+        if ao_progredir:
+            ao_progredir(evento)
+        else:
+            # Feedback de progresso a cada 100 frames
+            percentual = f" ({evento['percentual']:.1f}%)" if evento['percentual'] is not None else ""
+            print(f"Processando frame {evento['frames_processados']}/{evento['total_frames']}{percentual}")
+
+    if exportar_deteccoes:
+        processamento.deteccoes.exportar(exportar_deteccoes)
+
+    return output_path, processamento.lista_deteccoes()
+
+
+def processar_video_stream(modelo_path, input_path, intervalo_progresso=100, exportar_deteccoes=None, **opcoes):
+    """
+    Versão em gerador de `processar_video`: produz os resultados de cada frame à
+    medida que são processados, em vez de esperar o fim do vídeo.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        input_path: Caminho para o vídeo de entrada
+        intervalo_progresso: Emitir um evento de progresso a cada N frames
+        exportar_deteccoes: Caminho opcional (.npz ou .parquet) para salvar as
+            detecções ao final
+        **opcoes: Demais opções de `processar_video` (output_path,
+            limiar_confianca, salvar_frames, frames_dir, tamanho_lote...)
+
+    Yields:
+        dict: Eventos com a chave 'tipo':
+            - 'inicio': total de frames e fps do vídeo
+            - 'frame': frame_num, tempo, se foi inferido e as detecções do frame
+            - 'progresso': frames processados, percentual, frames por segundo
+            - 'fim': caminho do vídeo processado, total de detecções, eventos
+              (detecções agrupadas pelo rastreador) e estatísticas
+    """
+    estatisticas = opcoes.pop('estatisticas', None)
+    cancelar = opcoes.pop('cancelar', None)
+    processamento, execucao = _preparar_processamento(modelo_path, input_path, detalhar_eventos=True, **opcoes)
+    for evento in _executar_processamento(processamento, execucao, estatisticas, intervalo_progresso, cancelar):
+        if evento['tipo'] == 'fim':
+            # As detecções estão na ordem dos frames; no modo de memória
+            # limitada elas são agrupadas lendo o diário, sem carregá-las
+            deteccoes = processamento.lista_deteccoes()
+            evento['eventos'] = (agrupar_eventos_em_ordem(deteccoes) if processamento.memoria_limitada
+                                 else agrupar_eventos(deteccoes))
+        yield evento
+
+    if exportar_deteccoes:
+        processamento.deteccoes.exportar(exportar_deteccoes)
+
+
+def renderizar_deteccoes(input_path, armazem, output_path=None, frames_dir=None):
+    """
+    Gera o vídeo anotado e/ou os frames com detecções a partir de detecções já
+    conhecidas (ex.: vindas do cache de resultados), sem executar o modelo.
+
+    Args:
+        input_path: Caminho para o vídeo de entrada
+        armazem: ArmazemDeteccoes com as detecções a desenhar
+        output_path: Caminho para salvar o vídeo anotado (opcional)
+        frames_dir: Diretório para salvar os frames com detecções (opcional)
+
+    Returns:
+        ArmazemDeteccoes: O próprio armazém, com os caminhos dos frames salvos
+    """
+    from ultralytics.utils.plotting import Annotator, colors
+
+    registros = armazem.registros
+    por_frame = {}
+    for indice, frame_num in enumerate(registros['frame_num'].tolist()):
+        por_frame.setdefault(frame_num, []).append(indice)
+    ultimo_frame = max(por_frame) if por_frame else -1
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError(f"Não foi possível abrir o vídeo: {input_path}")
+
+    out = None
+    if output_path:
+        out = EscritorVideo(output_path, cap.get(cv2.CAP_PROP_FPS),
+                            (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+    snapshots = GravadorSnapshots(frames_dir) if frames_dir else None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    frame_num = 0
+    try:
+        while out is not None or frame_num <= ultimo_frame:
+            indices = por_frame.get(frame_num)
+            if out is None and indices is None:
+                # Sem vídeo de saída, os frames sem detecções não precisam ser convertidos
+                if not cap.grab():
+                    break
+                frame_num += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            salvar = bool(indices) and snapshots is not None and snapshots.deve_salvar(
+                frame, frame_num / fps if fps > 0 else 0,
+                np.stack([registros[c][indices] for c in ('x1', 'y1', 'x2', 'y2')], axis=1))
+            if indices and (salvar or out is not None):
+                anotador = Annotator(frame, example=str(armazem.nomes))
+                for indice in indices:
+                    registro = registros[indice]
+                    classe_id = int(registro['classe_id'])
+                    rotulo = f"{armazem.nomes.get(classe_id, 'objeto_cortante')} {float(registro['confianca']):.2f}"
+                    caixa = [int(registro['x1']), int(registro['y1']), int(registro['x2']), int(registro['y2'])]
+                    anotador.box_label(caixa, rotulo, color=colors(classe_id, True))
+                frame = anotador.result()
+                if salvar:
+                    armazem.frame_paths[frame_num] = snapshots.salvar(frame_num, frame)
+            if out is not None:
+                out.write(frame)
+            frame_num += 1
+    finally:
+        cap.release()
+        if out is not None:
+            out.release()
+        if snapshots is not None:
+            snapshots.concluir(armazem)
+    return armazem
+
+
+def comparar_tamanhos_lote(modelo_path, input_path, tamanhos=(1, 4, 8, 16), limiar_confianca=0.25):
+    """
+    Mede os frames por segundo de `processar_video` para cada tamanho de lote e
+    confere se as detecções são as mesmas do processamento frame a frame.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        input_path: Caminho para o vídeo usado na medição
+        tamanhos: Tamanhos de lote a comparar (o lote 1 é sempre incluído como referência)
+        limiar_confianca: Limiar de confiança usado em todas as execuções
+
+    Returns:
+        list: Um dicionário por tamanho de lote com fps, tempo, aceleração em
+        relação ao lote 1 e se as detecções coincidem com as do lote 1
+    """
+    # Aquecer o modelo para que a primeira medição não inclua a carga
+    obter_modelo(modelo_path, aquecer=True)
+
+    tamanhos = [1] + [t for t in tamanhos if t != 1]
+    referencia = None
+    fps_referencia = None
+    comparacao = []
+    for tamanho in tamanhos:
+        estatisticas = {}
+        _, deteccoes = processar_video(modelo_path, input_path, limiar_confianca=limiar_confianca,
+                                       tamanho_lote=tamanho, estatisticas=estatisticas)
+        if referencia is None:
+            referencia = deteccoes
+            fps_referencia = estatisticas['fps_processamento']
+
+        # As coordenadas são inteiras; a confiança pode variar no arredondamento
+        # de ponto flutuante entre kernels em lote e individuais
+        identicas = len(deteccoes) == len(referencia) and all(
+            a['frame_num'] == b['frame_num'] and a['classe'] == b['classe']
+            and a['coordenadas'] == b['coordenadas'] and abs(a['confianca'] - b['confianca']) < 1e-3
+            for a, b in zip(deteccoes, referencia)
+        )
+        comparacao.append({
+            'tamanho_lote': tamanho,
+            'frames': estatisticas['frames'],
+            'tempo_total': estatisticas['tempo_total'],
+            'fps_processamento': estatisticas['fps_processamento'],
+            'aceleracao': round(estatisticas['fps_processamento'] / fps_referencia, 2) if fps_referencia else None,
+            'deteccoes_identicas': identicas,
+        })
+    return comparacao
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compara o desempenho da inferência em lote com a inferência frame a frame.")
+    parser.add_argument("video", help="Caminho do vídeo usado na medição")
+    parser.add_argument("--modelo", default=os.environ.get('MODELO_PATH', 'models/objeto_cortante.pt'))
+    parser.add_argument("--lotes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--limiar", type=float, default=0.25)
+    args = parser.parse_args()
+
+    print(json.dumps(comparar_tamanhos_lote(args.modelo, args.video, args.lotes, args.limiar), indent=2))
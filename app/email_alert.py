@@ -1,7 +1,45 @@
+import os
+import time
+import queue
+import base64
+import asyncio
+import logging
 import smtplib
+import threading
 from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 
+import cv2
+import numpy as np
+
+from app import metricas
+from app.alerta_telegram import _formatar_tempo
+from app.rastreamento import eventos_representativos
+
+logger = logging.getLogger(__name__)
+
+# Servidor SMTP usado nos resumos; sem SMTP_USUARIO, os resumos vão pela API Lambda (URL_LAMBDA)
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORTA = int(os.environ.get('SMTP_PORTA', 587))
+SMTP_USUARIO = os.environ.get('SMTP_USUARIO')
+SMTP_SENHA = os.environ.get('SMTP_SENHA')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1').lower() in ('1', 'true', 'sim')
+EMAIL_REMETENTE = os.environ.get('EMAIL_REMETENTE') or SMTP_USUARIO
+
+# Frames representativos por resumo e tamanho das miniaturas anexadas
+MAX_MINIATURAS_RESUMO = int(os.environ.get('MAX_MINIATURAS_RESUMO', 6))
+LARGURA_MINIATURA = int(os.environ.get('LARGURA_MINIATURA', 480))
+QUALIDADE_MINIATURA = int(os.environ.get('QUALIDADE_MINIATURA', 80))
+
+# Duração (em segundos) da janela de eventos agrupados em cada e-mail; 0 envia
+# um único resumo por vídeo
+EMAIL_JANELA_RESUMO_S = float(os.environ.get('EMAIL_JANELA_RESUMO_S', 0))
+
+# Envios de e-mail simultâneos (e conexões SMTP mantidas abertas)
+EMAIL_ENVIOS_SIMULTANEOS = int(os.environ.get('EMAIL_ENVIOS_SIMULTANEOS', 4))
+
+
 def enviar_email_alerta(destinatario, remetente, senha_remetente, video_nome):
     assunto = "Alerta: Objeto cortante detectado"
     corpo = f"Foi detectado um objeto cortante no vídeo: {video_nome}"
@@ -22,3 +60,255 @@ def enviar_email_alerta(destinatario, remetente, senha_remetente, video_nome):
     except Exception as e:
         print(f"Erro ao enviar e-mail: {e}")
         return False
+
+
+def gerar_miniatura(caminho, largura_maxima=None):
+    """
+    Lê um frame salvo e o reduz para a largura máxima das miniaturas.
+
+    Returns:
+        np.ndarray: Imagem reduzida, ou None se o arquivo não puder ser lido
+    """
+    largura_maxima = largura_maxima or LARGURA_MINIATURA
+    imagem = cv2.imread(caminho) if caminho else None
+    if imagem is None:
+        return None
+    altura, largura = imagem.shape[:2]
+    if largura > largura_maxima:
+        imagem = cv2.resize(imagem, (largura_maxima, round(altura * largura_maxima / largura)),
+                            interpolation=cv2.INTER_AREA)
+    return imagem
+
+
+def codificar_jpeg(imagem, qualidade=None):
+    """Codifica uma imagem em JPEG e retorna os bytes."""
+    ok, buffer = cv2.imencode('.jpg', imagem, [cv2.IMWRITE_JPEG_QUALITY, qualidade or QUALIDADE_MINIATURA])
+    if not ok:
+        raise ValueError("Não foi possível codificar a miniatura em JPEG")
+    return buffer.tobytes()
+
+
+def montar_mosaico(imagens, colunas=2):
+    """
+    Junta as miniaturas em uma única imagem em grade, para transportes que
+    aceitam apenas uma imagem por mensagem (API Lambda).
+    """
+    altura = max(imagem.shape[0] for imagem in imagens)
+    largura = max(imagem.shape[1] for imagem in imagens)
+    colunas = min(colunas, len(imagens))
+    linhas = -(-len(imagens) // colunas)
+    mosaico = np.zeros((linhas * altura, colunas * largura, 3), dtype=np.uint8)
+    for i, imagem in enumerate(imagens):
+        y, x = (i // colunas) * altura, (i % colunas) * largura
+        mosaico[y:y + imagem.shape[0], x:x + imagem.shape[1]] = imagem
+    return mosaico
+
+
+def agrupar_em_janelas(eventos, janela=None):
+    """
+    Agrupa os eventos (ordenados pelo início) em janelas de `janela` segundos;
+    com janela 0, todos os eventos ficam em um único grupo.
+    """
+    janela = EMAIL_JANELA_RESUMO_S if janela is None else janela
+    if not eventos:
+        return []
+    if janela <= 0:
+        return [list(eventos)]
+    grupos = []
+    for evento in eventos:
+        if not grupos or evento['inicio'] - grupos[-1][0]['inicio'] >= janela:
+            grupos.append([])
+        grupos[-1].append(evento)
+    return grupos
+
+
+def montar_resumo(video_nome, eventos, max_miniaturas=None):
+    """
+    Monta o conteúdo de um e-mail de resumo: assunto, texto e as miniaturas
+    dos eventos mais representativos (maior confiança).
+
+    Returns:
+        tuple: (assunto, texto, lista de miniaturas como np.ndarray)
+    """
+    representativos = eventos_representativos(eventos, max_miniaturas or MAX_MINIATURAS_RESUMO)
+    inicio, fim = eventos[0]['inicio'], max(evento['fim'] for evento in eventos)
+    assunto = f"Alerta: {len(eventos)} ocorrência(s) de objeto cortante em {video_nome}"
+    linhas = [
+        f"Foram detectadas {len(eventos)} ocorrência(s) de objetos cortantes no vídeo {video_nome}, "
+        f"entre {_formatar_tempo(inicio)} e {_formatar_tempo(fim)}.",
+        "",
+    ]
+    for evento in eventos:
+        linhas.append(f"- {_formatar_tempo(evento['inicio'])} a {_formatar_tempo(evento['fim'])}: {evento['classe']}, "
+                      f"confiança máxima {evento['confianca_maxima'] * 100:.1f}% (frame #{evento['melhor_frame']})")
+    if representativos:
+        linhas += ["", f"Em anexo, os frames das {len(representativos)} ocorrência(s) de maior confiança."]
+    miniaturas = [m for m in (gerar_miniatura(evento.get('frame_path')) for evento in representativos) if m is not None]
+    return assunto, "\n".join(linhas), miniaturas
+
+
+class PoolSMTP:
+    """
+    Conexões SMTP autenticadas reaproveitadas entre os envios, em vez de uma
+    sessão nova (conexão, TLS e login) por mensagem. Seguro para uso por
+    várias threads.
+    """
+
+    def __init__(self, host=None, porta=None, usuario=None, senha=None, starttls=None, tamanho=None):
+        self.host = host or SMTP_HOST
+        self.porta = porta or SMTP_PORTA
+        self.usuario = usuario or SMTP_USUARIO
+        self.senha = senha or SMTP_SENHA
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.livres = queue.LifoQueue()
+        self.vagas = threading.BoundedSemaphore(tamanho or EMAIL_ENVIOS_SIMULTANEOS)
+
+    def _conectar(self):
+        conexao = smtplib.SMTP(self.host, self.porta, timeout=30)
+        if self.starttls:
+            conexao.starttls()
+        if self.usuario:
+            conexao.login(self.usuario, self.senha)
+        return conexao
+
+    def enviar(self, mensagem):
+        """Envia um `email.message.Message`, reconectando uma vez se a conexão tiver caído."""
+        with self.vagas:
+            try:
+                conexao = self.livres.get_nowait()
+            except queue.Empty:
+                conexao = self._conectar()
+            try:
+                try:
+                    conexao.send_message(mensagem)
+                except smtplib.SMTPServerDisconnected:
+                    # O servidor encerra conexões ociosas; abrir outra e tentar de novo
+                    conexao = self._conectar()
+                    conexao.send_message(mensagem)
+            except Exception:
+                _encerrar_smtp(conexao)
+                raise
+            self.livres.put(conexao)
+
+    def fechar(self):
+        """Encerra as conexões abertas."""
+        while True:
+            try:
+                _encerrar_smtp(self.livres.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _encerrar_smtp(conexao):
+    try:
+        conexao.quit()
+    except Exception:
+        conexao.close()
+
+
+class DespachanteEmail:
+    """
+    Envia os alertas por e-mail como resumos: uma mensagem por vídeo (ou por
+    janela de eventos, com EMAIL_JANELA_RESUMO_S), com miniaturas JPEG dos
+    frames mais representativos, em vez de uma chamada por detecção.
+
+    Com SMTP configurado (SMTP_USUARIO), as miniaturas vão anexadas e as
+    conexões SMTP são reaproveitadas (`PoolSMTP`); caso contrário, o resumo é
+    enviado à API Lambda (URL_LAMBDA) em uma única requisição, com as
+    miniaturas em um mosaico, por um cliente HTTP com conexões persistentes.
+    Os resumos são enviados em paralelo, até EMAIL_ENVIOS_SIMULTANEOS por vez.
+    """
+
+    def __init__(self, url_lambda=None, pool_smtp=None, remetente=None, envios_simultaneos=None):
+        """
+        Args:
+            url_lambda: URL da API Lambda de envio de e-mails
+            pool_smtp: `PoolSMTP` a usar (padrão: criado se SMTP_USUARIO estiver definido)
+            remetente: Endereço do remetente nos envios por SMTP (padrão: EMAIL_REMETENTE)
+            envios_simultaneos: Resumos enviados em paralelo (padrão: EMAIL_ENVIOS_SIMULTANEOS)
+        """
+        self.url_lambda = url_lambda
+        self.pool_smtp = pool_smtp if pool_smtp is not None else (PoolSMTP() if SMTP_USUARIO else None)
+        self.remetente = remetente or EMAIL_REMETENTE
+        self.envios_simultaneos = envios_simultaneos or EMAIL_ENVIOS_SIMULTANEOS
+        self.cliente = None
+        self.semaforo = None
+
+    async def iniciar(self):
+        """Cria o cliente HTTP e o limite de envios simultâneos (no event loop atual)."""
+        import httpx
+
+        if self.semaforo is None:
+            self.semaforo = asyncio.Semaphore(self.envios_simultaneos)
+        if self.cliente is None and self.pool_smtp is None and self.url_lambda:
+            self.cliente = httpx.AsyncClient(timeout=60.0, limits=httpx.Limits(
+                max_connections=self.envios_simultaneos, max_keepalive_connections=self.envios_simultaneos))
+
+    async def encerrar(self):
+        """Libera as conexões HTTP e SMTP."""
+        if self.cliente is not None:
+            await self.cliente.aclose()
+            self.cliente = None
+        if self.pool_smtp is not None:
+            await asyncio.to_thread(self.pool_smtp.fechar)
+
+    def _mensagem_smtp(self, destinatario, assunto, texto, miniaturas):
+        mensagem = MIMEMultipart()
+        mensagem['From'] = self.remetente
+        mensagem['To'] = destinatario
+        mensagem['Subject'] = assunto
+        mensagem.attach(MIMEText(texto, 'plain'))
+        for i, miniatura in enumerate(miniaturas, start=1):
+            anexo = MIMEImage(codificar_jpeg(miniatura), _subtype='jpeg')
+            anexo.add_header('Content-Disposition', 'attachment', filename=f"ocorrencia_{i}.jpg")
+            mensagem.attach(anexo)
+        return mensagem
+
+    async def _enviar_resumo(self, destinatario, video_nome, eventos):
+        assunto, texto, miniaturas = await asyncio.to_thread(montar_resumo, video_nome, eventos)
+        async with self.semaforo:
+            if self.pool_smtp is not None:
+                mensagem = await asyncio.to_thread(self._mensagem_smtp, destinatario, assunto, texto, miniaturas)
+                await asyncio.to_thread(self.pool_smtp.enviar, mensagem)
+                return True
+
+            payload = {"email": destinatario, "mensagem": texto}
+            if miniaturas:
+                mosaico = await asyncio.to_thread(lambda: codificar_jpeg(montar_mosaico(miniaturas)))
+                payload["imagemBase64"] = f"data:image/jpeg;base64,{base64.b64encode(mosaico).decode('utf-8')}"
+            resposta = await self.cliente.post(self.url_lambda, json=payload)
+            if resposta.status_code != 200:
+                logger.error(f"Falha ao enviar e-mail pela API Lambda. Status: {resposta.status_code}")
+            return resposta.status_code == 200
+
+    async def enviar_resumos(self, destinatario, video_nome, eventos, janela=None):
+        """
+        Envia os resumos dos eventos de um vídeo.
+
+        Args:
+            destinatario: E-mail do destinatário
+            video_nome: Nome do vídeo analisado
+            eventos: Eventos da análise (ver `app.rastreamento.agrupar_eventos`)
+            janela: Segundos de vídeo por resumo (padrão: EMAIL_JANELA_RESUMO_S)
+
+        Returns:
+            dict: Quantidade de resumos e quantos foram enviados com sucesso
+        """
+        if self.pool_smtp is None and not self.url_lambda:
+            raise ValueError("Nenhum transporte de e-mail configurado (defina SMTP_USUARIO ou URL_LAMBDA)")
+        await self.iniciar()
+        grupos = agrupar_em_janelas(eventos, janela)
+
+        async def enviar(grupo):
+            inicio = time.perf_counter()
+            try:
+                return await self._enviar_resumo(destinatario, video_nome, grupo)
+            finally:
+                metricas.DURACAO_ALERTA.observar(time.perf_counter() - inicio, canal='email')
+
+        resultados = await asyncio.gather(*(enviar(grupo) for grupo in grupos), return_exceptions=True)
+        for resultado in resultados:
+            if isinstance(resultado, Exception):
+                logger.error(f"Erro ao enviar resumo por e-mail: {str(resultado)}")
+            metricas.ALERTAS.incrementar(canal='email', resultado='enviado' if resultado is True else 'falha')
+        return {'resumos': len(grupos), 'enviados': sum(1 for r in resultados if r is True)}
@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Arquivo do índice, gravado na raiz do dataset
+INDICE_DATASET_ARQUIVO = os.environ.get('INDICE_DATASET_ARQUIVO', '.indice_dataset.json')
+
+# Threads lendo os arquivos de rótulos ao mesmo tempo. A leitura é dominada
+# pela abertura dos arquivos (milhares de arquivos pequenos, muitas vezes em
+# disco de rede ou no Drive), não pelo parsing
+INDICE_DATASET_WORKERS = int(os.environ.get('INDICE_DATASET_WORKERS', min(32, (os.cpu_count() or 1) * 4)))
+
+# Splits do dataset no formato exportado pelo Roboflow (YOLO)
+SPLITS_DATASET = ('train', 'valid', 'test')
+
+# Limites da área relativa das caixas (fração da imagem) entre pequenas, médias e grandes
+LIMITES_AREA = (0.01, 0.1)
+FAIXAS_AREA = ('pequena', 'media', 'grande')
+
+# Erros listados no resumo (o total é sempre informado)
+ERROS_EXIBIDOS = 50
+
+# Muda quando o conteúdo das entradas muda; um índice de outra versão é refeito
+VERSAO_INDICE = 1
+
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def ler_rotulos(caminho):
+    """
+    Lê um arquivo de rótulos YOLO (`classe x y largura altura` ou
+    `classe x1 y1 x2 y2 ...` para polígonos, coordenadas normalizadas).
+
+    Returns:
+        dict: Contagem por classe, quantidade de caixas, somas das larguras e
+        alturas, quantidade de caixas por faixa de área e erros por linha
+    """
+    entrada = {'classes': {}, 'caixas': 0, 'soma_largura': 0.0, 'soma_altura': 0.0,
+               'tamanhos': [0] * len(FAIXAS_AREA), 'erros': []}
+    try:
+        with open(caminho, 'r') as arquivo:
+            linhas = arquivo.read().splitlines()
+    except (OSError, UnicodeDecodeError) as e:
+        entrada['erros'].append(f"não foi possível ler: {str(e)}")
+        return entrada
+
+    for numero, linha in enumerate(linhas, 1):
+        partes = linha.split()
+        if not partes:
+            continue
+        try:
+            classe = int(partes[0])
+            valores = [float(valor) for valor in partes[1:]]
+        except ValueError:
+            entrada['erros'].append(f"linha {numero}: valor não numérico")
+            continue
+        if classe < 0:
+            entrada['erros'].append(f"linha {numero}: classe negativa ({classe})")
+            continue
+        if len(valores) == 4:
+            largura, altura = valores[2], valores[3]
+        elif len(valores) >= 6 and len(valores) % 2 == 0:
+            # Polígono (segmentação): a caixa é a que envolve os pontos
+            xs, ys = valores[0::2], valores[1::2]
+            largura, altura = max(xs) - min(xs), max(ys) - min(ys)
+        else:
+            entrada['erros'].append(f"linha {numero}: {len(partes)} valores (esperado 5, ou polígono)")
+            continue
+        if any(valor < 0 or valor > 1 for valor in valores):
+            entrada['erros'].append(f"linha {numero}: coordenadas fora de [0, 1]")
+            continue
+        if largura <= 0 or altura <= 0:
+            entrada['erros'].append(f"linha {numero}: caixa vazia")
+            continue
+
+        chave = str(classe)
+        entrada['classes'][chave] = entrada['classes'].get(chave, 0) + 1
+        entrada['caixas'] += 1
+        entrada['soma_largura'] += largura
+        entrada['soma_altura'] += altura
+        area = largura * altura
+        entrada['tamanhos'][sum(area >= limite for limite in LIMITES_AREA)] += 1
+    return entrada
+
+
+class IndiceDataset:
+    """
+    Índice dos rótulos de um dataset YOLO: histograma de classes, tamanhos
+    das caixas e erros de cada arquivo de rótulos, além do pareamento entre
+    imagens e rótulos de cada split.
+
+    O índice é gravado em `<dataset>/INDICE_DATASET_ARQUIVO` com o mtime e o
+    tamanho de cada arquivo de rótulos; ao atualizar, apenas os arquivos
+    novos ou alterados são lidos (em paralelo), então repetir a indexação de
+    um dataset grande custa apenas a listagem dos diretórios.
+    """
+
+    def __init__(self, caminho_dataset, arquivo_indice=None, workers=None):
+        """
+        Args:
+            caminho_dataset: Raiz do dataset (com train/, valid/ e test/)
+            arquivo_indice: Caminho do índice (padrão: INDICE_DATASET_ARQUIVO na raiz do dataset)
+            workers: Threads lendo os rótulos (padrão: INDICE_DATASET_WORKERS)
+        """
+        self.caminho_dataset = caminho_dataset
+        self.arquivo_indice = arquivo_indice or os.path.join(caminho_dataset, INDICE_DATASET_ARQUIVO)
+        self.workers = max(1, int(workers or INDICE_DATASET_WORKERS))
+        self.rotulos = {}  # caminho relativo -> entrada de `ler_rotulos` com mtime_ns e tamanho
+        self.arquivos_lidos = 0
+
+    def carregar(self):
+        try:
+            with open(self.arquivo_indice, 'r') as arquivo:
+                dados = json.load(arquivo)
+        except FileNotFoundError:
+            return self
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Índice do dataset ignorado ({self.arquivo_indice}): {str(e)}")
+            return self
+        if dados.get('versao') == VERSAO_INDICE:
+            self.rotulos = dados.get('rotulos', {})
+        return self
+
+    def salvar(self):
+        temporario = self.arquivo_indice + '.tmp'
+        try:
+            with open(temporario, 'w') as arquivo:
+                json.dump({'versao': VERSAO_INDICE, 'rotulos': self.rotulos}, arquivo)
+            os.replace(temporario, self.arquivo_indice)
+        except OSError as e:
+            # Dataset somente leitura: o índice vale apenas para esta execução
+            logger.warning(f"Não foi possível gravar o índice do dataset: {str(e)}")
+
+    def _listar(self, diretorio, extensoes):
+        """Arquivos do diretório com as extensões dadas: nome sem extensão -> DirEntry."""
+        try:
+            entradas = list(os.scandir(diretorio))
+        except FileNotFoundError:
+            return None
+        return {os.path.splitext(entrada.name)[0]: entrada for entrada in entradas
+                if entrada.is_file() and entrada.name.lower().endswith(extensoes)}
+
+    def atualizar(self):
+        """
+        Lista os splits, relê os rótulos novos ou alterados, remove do índice
+        os apagados e grava o índice se algo mudou.
+
+        Returns:
+            dict: Resumo do dataset (ver `resumo`)
+        """
+        inicio = time.perf_counter()
+        if not self.rotulos:
+            self.carregar()
+
+        splits = {}
+        a_ler = []
+        vistos = set()
+        for split in SPLITS_DATASET:
+            imagens = self._listar(os.path.join(self.caminho_dataset, split, 'images'), EXTENSOES_IMAGEM)
+            rotulos = self._listar(os.path.join(self.caminho_dataset, split, 'labels'), ('.txt',))
+            if imagens is None and rotulos is None:
+                continue
+            imagens, rotulos = imagens or {}, rotulos or {}
+            splits[split] = (imagens, rotulos)
+            for entrada in rotulos.values():
+                relativo = os.path.join(split, 'labels', entrada.name)
+                vistos.add(relativo)
+                stat = entrada.stat()
+                atual = self.rotulos.get(relativo)
+                if atual is None or atual['mtime_ns'] != stat.st_mtime_ns or atual['tamanho'] != stat.st_size:
+                    a_ler.append((relativo, entrada.path, stat))
+
+        removidos = [relativo for relativo in self.rotulos if relativo not in vistos]
+        for relativo in removidos:
+            del self.rotulos[relativo]
+
+        if a_ler:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(a_ler))) as executor:
+                lidos = executor.map(lambda item: ler_rotulos(item[1]), a_ler)
+                for (relativo, _, stat), entrada in zip(a_ler, lidos):
+                    entrada['mtime_ns'] = stat.st_mtime_ns
+                    entrada['tamanho'] = stat.st_size
+                    self.rotulos[relativo] = entrada
+        self.arquivos_lidos = len(a_ler)
+        if a_ler or removidos:
+            self.salvar()
+
+        resumo = self.resumo(splits)
+        resumo['tempo'] = round(time.perf_counter() - inicio, 3)
+        logger.info(f"Dataset {self.caminho_dataset} indexado: {len(self.rotulos)} rótulos, "
+                    f"{self.arquivos_lidos} lidos em {resumo['tempo']}s")
+        return resumo
+
+    def resumo(self, splits):
+        """
+        Args:
+            splits: Dicionário split -> (imagens, rótulos) listados por `atualizar`
+
+        Returns:
+            dict: Por split, imagens, rótulos, imagens sem rótulo (fundo),
+            caixas, histograma de classes, caixas por faixa de área e
+            largura/altura médias; no total, o histograma de classes, `nc`
+            (maior classe + 1), os erros (até ERROS_EXIBIDOS) e quantos
+            arquivos foram lidos nesta atualização
+        """
+        resumo = {'dataset': self.caminho_dataset, 'splits': {}, 'classes': {}, 'nc': 0, 'erros': [],
+                  'total_erros': 0, 'rotulos_lidos': self.arquivos_lidos}
+        for split, (imagens, rotulos) in splits.items():
+            dados = {'imagens': len(imagens), 'rotulos': len(rotulos),
+                     'imagens_sem_rotulo': sum(1 for nome in imagens if nome not in rotulos),
+                     'caixas': 0, 'classes': {}, 'tamanhos': dict.fromkeys(FAIXAS_AREA, 0)}
+            soma_largura = soma_altura = 0.0
+            erros = []
+            for nome, entrada in sorted(rotulos.items()):
+                relativo = os.path.join(split, 'labels', entrada.name)
+                if nome not in imagens:
+                    erros.append({'arquivo': relativo, 'erro': 'rótulo sem imagem'})
+                indice = self.rotulos[relativo]
+                erros.extend({'arquivo': relativo, 'erro': erro} for erro in indice['erros'])
+                dados['caixas'] += indice['caixas']
+                soma_largura += indice['soma_largura']
+                soma_altura += indice['soma_altura']
+                for classe, quantidade in indice['classes'].items():
+                    dados['classes'][classe] = dados['classes'].get(classe, 0) + quantidade
+                for faixa, quantidade in zip(FAIXAS_AREA, indice['tamanhos']):
+                    dados['tamanhos'][faixa] += quantidade
+            dados['largura_media'] = round(soma_largura / dados['caixas'], 4) if dados['caixas'] else None
+            dados['altura_media'] = round(soma_altura / dados['caixas'], 4) if dados['caixas'] else None
+            dados['erros'] = len(erros)
+            resumo['splits'][split] = dados
+
+            for classe, quantidade in dados['classes'].items():
+                resumo['classes'][classe] = resumo['classes'].get(classe, 0) + quantidade
+            resumo['total_erros'] += len(erros)
+            resumo['erros'].extend(erros[:ERROS_EXIBIDOS - len(resumo['erros'])])
+
+        resumo['classes'] = dict(sorted(resumo['classes'].items(), key=lambda item: int(item[0])))
+        # Os ids das classes são índices: com as classes 0 e 2, o modelo precisa de 3 saídas
+        resumo['nc'] = max((int(classe) for classe in resumo['classes']), default=-1) + 1
+        return resumo
+
+
+def indexar_dataset(caminho_dataset, **opcoes):
+    """
+    Atualiza o índice do dataset e retorna o resumo (ver `IndiceDataset`).
+
+    Args:
+        caminho_dataset: Raiz do dataset
+        **opcoes: Parâmetros de `IndiceDataset` (arquivo_indice, workers)
+    """
+    return IndiceDataset(caminho_dataset, **opcoes).atualizar()
+
+
+def verificar_dataset(resumo):
+    """
+    Problemas que impedem o treinamento, a partir do resumo do índice.
+
+    Returns:
+        list: Mensagens dos problemas (vazia se o dataset pode ser usado)
+    """
+    problemas = []
+    treino = resumo['splits'].get('train')
+    if not treino or not treino['imagens']:
+        problemas.append("O split train não tem imagens (esperado train/images)")
+    elif not treino['caixas']:
+        problemas.append("Nenhuma caixa válida nos rótulos de train/labels")
+    if not resumo['splits'].get('valid', {}).get('imagens'):
+        problemas.append("O split valid não tem imagens (esperado valid/images)")
+    return problemas
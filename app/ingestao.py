@@ -0,0 +1,210 @@
+import os
+import re
+import uuid
+import asyncio
+import hashlib
+import logging
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Diretório onde os vídeos recebidos são gravados
+DIRETORIO_UPLOADS = os.environ.get('DIRETORIO_UPLOADS', 'videos/input')
+
+# Tamanho máximo aceito para um vídeo enviado
+TAMANHO_MAXIMO_UPLOAD_MB = float(os.environ.get('TAMANHO_MAXIMO_UPLOAD_MB', 2048))
+
+# Tamanho dos blocos lidos do upload e gravados em disco
+TAMANHO_BLOCO_UPLOAD = int(float(os.environ.get('TAMANHO_BLOCO_UPLOAD_MB', 4)) * 1024 * 1024)
+
+
+class UploadRejeitado(Exception):
+    """Lançada quando o vídeo enviado é grande demais ou não pode ser decodificado."""
+
+    def __init__(self, mensagem, status_code=400):
+        super().__init__(mensagem)
+        self.status_code = status_code
+
+
+def formato_reconhecido(cabecalho):
+    """
+    Verifica pela assinatura dos primeiros bytes se o arquivo é de um formato
+    de vídeo conhecido (MP4/MOV, Matroska/WebM, AVI, FLV, MPEG-TS ou MPEG-PS).
+    """
+    return (
+        cabecalho[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip')
+        or cabecalho.startswith(b'\x1a\x45\xdf\xa3')
+        or (cabecalho.startswith(b'RIFF') and cabecalho[8:12] == b'AVI ')
+        or cabecalho.startswith(b'FLV')
+        or cabecalho.startswith(b'\x00\x00\x01\xba')
+        or (len(cabecalho) > 188 and cabecalho[0] == 0x47 and cabecalho[188] == 0x47)
+    )
+
+
+def sondar_video(caminho):
+    """
+    Lê os metadados do container e decodifica o primeiro frame.
+
+    Returns:
+        dict: fps, total_frames, largura, altura e duracao, ou None se o vídeo
+        não puder ser aberto ou o primeiro frame não puder ser decodificado
+    """
+    cap = cv2.VideoCapture(caminho)
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        largura = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        altura = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        ret, _ = cap.read()
+        if not ret or largura <= 0 or altura <= 0:
+            return None
+        return {
+            'fps': fps,
+            'total_frames': total_frames,
+            'largura': largura,
+            'altura': altura,
+            'duracao': round(total_frames / fps, 3) if fps > 0 else None,
+        }
+    finally:
+        cap.release()
+
+
+class IngestaoVideo:
+    """
+    Grava em disco um vídeo enviado, calculando o SHA-256 na mesma passagem.
+
+    O Starlette recebe o corpo multipart inteiro (em um arquivo temporário
+    anônimo) antes de o handler rodar, então o tamanho e a assinatura do
+    formato são conferidos antes de qualquer gravação, o conteúdo é copiado
+    uma única vez para um arquivo único no diretório de destino e os
+    metadados do container são lidos do arquivo completo. Ao concluir, o
+    arquivo é renomeado para `<sha256><extensão>`: envios simultâneos com o
+    mesmo nome não se sobrescrevem e reenvios do mesmo vídeo reaproveitam o
+    arquivo existente.
+    """
+
+    def __init__(self, nome_original, diretorio=None, tamanho_maximo=None):
+        """
+        Args:
+            nome_original: Nome do arquivo enviado (usado para a extensão)
+            diretorio: Diretório de destino (padrão: DIRETORIO_UPLOADS)
+            tamanho_maximo: Tamanho máximo em bytes (padrão: TAMANHO_MAXIMO_UPLOAD_MB)
+        """
+        self.nome_original = nome_original or 'video'
+        self.diretorio = diretorio or DIRETORIO_UPLOADS
+        self.tamanho_maximo = int(tamanho_maximo if tamanho_maximo is not None
+                                  else TAMANHO_MAXIMO_UPLOAD_MB * 1024 * 1024)
+        extensao = os.path.splitext(self.nome_original)[1].lower()
+        self.extensao = extensao if re.fullmatch(r'\.[a-z0-9]{1,5}', extensao) else ''
+        os.makedirs(self.diretorio, exist_ok=True)
+        self.caminho_parcial = os.path.join(self.diretorio, f".{uuid.uuid4().hex}.parcial{self.extensao}")
+        self.tamanho = 0
+        self.metadados = None
+        self._sha = hashlib.sha256()
+
+    def _rejeitar_tamanho(self):
+        raise UploadRejeitado(
+            f"O vídeo excede o tamanho máximo de {self.tamanho_maximo / (1024 * 1024):g} MB.", status_code=413
+        )
+
+    def validar(self, cabecalho, tamanho=None):
+        """
+        Rejeita o envio antes da gravação se o arquivo estiver vazio, for
+        maior que o tamanho máximo ou não começar com a assinatura de um
+        formato de vídeo conhecido.
+
+        Args:
+            cabecalho: Primeiros bytes do arquivo
+            tamanho: Tamanho total em bytes, se conhecido
+        """
+        if not cabecalho:
+            raise UploadRejeitado("O arquivo enviado está vazio.", status_code=400)
+        if tamanho is not None and tamanho > self.tamanho_maximo:
+            self._rejeitar_tamanho()
+        if not formato_reconhecido(cabecalho):
+            raise UploadRejeitado("O arquivo enviado não é um vídeo em formato reconhecido.", status_code=415)
+
+    def gravar(self, origem):
+        """
+        Copia o conteúdo de `origem` para o arquivo parcial, calculando o hash
+        durante a cópia e interrompendo-a se o tamanho máximo for ultrapassado.
+        """
+        with open(self.caminho_parcial, 'wb') as destino:
+            for bloco in iter(lambda: origem.read(TAMANHO_BLOCO_UPLOAD), b''):
+                self.tamanho += len(bloco)
+                if self.tamanho > self.tamanho_maximo:
+                    self._rejeitar_tamanho()
+                self._sha.update(bloco)
+                destino.write(bloco)
+
+    def concluir(self):
+        """
+        Confere se o vídeo gravado é decodificável e move o arquivo para o
+        caminho definitivo.
+
+        Returns:
+            dict: caminho, hash (SHA-256), tamanho em bytes, nome original e
+            metadados do vídeo (fps, total_frames, largura, altura, duracao)
+        """
+        self.metadados = sondar_video(self.caminho_parcial)
+        if self.metadados is None:
+            self.descartar()
+            raise UploadRejeitado("Não foi possível decodificar o vídeo enviado.", status_code=422)
+
+        hash_conteudo = self._sha.hexdigest()
+        caminho = os.path.join(self.diretorio, f"{hash_conteudo}{self.extensao}")
+        if os.path.exists(caminho):
+            # Mesmo conteúdo já recebido antes: manter o arquivo existente
+            self.descartar()
+        else:
+            os.replace(self.caminho_parcial, caminho)
+
+        return {
+            'caminho': caminho,
+            'hash': hash_conteudo,
+            'tamanho': self.tamanho,
+            'nome_original': self.nome_original,
+            'metadados': self.metadados,
+        }
+
+    def receber(self, origem, tamanho=None):
+        """
+        Valida, grava e conclui o recebimento de um arquivo já aberto.
+
+        Args:
+            origem: Arquivo binário com o vídeo (ex.: `UploadFile.file`)
+            tamanho: Tamanho total em bytes, se conhecido
+
+        Returns:
+            dict: Informações do vídeo recebido (ver `concluir`)
+        """
+        origem.seek(0)
+        self.validar(origem.read(512), tamanho)
+        origem.seek(0)
+        self.gravar(origem)
+        return self.concluir()
+
+    def descartar(self):
+        """Remove o arquivo parcial."""
+        try:
+            os.remove(self.caminho_parcial)
+        except FileNotFoundError:
+            pass
+
+
+async def receber_upload(video, diretorio=None, tamanho_maximo=None):
+    """
+    Grava um `UploadFile` do FastAPI com `IngestaoVideo`, fora do event loop.
+
+    Returns:
+        dict: Informações do vídeo recebido (ver `IngestaoVideo.concluir`)
+    """
+    ingestao = IngestaoVideo(video.filename, diretorio=diretorio, tamanho_maximo=tamanho_maximo)
+    try:
+        return await asyncio.to_thread(ingestao.receber, video.file, getattr(video, 'size', None))
+    except BaseException:
+        ingestao.descartar()
+        raise
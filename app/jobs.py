@@ -0,0 +1,319 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from app import metricas
+
+logger = logging.getLogger(__name__)
+
+# Estados possíveis de um job
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CANCELANDO = 'cancelando'
+CONCLUIDO = 'concluido'
+FALHOU = 'falhou'
+CANCELADO = 'cancelado'
+
+ESTADOS_FINAIS = (CONCLUIDO, FALHOU, CANCELADO)
+
+
+class Job:
+    """
+    Trabalho submetido a um `GerenciadorJobs`, com estado, progresso e resultado.
+    """
+
+    def __init__(self, tipo, parametros=None, guardar_eventos=False):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.parametros = parametros or {}
+        self.status = PENDENTE
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.finalizado_em = None
+        self.progresso = None  # Último evento de progresso recebido do worker
+        self.eventos = [] if guardar_eventos else None  # Todos os eventos de progresso, se guardados
+        self.resultado = None
+        self.erro = None
+        self._cancelar = None
+        self._future = None
+        self._concluido = None
+
+    @property
+    def finalizado(self):
+        return self.status in ESTADOS_FINAIS
+
+    def resumo(self, incluir_resultado=True):
+        resumo = {
+            'job_id': self.id,
+            'tipo': self.tipo,
+            'status': self.status,
+            'criado_em': self.criado_em,
+            'iniciado_em': self.iniciado_em,
+            'finalizado_em': self.finalizado_em,
+            'progresso': self.progresso,
+        }
+        if self.erro:
+            resumo['erro'] = self.erro
+        if incluir_resultado and self.resultado is not None:
+            resumo['resultado'] = self.resultado
+        return resumo
+
+
+def _executar_job(funcao, job_id, cancelar, fila_progresso, kwargs):
+    """
+    Executa a função do job no processo worker, informando o início e
+    repassando os eventos de progresso ao processo da API.
+    """
+    fila_progresso.put((job_id, {'tipo': 'status', 'status': EXECUTANDO, 'pid': os.getpid()}))
+
+    def progresso(evento):
+        fila_progresso.put((job_id, evento))
+
+    return funcao(cancelar=cancelar, progresso=progresso, **kwargs)
+
+
+class GerenciadorJobs:
+    """
+    Executa jobs em um pool limitado de processos worker.
+
+    A submissão retorna imediatamente um `Job`; o estado, o progresso e o
+    resultado podem ser consultados pelo id. A função do job roda em outro
+    processo, então trabalho pesado de CPU não bloqueia o event loop da API.
+
+    As funções submetidas devem ser importáveis pelo worker (definidas no nível
+    de módulo) e aceitar os argumentos nomeados `cancelar` (um Event que é
+    sinalizado quando o job é cancelado) e `progresso` (função que recebe um
+    dicionário com o progresso atual).
+    """
+
+    def __init__(self, nome, max_workers, inicializador=None, argumentos_inicializador=(), max_historico=200,
+                 guardar_eventos=False):
+        """
+        Args:
+            nome: Nome do gerenciador, usado como tipo padrão dos jobs
+            max_workers: Quantidade máxima de processos worker
+            inicializador: Função executada uma vez em cada worker ao iniciar
+            argumentos_inicializador: Argumentos do inicializador
+            max_historico: Quantidade de jobs finalizados mantidos para consulta
+            guardar_eventos: Se cada job guarda todos os eventos de progresso
+                (ex.: as métricas de cada época de um treinamento), e não
+                apenas o último
+        """
+        self.nome = nome
+        self.max_workers = max(1, int(max_workers))
+        self.inicializador = inicializador
+        self.argumentos_inicializador = argumentos_inicializador
+        self.max_historico = max_historico
+        self.guardar_eventos = guardar_eventos
+        self._executor = None
+        self._manager = None
+        self._fila_progresso = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _iniciar(self):
+        # Os processos são criados apenas no primeiro uso, e não ao importar o módulo
+        if self._executor is not None:
+            return
+        contexto = multiprocessing.get_context('spawn')
+        self._manager = contexto.Manager()
+        self._fila_progresso = self._manager.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=contexto,
+            initializer=self.inicializador,
+            initargs=self.argumentos_inicializador
+        )
+        threading.Thread(target=self._ler_progresso, name=f"jobs-{self.nome}-progresso", daemon=True).start()
+
+    def _ler_progresso(self):
+        while True:
+            try:
+                job_id, evento = self._fila_progresso.get()
+            except (EOFError, OSError, BrokenPipeError):
+                break
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if evento.get('tipo') == 'status':
+                if job.status == PENDENTE:
+                    job.status = EXECUTANDO
+                    job.iniciado_em = time.time()
+            else:
+                job.progresso = evento
+                if job.eventos is not None:
+                    job.eventos.append(evento)
+
+    def submeter(self, funcao, tipo=None, parametros=None, finalizar=None, **kwargs):
+        """
+        Submete um job para execução em um worker.
+
+        Args:
+            funcao: Função executada no worker
+            tipo: Tipo do job (padrão: nome do gerenciador)
+            parametros: Parâmetros exibidos na consulta do job
+            finalizar: Corrotina opcional `finalizar(job, resultado)` executada no
+                processo da API após o worker terminar; o valor retornado passa
+                a ser o resultado do job (ex.: envio de alertas)
+            **kwargs: Argumentos nomeados repassados à função
+
+        Returns:
+            Job: Job criado, com status 'pendente'
+        """
+        self._iniciar()
+        job = Job(tipo or self.nome, parametros, self.guardar_eventos)
+        job._cancelar = self._manager.Event()
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            job._concluido = loop.create_future()
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._limpar_historico()
+
+        job._future = self._executor.submit(_executar_job, funcao, job.id, job._cancelar, self._fila_progresso, kwargs)
+        job._future.add_done_callback(lambda future: self._ao_terminar(job, future, loop, finalizar))
+        logger.info(f"Job {job.id} ({job.tipo}) submetido")
+        return job
+
+    def _ao_terminar(self, job, future, loop, finalizar):
+        # Executado na thread interna do executor
+        resultado = None
+        if future.cancelled():
+            job.status = CANCELADO
+        elif future.exception() is not None:
+            erro = future.exception()
+            if job._cancelar.is_set():
+                job.status = CANCELADO
+            else:
+                job.status = FALHOU
+                job.erro = str(erro)
+                detalhes = ''.join(traceback.format_exception(type(erro), erro, erro.__traceback__))
+                logger.error(f"Job {job.id} ({job.tipo}) falhou: {job.erro}\n{detalhes}")
+        else:
+            resultado = future.result()
+
+        if job.status in ESTADOS_FINAIS or loop is None or finalizar is None:
+            if not job.finalizado:
+                job.resultado = resultado
+                job.status = CONCLUIDO
+            self._marcar_finalizado(job, loop)
+        else:
+            loop.call_soon_threadsafe(lambda: loop.create_task(self._finalizar(job, resultado, finalizar, loop)))
+
+    async def _finalizar(self, job, resultado, finalizar, loop):
+        try:
+            job.resultado = await finalizar(job, resultado)
+            job.status = CONCLUIDO
+        except Exception as e:
+            job.status = FALHOU
+            job.erro = str(e)
+            logger.error(f"Erro ao finalizar o job {job.id}: {str(e)}\n{traceback.format_exc()}")
+        finally:
+            self._marcar_finalizado(job, loop)
+
+    def _marcar_finalizado(self, job, loop):
+        job.finalizado_em = time.time()
+        logger.info(f"Job {job.id} ({job.tipo}) finalizado com status {job.status}")
+        metricas.JOBS.incrementar(tipo=job.tipo, status=job.status)
+        if job.iniciado_em is not None:
+            metricas.DURACAO_JOB.observar(job.finalizado_em - job.iniciado_em, tipo=job.tipo)
+        if job._concluido is not None:
+            def sinalizar():
+                if not job._concluido.done():
+                    job._concluido.set_result(job.status)
+            loop.call_soon_threadsafe(sinalizar)
+
+    def _limpar_historico(self):
+        finalizados = [job_id for job_id, job in self._jobs.items() if job.finalizado]
+        for job_id in finalizados[:max(0, len(finalizados) - self.max_historico)]:
+            del self._jobs[job_id]
+
+    async def aguardar(self, job):
+        """
+        Aguarda, sem bloquear o event loop, até o job terminar.
+
+        Returns:
+            Job: O próprio job, já em um estado final
+        """
+        if job._concluido is None:
+            await asyncio.wrap_future(job._future)
+        else:
+            await asyncio.shield(job._concluido)
+        return job
+
+    async def acompanhar(self, job, intervalo=0.5):
+        """
+        Produz os eventos de progresso do job até ele terminar: com
+        `guardar_eventos`, todos desde o início; sem, cada novo último evento.
+
+        Args:
+            job: Job acompanhado
+            intervalo: Segundos entre as consultas ao progresso do job
+        """
+        enviados = 0
+        ultimo = None
+        while True:
+            finalizado = job.finalizado
+            if job.eventos is not None:
+                novos = job.eventos[enviados:]
+                enviados += len(novos)
+            else:
+                novos = [job.progresso] if job.progresso is not None and job.progresso is not ultimo else []
+                ultimo = job.progresso
+            for evento in novos:
+                yield evento
+            if finalizado:
+                return
+            await asyncio.sleep(intervalo)
+
+    def obter(self, job_id):
+        return self._jobs.get(job_id)
+
+    def listar(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancelar(self, job_id):
+        """
+        Cancela um job: jobs pendentes são removidos da fila e jobs em execução
+        recebem o sinal de cancelamento, interrompendo no próximo frame.
+
+        Returns:
+            bool: False se o job não existir ou já estiver finalizado
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.finalizado:
+            return False
+        if not job._future.cancel():
+            job._cancelar.set()
+            job.status = CANCELANDO
+        return True
+
+    def profundidade_fila(self):
+        """Quantidade de jobs aguardando um worker livre."""
+        return sum(1 for job in list(self._jobs.values()) if job.status == PENDENTE)
+
+    def em_execucao(self):
+        """Quantidade de jobs sendo executados pelos workers."""
+        return sum(1 for job in list(self._jobs.values()) if job.status in (EXECUTANDO, CANCELANDO))
+
+    def encerrar(self, aguardar=False):
+        if self._executor is not None:
+            for job in list(self._jobs.values()):
+                if not job.finalizado:
+                    self.cancelar(job.id)
+            self._executor.shutdown(wait=aguardar, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
@@ -0,0 +1,169 @@
+import gc
+import os
+import sys
+import logging
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Modo de memória limitada ativado por padrão nas análises
+MEMORIA_LIMITADA = os.environ.get('MEMORIA_LIMITADA', '0').lower() in ('1', 'true', 'sim')
+
+# Crescimento máximo (em MB) do RSS do processo durante um processamento no
+# modo de memória limitada; acima disso o processamento é interrompido
+MEMORIA_ORCAMENTO_MB = float(os.environ.get('MEMORIA_ORCAMENTO_MB', 1024))
+
+# Frames processados entre duas verificações da memória
+MEMORIA_INTERVALO_VERIFICACAO = int(os.environ.get('MEMORIA_INTERVALO_VERIFICACAO', 30))
+
+# Se o tracemalloc deve medir as alocações do Python (deixa o processamento mais lento)
+MEMORIA_TRACEMALLOC = os.environ.get('MEMORIA_TRACEMALLOC', '0').lower() in ('1', 'true', 'sim')
+
+
+class MemoriaExcedida(Exception):
+    """Lançada quando o processamento ultrapassa o orçamento de memória."""
+
+
+def rss_atual_mb():
+    """
+    Memória residente atual do processo, em MB (None se não for possível medir).
+    Usa o psutil se instalado; no Linux, lê /proc/self/statm.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as arquivo:
+            paginas = int(arquivo.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def pico_rss_mb():
+    """Maior memória residente do processo desde o início, em MB."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB no Linux, bytes no macOS
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+def _arredondar(valor):
+    return round(valor, 1) if valor is not None else None
+
+
+class PoolFrames:
+    """
+    Buffers de frames reaproveitados entre os lotes: a decodificação lê cada
+    frame em um buffer devolvido por um estágio posterior, em vez de alocar
+    um array novo por frame. Sem buffer livre, um novo é alocado, então o
+    pool nunca bloqueia o pipeline; ele cresce até a quantidade de frames em
+    trânsito nas filas.
+    """
+
+    def __init__(self):
+        self._livres = []
+        self._lock = threading.Lock()
+        self.alocados = 0
+        self.reaproveitados = 0
+
+    def obter(self):
+        """Retorna um buffer livre ou None (o leitor aloca um novo)."""
+        with self._lock:
+            if self._livres:
+                self.reaproveitados += 1
+                return self._livres.pop()
+            self.alocados += 1
+            return None
+
+    def devolver(self, frame):
+        if frame is not None:
+            with self._lock:
+                self._livres.append(frame)
+
+    def estatisticas(self):
+        return {'buffers_alocados': self.alocados, 'buffers_reaproveitados': self.reaproveitados}
+
+
+class MonitorMemoria:
+    """
+    Acompanha o RSS do processo (e, opcionalmente, as alocações do Python pelo
+    tracemalloc) durante um processamento e o interrompe com
+    `MemoriaExcedida` se o crescimento passar do orçamento.
+    """
+
+    def __init__(self, orcamento_mb=None, rastrear_alocacoes=None):
+        """
+        Args:
+            orcamento_mb: Crescimento máximo do RSS em MB (padrão:
+                MEMORIA_ORCAMENTO_MB; 0 apenas mede)
+            rastrear_alocacoes: Se deve usar o tracemalloc (padrão: MEMORIA_TRACEMALLOC)
+        """
+        self.orcamento_mb = MEMORIA_ORCAMENTO_MB if orcamento_mb is None else orcamento_mb
+        self.rastrear_alocacoes = MEMORIA_TRACEMALLOC if rastrear_alocacoes is None else rastrear_alocacoes
+        self.rss_inicial = None
+        self.rss_maximo = None
+        self.verificacoes = 0
+        self._tracemalloc_proprio = False
+        self._tracemalloc = None
+
+    def iniciar(self):
+        self.rss_inicial = self.rss_maximo = rss_atual_mb()
+        if self.rastrear_alocacoes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracemalloc_proprio = True
+        return self
+
+    def verificar(self):
+        """
+        Mede o RSS atual. Acima do orçamento, coleta o lixo e mede de novo
+        antes de interromper.
+
+        Raises:
+            MemoriaExcedida: Se o RSS cresceu mais que o orçamento
+        """
+        rss = rss_atual_mb()
+        if rss is None or self.rss_inicial is None:
+            return None
+        self.verificacoes += 1
+        self.rss_maximo = max(self.rss_maximo, rss)
+        if self.orcamento_mb and rss - self.rss_inicial > self.orcamento_mb:
+            logger.warning(f"Memória acima do orçamento ({rss - self.rss_inicial:.0f} MB); coletando o lixo")
+            gc.collect()
+            rss = rss_atual_mb()
+            if rss - self.rss_inicial > self.orcamento_mb:
+                raise MemoriaExcedida(
+                    f"Memória do processamento cresceu {rss - self.rss_inicial:.0f} MB "
+                    f"(orçamento: {self.orcamento_mb:.0f} MB)"
+                )
+        return rss
+
+    def parar(self):
+        if self.rastrear_alocacoes and tracemalloc.is_tracing():
+            self._tracemalloc = tracemalloc.get_traced_memory()
+            if self._tracemalloc_proprio:
+                tracemalloc.stop()
+
+    def relatorio(self):
+        """RSS inicial, final e máximo medido, crescimento e, com o tracemalloc, o pico das alocações do Python."""
+        rss = rss_atual_mb()
+        relatorio = {
+            'orcamento_mb': self.orcamento_mb,
+            'rss_inicial_mb': _arredondar(self.rss_inicial),
+            'rss_final_mb': _arredondar(rss),
+            'rss_maximo_mb': _arredondar(max(self.rss_maximo or 0, rss or 0) or None),
+            'crescimento_mb': _arredondar(rss - self.rss_inicial) if rss is not None and self.rss_inicial else None,
+            'pico_rss_processo_mb': _arredondar(pico_rss_mb()),
+            'verificacoes': self.verificacoes,
+        }
+        if self._tracemalloc is not None:
+            atual, pico = self._tracemalloc
+            relatorio['tracemalloc_atual_mb'] = round(atual / (1024 * 1024), 1)
+            relatorio['tracemalloc_pico_mb'] = round(pico / (1024 * 1024), 1)
+        return relatorio
@@ -0,0 +1,241 @@
+import math
+import threading
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Limites (em segundos) do histograma de duração das análises
+BUCKETS_DURACAO_JOB = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+PREFIXO = 'sharp_objects_'
+
+
+class SerieHistograma:
+    """
+    Contagens de um histograma acumuladas localmente (ex.: em um worker) e
+    transportadas como dicionário até o processo da API, onde são somadas ao
+    histograma global por `Histograma.mesclar`.
+    """
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = tuple(buckets)
+        self.contagens = [0] * (len(self.buckets) + 1)  # O último é o +Inf
+        self.soma = 0.0
+        self.contagem = 0
+
+    def observar(self, valor):
+        # Busca linear: poucos buckets, e a maioria das observações cai nos primeiros
+        indice = next((i for i, limite in enumerate(self.buckets) if valor <= limite), len(self.buckets))
+        self.contagens[indice] += 1
+        self.soma += valor
+        self.contagem += 1
+
+    def mesclar(self, serie):
+        if isinstance(serie, SerieHistograma):
+            serie = serie.para_dict()
+        if not serie or tuple(serie.get('limites', self.buckets)) != self.buckets:
+            return
+        for i, contagem in enumerate(serie['contagens']):
+            self.contagens[i] += contagem
+        self.soma += serie['soma']
+        self.contagem += serie['contagem']
+
+    def para_dict(self):
+        return {'limites': list(self.buckets), 'contagens': list(self.contagens), 'soma': self.soma,
+                'contagem': self.contagem}
+
+
+def mesclar_metricas(*partes):
+    """
+    Soma as métricas de vários processamentos (ex.: segmentos de um vídeo), no
+    formato de `estatisticas['metricas']` de `processar_video`.
+    """
+    total = {'etapas': {}, 'frames': 0, 'deteccoes': 0}
+    for parte in partes:
+        if not parte:
+            continue
+        for etapa, serie in parte.get('etapas', {}).items():
+            acumulada = total['etapas'].setdefault(etapa, SerieHistograma(serie.get('limites', BUCKETS_LATENCIA)))
+            acumulada.mesclar(serie)
+        total['frames'] += parte.get('frames', 0)
+        total['deteccoes'] += parte.get('deteccoes', 0)
+    total['etapas'] = {etapa: serie.para_dict() for etapa, serie in total['etapas'].items()}
+    return total
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(rotulos, extra=None):
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+def _formatar_numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = PREFIXO + nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        if set(rotulos) != set(self.rotulos):
+            raise ValueError(f"{self.nome} espera os rótulos {self.rotulos}, recebeu {tuple(rotulos)}")
+        return tuple((nome, rotulos[nome]) for nome in self.rotulos)
+
+    def _cabecalho(self):
+        return [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def exportar(self):
+        with self._lock:
+            valores = dict(self._valores)
+        return self._cabecalho() + [f"{self.nome}{_formatar_rotulos(chave)} {_formatar_numero(valor)}"
+                                    for chave, valor in sorted(valores.items())]
+
+
+class Medidor(_Metrica):
+    tipo = 'gauge'
+
+    def definir(self, valor, **rotulos):
+        with self._lock:
+            self._valores[self._chave(rotulos)] = valor
+
+    def exportar(self):
+        with self._lock:
+            valores = dict(self._valores)
+        return self._cabecalho() + [f"{self.nome}{_formatar_rotulos(chave)} {_formatar_numero(valor)}"
+                                    for chave, valor in sorted(valores.items())]
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nome, descricao, rotulos)
+        self.buckets = tuple(buckets)
+
+    def _serie(self, rotulos):
+        chave = self._chave(rotulos)
+        if chave not in self._valores:
+            self._valores[chave] = SerieHistograma(self.buckets)
+        return self._valores[chave]
+
+    def observar(self, valor, **rotulos):
+        with self._lock:
+            self._serie(rotulos).observar(valor)
+
+    def mesclar(self, serie, **rotulos):
+        """Soma ao histograma as contagens de uma `SerieHistograma` (ou do seu dicionário)."""
+        with self._lock:
+            self._serie(rotulos).mesclar(serie)
+
+    def exportar(self):
+        linhas = self._cabecalho()
+        with self._lock:
+            series = {chave: serie.para_dict() for chave, serie in self._valores.items()}
+        for chave, serie in sorted(series.items()):
+            acumulado = 0
+            for limite, contagem in zip(list(self.buckets) + [math.inf], serie['contagens']):
+                acumulado += contagem
+                linhas.append(f"{self.nome}_bucket{_formatar_rotulos(chave, ('le', _formatar_numero(limite)))} "
+                              f"{acumulado}")
+            linhas.append(f"{self.nome}_sum{_formatar_rotulos(chave)} {_formatar_numero(serie['soma'])}")
+            linhas.append(f"{self.nome}_count{_formatar_rotulos(chave)} {serie['contagem']}")
+        return linhas
+
+
+class RegistroMetricas:
+    """
+    Métricas do processo no formato de texto do Prometheus.
+
+    Os medidores que refletem um estado (ex.: tamanho das filas) podem ser
+    atualizados na hora da coleta por funções registradas em `ao_coletar`.
+    """
+
+    def __init__(self):
+        self.metricas = []
+        self.coletores = []
+
+    def _registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, descricao, rotulos=()):
+        return self._registrar(Contador(nome, descricao, rotulos))
+
+    def medidor(self, nome, descricao, rotulos=()):
+        return self._registrar(Medidor(nome, descricao, rotulos))
+
+    def histograma(self, nome, descricao, rotulos=(), buckets=BUCKETS_LATENCIA):
+        return self._registrar(Histograma(nome, descricao, rotulos, buckets))
+
+    def ao_coletar(self, funcao):
+        self.coletores.append(funcao)
+        return funcao
+
+    def gerar_texto(self):
+        for coletor in self.coletores:
+            coletor()
+        linhas = []
+        for metrica in self.metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = RegistroMetricas()
+
+DURACAO_ETAPA = registro.histograma(
+    'etapa_duracao_segundos',
+    'Duração de cada etapa do processamento por lote de frames (decodificacao, inferencia, anotacao, snapshot, '
+    'codificacao)',
+    ('origem', 'etapa'))
+DURACAO_ALERTA = registro.histograma(
+    'alerta_duracao_segundos', 'Duração da entrega de um alerta, incluindo retentativas', ('canal',))
+DURACAO_JOB = registro.histograma(
+    'job_duracao_segundos', 'Duração dos jobs executados pelos workers', ('tipo',), BUCKETS_DURACAO_JOB)
+
+FRAMES = registro.contador('frames_processados_total', 'Frames processados', ('origem',))
+DETECCOES = registro.contador('deteccoes_total', 'Detecções acima do limiar de confiança', ('origem',))
+ALERTAS = registro.contador('alertas_total', 'Alertas entregues ou com falha', ('canal', 'resultado'))
+RETENTATIVAS_ALERTA = registro.contador('alertas_retentativas_total', 'Retentativas de envio de alertas', ('canal',))
+JOBS = registro.contador('jobs_finalizados_total', 'Jobs finalizados por status', ('tipo', 'status'))
+
+JOBS_EM_EXECUCAO = registro.medidor('jobs_em_execucao', 'Jobs sendo executados pelos workers', ('tipo',))
+JOBS_NA_FILA = registro.medidor('jobs_na_fila', 'Jobs aguardando um worker livre', ('tipo',))
+ALERTAS_NA_FILA = registro.medidor('alertas_na_fila', 'Alertas aguardando envio', ('canal',))
+TRANSMISSOES_ATIVAS = registro.medidor('transmissoes_ativas', 'Transmissões ao vivo em processamento')
+
+
+def registrar_processamento(metricas, origem='analise'):
+    """
+    Soma às métricas do processo as métricas de um processamento de vídeo,
+    possivelmente executado em um worker (`estatisticas['metricas']` de
+    `processar_video`).
+    """
+    if not metricas:
+        return
+    for etapa, serie in metricas.get('etapas', {}).items():
+        DURACAO_ETAPA.mesclar(serie, origem=origem, etapa=etapa)
+    FRAMES.incrementar(metricas.get('frames', 0), origem=origem)
+    DETECCOES.incrementar(metricas.get('deteccoes', 0), origem=origem)
@@ -0,0 +1,266 @@
+import gc
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+# Quantidade máxima de modelos mantidos em memória pelo processo
+MAX_MODELOS_CARREGADOS = int(os.environ.get('MAX_MODELOS_CARREGADOS', 2))
+
+# Memória livre mínima (MB) antes de carregar um novo modelo; abaixo disso os
+# modelos menos usados recentemente são descarregados
+MEMORIA_MINIMA_LIVRE_MB = int(os.environ.get('MEMORIA_MINIMA_LIVRE_MB', 512))
+
+# Tamanho (lado, em pixels) do frame sintético usado no aquecimento
+IMGSZ_AQUECIMENTO = int(os.environ.get('IMGSZ_AQUECIMENTO', 640))
+
+_modelos = OrderedDict()  # chave -> ModeloCarregado, ordenado do menos ao mais recente
+_hashes = {}  # (caminho, mtime, tamanho) -> sha256
+_carregando = {}  # chave -> Lock da carga em andamento daquela versão do modelo
+_lock = threading.RLock()
+
+
+class ModeloCarregado:
+    """
+    Modelo YOLO residente em memória, com as estatísticas de carga e uso.
+
+    O predictor do ultralytics não é seguro para chamadas concorrentes, então
+    toda inferência passa por `prever`, que serializa o acesso ao modelo.
+    """
+
+    def __init__(self, modelo, caminho, chave, hash_arquivo, tempo_carga):
+        self.modelo = modelo
+        self.caminho = caminho
+        self.chave = chave
+        self.hash = hash_arquivo
+        self.tempo_carga = tempo_carga
+        self.tempo_aquecimento = None
+        self.carregado_em = time.time()
+        self.ultimo_uso = self.carregado_em
+        self.usos = 0
+        self.lock = threading.Lock()
+
+    def prever(self, fonte, **kwargs):
+        """
+        Executa a inferência sobre um frame ou uma lista de frames.
+
+        Args:
+            fonte: Frame (np.ndarray) ou lista de frames
+            **kwargs: Argumentos repassados ao predictor do YOLO (conf, imgsz...)
+
+        Returns:
+            list: Lista de `Results` do ultralytics, um por frame
+        """
+        with self.lock:
+            self.ultimo_uso = time.time()
+            self.usos += 1
+            return self.modelo(fonte, **kwargs)
+
+    def aquecer(self, imgsz=IMGSZ_AQUECIMENTO):
+        """
+        Executa uma inferência em um frame vazio para inicializar o grafo e os
+        buffers do modelo antes da primeira requisição real.
+
+        Returns:
+            float: Tempo de aquecimento em segundos
+        """
+        frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        inicio = time.perf_counter()
+        with self.lock:
+            self.modelo(frame, imgsz=imgsz, verbose=False)
+        self.tempo_aquecimento = time.perf_counter() - inicio
+        logger.info(f"Modelo {self.caminho} aquecido em {self.tempo_aquecimento:.2f}s")
+        return self.tempo_aquecimento
+
+    def resumo(self):
+        return {
+            'caminho': self.caminho,
+            'hash': self.hash,
+            'tempo_carga': round(self.tempo_carga, 3),
+            'tempo_aquecimento': round(self.tempo_aquecimento, 3) if self.tempo_aquecimento is not None else None,
+            'carregado_em': self.carregado_em,
+            'ultimo_uso': self.ultimo_uso,
+            'usos': self.usos,
+        }
+
+
+def _identificar_arquivo(modelo_path):
+    """
+    Retorna a identificação (caminho absoluto, mtime, tamanho) do arquivo do modelo.
+    Diretórios (ex.: exportações OpenVINO) usam o mtime do próprio diretório.
+    """
+    caminho = os.path.abspath(modelo_path)
+    stat = os.stat(caminho)
+    return caminho, stat.st_mtime_ns, stat.st_size
+
+
+def hash_arquivo(modelo_path):
+    """
+    Calcula o SHA-256 do arquivo do modelo, reaproveitando o valor enquanto
+    o mtime e o tamanho do arquivo não mudarem.
+    """
+    identificacao = _identificar_arquivo(modelo_path)
+    with _lock:
+        if identificacao in _hashes:
+            return _hashes[identificacao]
+
+    caminho = identificacao[0]
+    sha = hashlib.sha256()
+    if os.path.isdir(caminho):
+        for raiz, _, arquivos in sorted(os.walk(caminho)):
+            for nome in sorted(arquivos):
+                with open(os.path.join(raiz, nome), 'rb') as f:
+                    for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                        sha.update(bloco)
+    else:
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(bloco)
+
+    with _lock:
+        _hashes[identificacao] = sha.hexdigest()
+    return _hashes[identificacao]
+
+
+def _memoria_disponivel_mb():
+    """Memória física disponível em MB, ou None se não for possível medir."""
+    try:
+        with open('/proc/meminfo') as f:
+            for linha in f:
+                if linha.startswith('MemAvailable:'):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _descarregar_menos_usado():
+    _, registro = _modelos.popitem(last=False)
+    logger.info(f"Descarregando modelo {registro.caminho} (último uso em {registro.ultimo_uso:.0f})")
+
+
+def liberar_memoria(manter=0):
+    """
+    Descarrega modelos menos usados recentemente enquanto houver mais de
+    `MAX_MODELOS_CARREGADOS` em memória ou a memória livre estiver abaixo de
+    `MEMORIA_MINIMA_LIVRE_MB`.
+
+    Args:
+        manter: Quantidade mínima de modelos que devem permanecer carregados
+
+    Returns:
+        int: Número de modelos descarregados
+    """
+    descarregados = 0
+    with _lock:
+        while len(_modelos) > manter:
+            memoria = _memoria_disponivel_mb()
+            memoria_baixa = memoria is not None and memoria < MEMORIA_MINIMA_LIVRE_MB
+            if len(_modelos) < MAX_MODELOS_CARREGADOS and not memoria_baixa:
+                break
+            _descarregar_menos_usado()
+            descarregados += 1
+    if descarregados:
+        gc.collect()
+    return descarregados
+
+
+def obter_modelo(modelo_path, aquecer=False):
+    """
+    Retorna o modelo carregado para `modelo_path`, carregando-o apenas se ainda
+    não estiver em memória ou se o arquivo tiver mudado desde a última carga.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        aquecer: Se deve executar uma inferência de aquecimento após a carga
+
+    Returns:
+        ModeloCarregado: Modelo pronto para inferência
+    """
+    caminho, mtime, tamanho = _identificar_arquivo(modelo_path)
+    chave = (caminho, mtime, tamanho)
+
+    # O lock global protege apenas o dicionário; a carga e o aquecimento
+    # (segundos) acontecem fora dele, sob um lock por versão do modelo, para
+    # não bloquear quem usa outros modelos já carregados
+    with _lock:
+        registro = _modelos.get(chave)
+        if registro is not None:
+            _modelos.move_to_end(chave)
+        else:
+            lock_carga = _carregando.setdefault(chave, threading.Lock())
+
+    if registro is None:
+        with lock_carga:
+            with _lock:
+                # Outra thread pode ter concluído a carga enquanto esta esperava
+                registro = _modelos.get(chave)
+            if registro is None:
+                try:
+                    registro = _carregar(modelo_path, caminho, chave, aquecer)
+                finally:
+                    with _lock:
+                        _carregando.pop(chave, None)
+                return registro
+
+    if aquecer and registro.tempo_aquecimento is None:
+        registro.aquecer()
+    return registro
+
+
+def _carregar(modelo_path, caminho, chave, aquecer):
+    """Carrega (e aquece) o modelo fora do lock global e o registra no pool."""
+    with _lock:
+        # Versões antigas do mesmo arquivo não serão mais usadas
+        for chave_antiga in [c for c in _modelos if c[0] == caminho]:
+            del _modelos[chave_antiga]
+
+    # Abrir espaço antes de carregar o novo modelo
+    liberar_memoria()
+
+    inicio = time.perf_counter()
+    modelo = YOLO(modelo_path)
+    tempo_carga = time.perf_counter() - inicio
+    registro = ModeloCarregado(modelo, caminho, chave, hash_arquivo(modelo_path), tempo_carga)
+    logger.info(f"Modelo {caminho} carregado em {tempo_carga:.2f}s")
+
+    if aquecer:
+        registro.aquecer()
+
+    with _lock:
+        _modelos[chave] = registro
+        _modelos.move_to_end(chave)
+    return registro
+
+
+def recarregar_modelo(modelo_path, aquecer=True):
+    """
+    Carrega a versão atual do arquivo do modelo (por exemplo, após um novo
+    treinamento sobrescrever `MODELO_PATH`) e descarta as versões anteriores.
+    """
+    return obter_modelo(modelo_path, aquecer=aquecer)
+
+
+def estatisticas_modelos():
+    """
+    Retorna o estado do pool de modelos: modelos residentes, tempos de carga e
+    aquecimento e memória livre.
+    """
+    with _lock:
+        modelos = [registro.resumo() for registro in reversed(_modelos.values())]
+    memoria = _memoria_disponivel_mb()
+    return {
+        'modelos': modelos,
+        'max_modelos': MAX_MODELOS_CARREGADOS,
+        'memoria_disponivel_mb': round(memoria, 1) if memoria is not None else None,
+    }
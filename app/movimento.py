@@ -0,0 +1,92 @@
+import os
+import cv2
+
+# Largura (em pixels) da versão reduzida do frame usada na comparação
+LARGURA_ANALISE_MOVIMENTO = int(os.environ.get('LARGURA_ANALISE_MOVIMENTO', 160))
+
+# Fração mínima de pixels alterados para considerar que houve movimento
+LIMIAR_MOVIMENTO_PADRAO = float(os.environ.get('LIMIAR_MOVIMENTO', 0.005))
+
+
+class FiltroMovimento:
+    """
+    Decide, frame a frame, se vale a pena executar a inferência do YOLO.
+
+    Combina dois critérios baratos:
+      - passo fixo: analisa apenas um a cada `analisar_a_cada` frames;
+      - movimento: compara uma versão reduzida e em tons de cinza do frame com a
+        do último frame inferido (diferença absoluta) ou com um modelo de fundo
+        (MOG2) e ignora o frame se a fração de pixels alterados for menor que
+        `limiar_movimento`.
+
+    Para que objetos parados não fiquem indefinidamente sem inferência, um frame
+    é sempre analisado após `intervalo_maximo` frames ignorados seguidos.
+    """
+
+    def __init__(self, analisar_a_cada=1, detectar_movimento=True, limiar_movimento=None,
+                 metodo='diferenca', intervalo_maximo=30, largura=LARGURA_ANALISE_MOVIMENTO):
+        if metodo not in ('diferenca', 'mog2'):
+            raise ValueError(f"Método de detecção de movimento inválido: {metodo}")
+        self.analisar_a_cada = max(1, int(analisar_a_cada))
+        self.detectar_movimento = detectar_movimento
+        self.limiar_movimento = LIMIAR_MOVIMENTO_PADRAO if limiar_movimento is None else limiar_movimento
+        self.metodo = metodo
+        self.intervalo_maximo = intervalo_maximo
+        self.largura = largura
+
+        self._referencia = None
+        self._subtrator = cv2.createBackgroundSubtractorMOG2(history=200, detectShadows=False) if metodo == 'mog2' else None
+        self._ignorados_seguidos = 0
+        self.frames_inferidos = 0
+        self.frames_ignorados = 0
+
+    def _reduzir(self, frame):
+        altura = max(1, int(frame.shape[0] * self.largura / frame.shape[1]))
+        pequeno = cv2.resize(frame, (self.largura, altura), interpolation=cv2.INTER_AREA)
+        cinza = cv2.cvtColor(pequeno, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(cinza, (5, 5), 0)
+
+    def _fracao_alterada(self, reduzido):
+        if self._subtrator is not None:
+            mascara = self._subtrator.apply(reduzido)
+        else:
+            if self._referencia is None:
+                return 1.0
+            diferenca = cv2.absdiff(reduzido, self._referencia)
+            _, mascara = cv2.threshold(diferenca, 25, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(mascara) / mascara.size
+
+    def deve_inferir(self, frame_num, frame):
+        """
+        Indica se o frame deve passar pela inferência.
+
+        Args:
+            frame_num: Índice do frame no vídeo
+            frame: Frame BGR decodificado
+
+        Returns:
+            bool: True se o frame deve ser inferido, False se pode ser ignorado
+        """
+        inferir = frame_num % self.analisar_a_cada == 0
+
+        # Frames fora do passo não são comparados, então nem chegam a ser
+        # reduzidos; o MOG2 também só vê os frames do passo (o histórico do
+        # modelo de fundo passa a contar frames analisados)
+        if inferir and self.detectar_movimento:
+            reduzido = self._reduzir(frame)
+            fracao = self._fracao_alterada(reduzido)
+            inferir = (
+                frame_num == 0
+                or fracao >= self.limiar_movimento
+                or (self.intervalo_maximo and self._ignorados_seguidos >= self.intervalo_maximo)
+            )
+            if inferir:
+                self._referencia = reduzido
+
+        if inferir:
+            self.frames_inferidos += 1
+            self._ignorados_seguidos = 0
+        else:
+            self.frames_ignorados += 1
+            self._ignorados_seguidos += 1
+        return inferir
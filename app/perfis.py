@@ -0,0 +1,188 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Diretório onde os perfis das análises são gravados
+PERFIS_DIR = os.environ.get('PERFIS_DIR', 'perfis')
+
+# Intervalo (em ms) entre as amostras das pilhas das threads
+PERFIL_INTERVALO_MS = float(os.environ.get('PERFIL_INTERVALO_MS', 5))
+
+# Perfis mantidos em disco; os mais antigos são apagados
+PERFIS_MAXIMO = int(os.environ.get('PERFIS_MAXIMO', 50))
+
+# Formatos servidos: JSON (metadados, funções mais amostradas e linha do tempo)
+# ou pilhas "folded" (uma pilha por linha com a contagem), aceitas pelo
+# flamegraph.pl e pelo speedscope
+FORMATOS_PERFIL = ('json', 'folded')
+
+
+def validar_perfil_id(perfil_id):
+    """O id vira nome de arquivo: apenas letras, números, '_', '-' e '.'."""
+    if not perfil_id or not re.fullmatch(r'[\w-][\w.-]*', str(perfil_id)):
+        raise ValueError(f"Id de perfil inválido: {perfil_id}")
+    return str(perfil_id)
+
+
+def caminho_perfil(perfil_id, formato='json', diretorio=None):
+    if formato not in FORMATOS_PERFIL:
+        raise ValueError(f"Formato de perfil inválido: {formato} (opções: {', '.join(FORMATOS_PERFIL)})")
+    return os.path.join(diretorio or PERFIS_DIR, f"{validar_perfil_id(perfil_id)}.{formato}")
+
+
+class AmostradorPilhas:
+    """
+    Perfil por amostragem: uma thread lê as pilhas de todas as threads do
+    processo a cada `intervalo` ms e conta as pilhas iguais. Não instrumenta
+    as funções, então o custo independe da quantidade de chamadas, e as
+    threads do pipeline aparecem separadas pelo nome. O tempo é de relógio:
+    as esperas (filas, E/S, locks) também são amostradas.
+    """
+
+    def __init__(self, intervalo=None):
+        """
+        Args:
+            intervalo: Milissegundos entre as amostras (padrão: PERFIL_INTERVALO_MS)
+        """
+        self.intervalo = (PERFIL_INTERVALO_MS if intervalo is None else intervalo) / 1000
+        self.pilhas = Counter()
+        self.amostras = 0
+        self.inicio = None
+        self.fim = None
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        self.inicio = time.time()
+        self._thread = threading.Thread(target=self._amostrar, name='perfil', daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.fim = time.time()
+
+    def _amostrar(self):
+        propria = threading.get_ident()
+        nomes = {}
+        while not self._parar.wait(self.intervalo):
+            for ident, frame in sys._current_frames().items():
+                if ident == propria:
+                    continue
+                if ident not in nomes:
+                    nomes = {thread.ident: thread.name for thread in threading.enumerate()}
+                pilha = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                    frame = frame.f_back
+                pilha.append(nomes.get(ident, f"thread-{ident}"))
+                self.pilhas[';'.join(reversed(pilha))] += 1
+            self.amostras += 1
+
+    def folded(self):
+        """Pilhas no formato "folded": `thread;chamador;...;funcao contagem`."""
+        return ''.join(f"{pilha} {contagem}\n" for pilha, contagem in self.pilhas.most_common())
+
+    def mais_amostradas(self, quantidade=30):
+        """Funções que estavam no topo da pilha (tempo próprio) no maior número de amostras."""
+        topo = Counter()
+        for pilha, contagem in self.pilhas.items():
+            thread, _, chamadas = pilha.partition(';')
+            topo[(thread, chamadas.rsplit(';', 1)[-1])] += contagem
+        total = sum(self.pilhas.values()) or 1
+        return [{'thread': thread, 'funcao': funcao, 'amostras': contagem,
+                 'percentual': round(contagem / total * 100, 2)}
+                for (thread, funcao), contagem in topo.most_common(quantidade)]
+
+
+def salvar_perfil(perfil_id, amostrador, linha_tempo=None, metadados=None, diretorio=None):
+    """
+    Grava o perfil em `<diretorio>/<perfil_id>.json` e `.folded` e apaga os
+    perfis além de PERFIS_MAXIMO.
+    """
+    diretorio = diretorio or PERFIS_DIR
+    os.makedirs(diretorio, exist_ok=True)
+    with open(caminho_perfil(perfil_id, 'folded', diretorio), 'w') as arquivo:
+        arquivo.write(amostrador.folded())
+    conteudo = {
+        'perfil_id': perfil_id,
+        **(metadados or {}),
+        'inicio': amostrador.inicio,
+        'duracao_s': round((amostrador.fim or time.time()) - amostrador.inicio, 3),
+        'intervalo_ms': amostrador.intervalo * 1000,
+        'amostras': amostrador.amostras,
+        'mais_amostradas': amostrador.mais_amostradas(),
+        'linha_tempo': linha_tempo,
+    }
+    # Gravar o JSON por último: a presença dele indica que o perfil está completo
+    temporario = caminho_perfil(perfil_id, 'json', diretorio) + '.tmp'
+    with open(temporario, 'w') as arquivo:
+        json.dump(conteudo, arquivo, ensure_ascii=False)
+    os.replace(temporario, caminho_perfil(perfil_id, 'json', diretorio))
+    _limpar_antigos(diretorio)
+
+
+def _limpar_antigos(diretorio):
+    perfis = [os.path.join(diretorio, nome) for nome in os.listdir(diretorio) if nome.endswith('.json')]
+    perfis.sort(key=os.path.getmtime)
+    for caminho in perfis[:max(0, len(perfis) - PERFIS_MAXIMO)]:
+        base = os.path.splitext(caminho)[0]
+        for formato in FORMATOS_PERFIL:
+            try:
+                os.remove(f"{base}.{formato}")
+            except FileNotFoundError:
+                pass
+
+
+def carregar_perfil(perfil_id, formato='json', diretorio=None):
+    """
+    Returns:
+        str: Conteúdo do perfil no formato pedido, ou None se ele (ainda) não existe
+    """
+    diretorio = diretorio or PERFIS_DIR
+    if not os.path.exists(caminho_perfil(perfil_id, 'json', diretorio)):
+        return None
+    with open(caminho_perfil(perfil_id, formato, diretorio), 'r') as arquivo:
+        return arquivo.read()
+
+
+class CapturaPerfil:
+    """
+    Perfil de uma análise, como gerenciador de contexto: amostra as pilhas
+    enquanto o bloco executa e grava o perfil ao sair, mesmo em caso de erro.
+    Quem executa o bloco preenche `linha_tempo` com a linha do tempo do
+    pipeline (`estatisticas['linha_tempo']` de `processar_video`).
+    """
+
+    def __init__(self, perfil_id, metadados=None, intervalo=None, diretorio=None):
+        self.perfil_id = validar_perfil_id(perfil_id)
+        self.metadados = dict(metadados or {})
+        self.diretorio = diretorio
+        self.amostrador = AmostradorPilhas(intervalo)
+        self.linha_tempo = None
+
+    def __enter__(self):
+        self.amostrador.iniciar()
+        return self
+
+    def __exit__(self, tipo, erro, rastro):
+        self.amostrador.parar()
+        metadados = dict(self.metadados, status='falhou' if erro else 'concluido')
+        if erro:
+            metadados['erro'] = str(erro)
+        try:
+            salvar_perfil(self.perfil_id, self.amostrador, self.linha_tempo, metadados, self.diretorio)
+            logger.info(f"Perfil {self.perfil_id} gravado ({self.amostrador.amostras} amostras)")
+        except OSError as e:
+            logger.error(f"Erro ao gravar o perfil {self.perfil_id}: {str(e)}")
+        return False
@@ -0,0 +1,268 @@
+import time
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+from app.metricas import SerieHistograma
+
+# Marcador de fim de fluxo trocado entre os estágios
+_FIM = object()
+
+# Durações mais recentes guardadas por estágio para os percentis de latência
+AMOSTRAS_LATENCIA_ESTAGIO = 10000
+
+
+class Estagio:
+    """
+    Etapa do pipeline com as medições de tempo ocupado (executando a função) e
+    ocioso (aguardando item na fila de entrada ou espaço na fila de saída).
+    """
+
+    def __init__(self, nome, funcao=None):
+        self.nome = nome
+        self.funcao = funcao
+        self.ocupado = 0.0
+        self.espera_entrada = 0.0
+        self.espera_saida = 0.0
+        self.itens = 0
+        self.duracoes = deque(maxlen=AMOSTRAS_LATENCIA_ESTAGIO)
+        self.serie = SerieHistograma()  # Todas as durações, para o histograma do /metrics
+        self.linha_tempo = None  # (início, fim) de cada item, apenas quando o perfil é pedido
+
+    def registrar(self, duracao):
+        """Registra o tempo ocupado com um item."""
+        self.ocupado += duracao
+        self.itens += 1
+        self.duracoes.append(duracao)
+        self.serie.observar(duracao)
+        if self.linha_tempo is not None:
+            fim = time.perf_counter()
+            self.linha_tempo.append((fim - duracao, fim))
+
+    def percentis(self):
+        """Latência por item (em ms) nos percentis 50, 95 e 99."""
+        if not self.duracoes:
+            return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+        p50, p95, p99 = np.percentile(np.fromiter(self.duracoes, dtype=np.float64), [50, 95, 99]) * 1000
+        return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3)}
+
+    def resumo(self):
+        return {
+            'ocupado': round(self.ocupado, 3),
+            'ocioso': round(self.espera_entrada + self.espera_saida, 3),
+            'espera_entrada': round(self.espera_entrada, 3),
+            'espera_saida': round(self.espera_saida, 3),
+            'itens': self.itens,
+            **self.percentis(),
+        }
+
+
+class Pipeline:
+    """
+    Executa uma fonte de itens seguida de uma sequência de estágios.
+
+    No modo paralelo cada estágio roda em sua própria thread, ligado ao próximo
+    por uma fila limitada a `capacidade` itens; assim a decodificação, a
+    inferência e a codificação se sobrepõem e a quantidade de frames em memória
+    fica limitada. No modo sequencial os estágios são chamados um após o outro
+    na thread atual, com as mesmas medições de tempo.
+
+    Iterar sobre o pipeline retorna as saídas do último estágio, na ordem da
+    fonte. Uma exceção em qualquer estágio interrompe os demais e é relançada
+    para quem está iterando.
+    """
+
+    def __init__(self, fonte, estagios, capacidade=4, paralelo=True, nome_fonte='decodificacao', linha_tempo=False,
+                 rotular=None):
+        """
+        Args:
+            fonte: Iterável que produz os itens de entrada
+            estagios: Lista de tuplas (nome, função); cada função recebe a saída
+                do estágio anterior e retorna a entrada do próximo
+            capacidade: Tamanho máximo de cada fila entre estágios
+            paralelo: Se cada estágio deve rodar em uma thread própria
+            nome_fonte: Nome usado nas medições da fonte
+            linha_tempo: Se o início e o fim de cada item em cada estágio devem
+                ser guardados (ver `obter_linha_tempo`)
+            rotular: Função opcional que descreve cada item da fonte na linha
+                do tempo (ex.: os frames do lote)
+        """
+        self.fonte = fonte
+        self.estagios = [Estagio(nome_fonte)] + [Estagio(nome, funcao) for nome, funcao in estagios]
+        self.capacidade = max(1, int(capacidade))
+        self.paralelo = paralelo
+        self.tempo_total = 0.0
+        self.inicio = None
+        self.rotular = rotular
+        self.rotulos = [] if linha_tempo and rotular else None
+        if linha_tempo:
+            for estagio in self.estagios:
+                estagio.linha_tempo = []
+        self._parar = threading.Event()
+        self._erro = None
+
+    def tempos(self):
+        """
+        Retorna as medições de cada estágio e o tempo total de execução.
+        """
+        return {
+            'paralelo': self.paralelo,
+            'tempo_total': round(self.tempo_total, 3),
+            'estagios': {estagio.nome: estagio.resumo() for estagio in self.estagios},
+        }
+
+    def series(self):
+        """Histograma das durações de cada estágio (ver `app.metricas.SerieHistograma`)."""
+        return {estagio.nome: estagio.serie.para_dict() for estagio in self.estagios}
+
+    def obter_linha_tempo(self):
+        """
+        Retorna, para cada item, o início e a duração (em ms, a partir do início
+        do pipeline) em cada estágio. Os estágios processam os itens na ordem
+        da fonte, então o n-ésimo registro de cada estágio é o mesmo item.
+
+        Returns:
+            list: Um dicionário por item com 'item', 'rotulo' e 'estagios'
+                ({nome: [inicio_ms, duracao_ms]}), ou None sem `linha_tempo`
+        """
+        if self.estagios[0].linha_tempo is None:
+            return None
+        base = self.inicio or 0.0
+        itens = []
+        for i in range(len(self.estagios[0].linha_tempo)):
+            estagios = {}
+            for estagio in self.estagios:
+                if i < len(estagio.linha_tempo):
+                    inicio, fim = estagio.linha_tempo[i]
+                    estagios[estagio.nome] = [round((inicio - base) * 1000, 3), round((fim - inicio) * 1000, 3)]
+            itens.append({
+                'item': i,
+                'rotulo': self.rotulos[i] if self.rotulos is not None and i < len(self.rotulos) else None,
+                'estagios': estagios,
+            })
+        return itens
+
+    def _registrar_fonte(self, estagio, duracao, item):
+        estagio.registrar(duracao)
+        if self.rotulos is not None:
+            self.rotulos.append(self.rotular(item))
+
+    def __iter__(self):
+        inicio = self.inicio = time.perf_counter()
+        try:
+            if self.paralelo:
+                yield from self._executar_paralelo()
+            else:
+                yield from self._executar_sequencial()
+        finally:
+            self.tempo_total = time.perf_counter() - inicio
+
+    def _executar_sequencial(self):
+        fonte = self.estagios[0]
+        iterador = iter(self.fonte)
+        while True:
+            t = time.perf_counter()
+            try:
+                item = next(iterador)
+            except StopIteration:
+                fonte.ocupado += time.perf_counter() - t
+                break
+            self._registrar_fonte(fonte, time.perf_counter() - t, item)
+
+            for estagio in self.estagios[1:]:
+                t = time.perf_counter()
+                item = estagio.funcao(item)
+                estagio.registrar(time.perf_counter() - t)
+            yield item
+
+    def _executar_paralelo(self):
+        filas = [queue.Queue(maxsize=self.capacidade) for _ in self.estagios]
+        threads = [threading.Thread(target=self._executar_fonte, args=(self.estagios[0], filas[0]),
+                                    name=f"pipeline-{self.estagios[0].nome}", daemon=True)]
+        for i, estagio in enumerate(self.estagios[1:], start=1):
+            threads.append(threading.Thread(target=self._executar_estagio, args=(estagio, filas[i - 1], filas[i]),
+                                            name=f"pipeline-{estagio.nome}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        concluido = False
+        try:
+            while True:
+                item = self._obter(filas[-1])
+                if item is _FIM:
+                    break
+                yield item
+            concluido = True
+        finally:
+            if not concluido:
+                # Iteração interrompida por quem consome: parar os estágios
+                self._parar.set()
+            for thread in threads:
+                thread.join()
+
+        if self._erro is not None:
+            raise self._erro
+
+    def _falhar(self, erro):
+        if self._erro is None:
+            self._erro = erro
+        self._parar.set()
+
+    def _colocar(self, fila, item):
+        while not self._parar.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _obter(self, fila):
+        while True:
+            try:
+                return fila.get(timeout=0.1)
+            except queue.Empty:
+                if self._parar.is_set():
+                    return _FIM
+
+    def _executar_fonte(self, estagio, saida):
+        try:
+            iterador = iter(self.fonte)
+            while not self._parar.is_set():
+                t = time.perf_counter()
+                try:
+                    item = next(iterador)
+                except StopIteration:
+                    estagio.ocupado += time.perf_counter() - t
+                    break
+                self._registrar_fonte(estagio, time.perf_counter() - t, item)
+
+                t = time.perf_counter()
+                self._colocar(saida, item)
+                estagio.espera_saida += time.perf_counter() - t
+        except BaseException as e:
+            self._falhar(e)
+        finally:
+            self._colocar(saida, _FIM)
+
+    def _executar_estagio(self, estagio, entrada, saida):
+        try:
+            while True:
+                t = time.perf_counter()
+                item = self._obter(entrada)
+                estagio.espera_entrada += time.perf_counter() - t
+                if item is _FIM:
+                    break
+
+                t = time.perf_counter()
+                resultado = estagio.funcao(item)
+                estagio.registrar(time.perf_counter() - t)
+
+                t = time.perf_counter()
+                self._colocar(saida, resultado)
+                estagio.espera_saida += time.perf_counter() - t
+        except BaseException as e:
+            self._falhar(e)
+        finally:
+            self._colocar(saida, _FIM)
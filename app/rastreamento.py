@@ -0,0 +1,220 @@
+import os
+
+import numpy as np
+
+# IoU mínimo entre a caixa de um evento e a caixa do frame atual para continuar o evento
+IOU_MINIMO_EVENTO = float(os.environ.get('IOU_MINIMO_EVENTO', 0.3))
+
+# Tempo (em segundos) que um evento sem novas caixas aguarda antes de ser
+# encerrado; cobre falhas pontuais do detector, oclusões e frames não inferidos
+TEMPO_MAXIMO_PERDA_EVENTO = float(os.environ.get('TEMPO_MAXIMO_PERDA_EVENTO', 1.0))
+
+# Caixas com confiança a partir deste valor são associadas primeiro aos eventos
+# ativos; as demais só são usadas para os eventos que ficaram sem caixa
+CONFIANCA_ALTA_EVENTO = float(os.environ.get('CONFIANCA_ALTA_EVENTO', 0.5))
+
+
+def calcular_iou(caixas_a, caixas_b):
+    """
+    Calcula a matriz de IoU entre dois conjuntos de caixas x1, y1, x2, y2.
+
+    Returns:
+        np.ndarray: Matriz (len(caixas_a), len(caixas_b))
+    """
+    a = np.asarray(caixas_a, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(caixas_b, dtype=np.float64).reshape(-1, 4)[None, :, :]
+    largura = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    altura = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersecao = largura * altura
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    uniao = area_a + area_b - intersecao
+    return np.divide(intersecao, uniao, out=np.zeros_like(intersecao), where=uniao > 0)
+
+
+class _Evento:
+    # Estado de um evento em andamento
+
+    def __init__(self, evento_id, classe, deteccao):
+        self.evento_id = evento_id
+        self.classe = classe
+        self.inicio = self.fim = deteccao['tempo']
+        self.frame_inicial = self.frame_final = deteccao['frame_num']
+        self.caixa = deteccao['coordenadas']
+        self.total = 0
+        self.soma_confianca = 0.0
+        self.confianca_maxima = 0.0
+        self.melhor = None
+        self.adicionar(deteccao)
+
+    def adicionar(self, deteccao):
+        self.fim = deteccao['tempo']
+        self.frame_final = deteccao['frame_num']
+        self.caixa = deteccao['coordenadas']
+        self.total += 1
+        self.soma_confianca += deteccao['confianca']
+        self.confianca_maxima = max(self.confianca_maxima, deteccao['confianca'])
+        # O melhor frame é o de maior confiança entre os salvos em disco (os
+        # quase duplicados não são salvos); sem nenhum salvo, o de maior confiança
+        chave = (bool(deteccao.get('frame_path')), deteccao['confianca'])
+        if self.melhor is None or chave > (bool(self.melhor.get('frame_path')), self.melhor['confianca']):
+            self.melhor = deteccao
+
+    def para_dict(self):
+        return {
+            'evento_id': self.evento_id,
+            'classe': self.classe,
+            'inicio': self.inicio,
+            'fim': self.fim,
+            'duracao': round(self.fim - self.inicio, 3),
+            'frame_inicial': self.frame_inicial,
+            'frame_final': self.frame_final,
+            'total_deteccoes': self.total,
+            'confianca_maxima': self.confianca_maxima,
+            'confianca_media': round(self.soma_confianca / self.total, 4),
+            'melhor_frame': self.melhor['frame_num'],
+            'coordenadas': self.melhor['coordenadas'],
+            'frame_path': self.melhor.get('frame_path'),
+        }
+
+
+class RastreadorEventos:
+    """
+    Agrupa as caixas detectadas frame a frame em eventos: a mesma faca visível
+    por 10 segundos gera um evento com início, fim, confiança de pico e melhor
+    frame, em vez de uma detecção por frame.
+
+    A associação segue a ideia do ByteTrack, sem modelo de movimento: as caixas
+    de alta confiança são associadas primeiro aos eventos ativos da mesma
+    classe (maior IoU primeiro); as de baixa confiança só continuam eventos que
+    ficaram sem caixa, e caixas não associadas abrem novos eventos. Um evento
+    é encerrado após `tempo_maximo_perda` segundos sem novas caixas.
+    """
+
+    def __init__(self, iou_minimo=None, tempo_maximo_perda=None, confianca_alta=None):
+        """
+        Args:
+            iou_minimo: IoU mínimo para associar uma caixa a um evento
+                (padrão: IOU_MINIMO_EVENTO)
+            tempo_maximo_perda: Segundos sem caixas até encerrar um evento
+                (padrão: TEMPO_MAXIMO_PERDA_EVENTO)
+            confianca_alta: Confiança a partir da qual a caixa é associada na
+                primeira etapa (padrão: CONFIANCA_ALTA_EVENTO)
+        """
+        self.iou_minimo = IOU_MINIMO_EVENTO if iou_minimo is None else iou_minimo
+        self.tempo_maximo_perda = TEMPO_MAXIMO_PERDA_EVENTO if tempo_maximo_perda is None else tempo_maximo_perda
+        self.confianca_alta = CONFIANCA_ALTA_EVENTO if confianca_alta is None else confianca_alta
+        self.ativos = []
+        self._proximo_id = 1
+
+    def _associar(self, eventos, deteccoes):
+        # Associação gulosa pelo maior IoU, apenas entre a mesma classe
+        if not eventos or not deteccoes:
+            return [], list(range(len(eventos))), list(range(len(deteccoes)))
+        iou = calcular_iou([e.caixa for e in eventos], [d['coordenadas'] for d in deteccoes])
+        classes_eventos = np.array([e.classe for e in eventos], dtype=object)[:, None]
+        classes_deteccoes = np.array([d['classe'] for d in deteccoes], dtype=object)[None, :]
+        iou[classes_eventos != classes_deteccoes] = 0
+
+        pares = []
+        eventos_livres, deteccoes_livres = set(range(len(eventos))), set(range(len(deteccoes)))
+        for indice in np.argsort(-iou, axis=None):
+            i, j = np.unravel_index(indice, iou.shape)
+            if iou[i, j] < self.iou_minimo:
+                break
+            if i in eventos_livres and j in deteccoes_livres:
+                pares.append((i, j))
+                eventos_livres.discard(i)
+                deteccoes_livres.discard(j)
+        return pares, sorted(eventos_livres), sorted(deteccoes_livres)
+
+    def atualizar(self, tempo, deteccoes):
+        """
+        Processa as caixas de um frame.
+
+        Args:
+            tempo: Instante do frame em segundos
+            deteccoes: Detecções do frame, no formato retornado pela API
+                (frame_num, tempo, classe, confianca, coordenadas, frame_path)
+
+        Returns:
+            list: Eventos encerrados até este frame
+        """
+        encerrados = [e for e in self.ativos if tempo - e.fim > self.tempo_maximo_perda]
+        self.ativos = [e for e in self.ativos if tempo - e.fim <= self.tempo_maximo_perda]
+
+        altas = [d for d in deteccoes if d['confianca'] >= self.confianca_alta]
+        baixas = [d for d in deteccoes if d['confianca'] < self.confianca_alta]
+
+        pares, livres, altas_livres = self._associar(self.ativos, altas)
+        for i, j in pares:
+            self.ativos[i].adicionar(altas[j])
+        restantes = [self.ativos[i] for i in livres]
+        pares, _, baixas_livres = self._associar(restantes, baixas)
+        for i, j in pares:
+            restantes[i].adicionar(baixas[j])
+
+        for deteccao in [altas[j] for j in altas_livres] + [baixas[j] for j in baixas_livres]:
+            self.ativos.append(_Evento(self._proximo_id, deteccao['classe'], deteccao))
+            self._proximo_id += 1
+
+        return [e.para_dict() for e in encerrados]
+
+    def finalizar(self):
+        """
+        Encerra os eventos ainda ativos (fim do vídeo).
+
+        Returns:
+            list: Eventos encerrados
+        """
+        encerrados, self.ativos = self.ativos, []
+        return [e.para_dict() for e in encerrados]
+
+
+def agrupar_eventos(deteccoes, **opcoes):
+    """
+    Agrupa a lista de detecções de um vídeo em eventos.
+
+    Args:
+        deteccoes: Lista de detecções retornada por `processar_video`
+        **opcoes: Parâmetros de `RastreadorEventos` (iou_minimo,
+            tempo_maximo_perda, confianca_alta)
+
+    Returns:
+        list: Eventos ordenados pelo início, cada um com evento_id, classe,
+        inicio, fim, duracao, frame_inicial, frame_final, total_deteccoes,
+        confianca_maxima, confianca_media, melhor_frame, coordenadas (do melhor
+        frame) e frame_path (do melhor frame)
+    """
+    return agrupar_eventos_em_ordem(sorted(deteccoes, key=lambda deteccao: deteccao['frame_num']), **opcoes)
+
+
+def agrupar_eventos_em_ordem(deteccoes, **opcoes):
+    """
+    Como `agrupar_eventos`, para detecções já ordenadas por frame (ex.: lidas
+    de um `DiarioDeteccoes`): o iterável é consumido frame a frame, sem ser
+    guardado em memória.
+    """
+    rastreador = RastreadorEventos(**opcoes)
+    eventos = []
+    do_frame = []
+    for deteccao in deteccoes:
+        if do_frame and deteccao['frame_num'] != do_frame[0]['frame_num']:
+            eventos.extend(rastreador.atualizar(do_frame[0]['tempo'], do_frame))
+            do_frame = []
+        do_frame.append(deteccao)
+    if do_frame:
+        eventos.extend(rastreador.atualizar(do_frame[0]['tempo'], do_frame))
+    eventos.extend(rastreador.finalizar())
+    eventos.sort(key=lambda evento: (evento['inicio'], evento['evento_id']))
+    return eventos
+
+
+def eventos_representativos(eventos, limite):
+    """
+    Seleciona até `limite` eventos de maior confiança, na ordem do vídeo.
+    """
+    if len(eventos) <= limite:
+        return list(eventos)
+    selecionados = sorted(eventos, key=lambda evento: evento['confianca_maxima'], reverse=True)[:limite]
+    return sorted(selecionados, key=lambda evento: evento['inicio'])
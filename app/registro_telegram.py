@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import requests
+
+from app.alerta_telegram import URL_API_TELEGRAM
+
+logger = logging.getLogger(__name__)
+
+# Banco SQLite com os usuários registrados e o índice de contatos do bot
+REGISTRO_TELEGRAM_DB = os.environ.get('REGISTRO_TELEGRAM_DB', 'usuarios_telegram.db')
+
+# Arquivo JSON usado antes do banco; importado na primeira abertura
+REGISTRO_TELEGRAM_JSON_LEGADO = os.environ.get('REGISTRO_TELEGRAM_JSON_LEGADO', 'usuarios_telegram.json')
+
+# Tempo (em segundos) que cada chamada ao getUpdates aguarda por novas
+# mensagens (long polling); o Telegram responde assim que uma chega
+TELEGRAM_LONG_POLLING_S = int(os.environ.get('TELEGRAM_LONG_POLLING_S', 25))
+
+# Espera máxima (em segundos) entre tentativas após uma falha no getUpdates
+TELEGRAM_ESPERA_MAXIMA_ATUALIZACOES_S = float(os.environ.get('TELEGRAM_ESPERA_MAXIMA_ATUALIZACOES_S', 60))
+
+
+def normalizar_usuario(usuario):
+    """Nomes de usuário do Telegram não diferenciam maiúsculas e podem vir com @."""
+    return str(usuario or '').strip().lstrip('@').lower()
+
+
+class RegistroTelegram:
+    """
+    Registro dos usuários do Telegram (nome de usuário -> chat_id).
+
+    Os dados ficam em um banco SQLite, com cópia em memória: as consultas não
+    leem o disco e cada gravação é uma transação, então registros simultâneos
+    não corrompem o arquivo. Além dos usuários registrados, mantém um índice
+    dos contatos que escreveram para o bot, atualizado em segundo plano pelo
+    getUpdates com o offset salvo no banco: cada mensagem é lida uma única
+    vez, em vez de baixar e percorrer todas as atualizações a cada registro.
+    """
+
+    def __init__(self, token, caminho_db=None, url_base=None, json_legado=None):
+        """
+        Args:
+            token: Token do bot do Telegram
+            caminho_db: Caminho do banco SQLite (padrão: REGISTRO_TELEGRAM_DB)
+            url_base: URL da API do Telegram (padrão: URL_API_TELEGRAM)
+            json_legado: Arquivo JSON importado se o banco estiver vazio
+                (padrão: REGISTRO_TELEGRAM_JSON_LEGADO)
+        """
+        self.token = token
+        self.caminho_db = caminho_db or REGISTRO_TELEGRAM_DB
+        self.url_base = (url_base or URL_API_TELEGRAM).rstrip('/')
+        self.json_legado = REGISTRO_TELEGRAM_JSON_LEGADO if json_legado is None else json_legado
+        self.usuarios = {}  # usuário normalizado -> chat_id dos usuários registrados
+        self.contatos = {}  # usuário normalizado -> chat_id de quem escreveu para o bot
+        self.offset = 0  # Próximo update_id a ler do getUpdates
+        self.atualizacoes_lidas = 0
+        self._conexao = None
+        self._lock = threading.Lock()  # Serializa as gravações no banco
+        self._lock_atualizacao = threading.Lock()  # Uma chamada ao getUpdates por vez
+        self._novos_contatos = threading.Condition()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def abrir(self):
+        """Abre (ou cria) o banco e carrega os registros em memória."""
+        if self._conexao is not None:
+            return self
+        os.makedirs(os.path.dirname(os.path.abspath(self.caminho_db)), exist_ok=True)
+        conexao = sqlite3.connect(self.caminho_db, check_same_thread=False, timeout=30)
+        # WAL: leituras de outros processos não bloqueiam as gravações
+        conexao.execute("PRAGMA journal_mode=WAL")
+        with conexao:
+            conexao.execute("CREATE TABLE IF NOT EXISTS usuarios "
+                            "(usuario TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, registrado_em REAL NOT NULL)")
+            conexao.execute("CREATE TABLE IF NOT EXISTS contatos "
+                            "(usuario TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, atualizado_em REAL NOT NULL)")
+            conexao.execute("CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        self._conexao = conexao
+
+        self.usuarios = dict(conexao.execute("SELECT usuario, chat_id FROM usuarios"))
+        self.contatos = dict(conexao.execute("SELECT usuario, chat_id FROM contatos"))
+        linha = conexao.execute("SELECT valor FROM estado WHERE chave = 'offset'").fetchone()
+        self.offset = int(linha[0]) if linha else 0
+        if not self.usuarios:
+            self._importar_json_legado()
+        return self
+
+    def _importar_json_legado(self):
+        if not self.json_legado or not os.path.exists(self.json_legado):
+            return
+        try:
+            with open(self.json_legado, 'r') as arquivo:
+                usuarios = json.load(arquivo)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Não foi possível importar {self.json_legado}: {str(e)}")
+            return
+        for usuario, chat_id in usuarios.items():
+            if chat_id:
+                self.registrar(usuario, chat_id)
+        logger.info(f"{len(usuarios)} usuários importados de {self.json_legado}")
+
+    def _gravar(self, funcao):
+        """
+        Executa `funcao(conexao)` em uma transação, sob o lock das gravações.
+        A conexão é conferida já com o lock: um `encerrar` concorrente pode
+        tê-la fechado depois do `abrir`, e então o banco é reaberto.
+        """
+        while True:
+            self.abrir()
+            with self._lock:
+                if self._conexao is None:
+                    continue
+                with self._conexao:
+                    return funcao(self._conexao)
+
+    def registrar(self, usuario, chat_id):
+        """Registra (ou atualiza) o chat_id de um usuário."""
+        chave = normalizar_usuario(usuario)
+
+        def gravar(conexao):
+            conexao.execute("INSERT OR REPLACE INTO usuarios (usuario, chat_id, registrado_em) VALUES (?, ?, ?)",
+                            (chave, int(chat_id), time.time()))
+            self.usuarios[chave] = int(chat_id)
+
+        self._gravar(gravar)
+
+    def remover(self, usuario):
+        """
+        Remove o registro de um usuário.
+
+        Returns:
+            bool: True se o usuário estava registrado
+        """
+        chave = normalizar_usuario(usuario)
+
+        def apagar(conexao):
+            conexao.execute("DELETE FROM usuarios WHERE usuario = ?", (chave,))
+            return self.usuarios.pop(chave, None) is not None
+
+        return self._gravar(apagar)
+
+    def obter_chat_id(self, usuario):
+        """Retorna o chat_id de um usuário registrado, ou None."""
+        return self.usuarios.get(normalizar_usuario(usuario))
+
+    def buscar_contato(self, usuario, tempo_limite=0):
+        """
+        Procura o chat_id de um usuário entre os contatos do bot.
+
+        Args:
+            usuario: Nome de usuário do Telegram
+            tempo_limite: Segundos aguardando a mensagem do usuário chegar
+                pelo getUpdates (apenas com a atualização em segundo plano ativa)
+
+        Returns:
+            int: chat_id do usuário, ou None se ele não escreveu para o bot
+        """
+        chave = normalizar_usuario(usuario)
+        if chave not in self.contatos and not self.atualizando():
+            # Sem a thread de atualização, ler as mensagens novas agora
+            self.atualizar_contatos()
+        with self._novos_contatos:
+            self._novos_contatos.wait_for(lambda: chave in self.contatos, timeout=tempo_limite)
+        return self.contatos.get(chave)
+
+    def atualizar_contatos(self, espera=0):
+        """
+        Lê as mensagens recebidas pelo bot desde o último offset e atualiza o
+        índice de contatos. O offset é salvo na mesma transação dos contatos.
+
+        Args:
+            espera: Segundos que o Telegram aguarda por novas mensagens (long polling)
+
+        Returns:
+            int: Quantidade de atualizações lidas
+        """
+        self.abrir()
+        with self._lock_atualizacao:
+            resposta = requests.get(
+                f"{self.url_base}/bot{self.token}/getUpdates",
+                params={'offset': self.offset, 'timeout': espera, 'allowed_updates': json.dumps(['message'])},
+                timeout=espera + 30
+            )
+            resposta.raise_for_status()
+            dados = resposta.json()
+            if not dados.get('ok'):
+                raise RuntimeError(f"getUpdates falhou: {dados}")
+            atualizacoes = dados.get('result', [])
+            if not atualizacoes:
+                return 0
+
+            novos = {}
+            for atualizacao in atualizacoes:
+                mensagem = atualizacao.get('message') or {}
+                usuario = normalizar_usuario((mensagem.get('from') or {}).get('username'))
+                chat_id = (mensagem.get('chat') or {}).get('id')
+                if usuario and chat_id is not None:
+                    novos[usuario] = int(chat_id)
+            offset = max(atualizacao['update_id'] for atualizacao in atualizacoes) + 1
+
+            agora = time.time()
+            with self._lock:
+                if self._conexao is None:
+                    # Registro encerrado durante o long polling
+                    return 0
+                with self._conexao:
+                    self._conexao.executemany(
+                        "INSERT OR REPLACE INTO contatos (usuario, chat_id, atualizado_em) VALUES (?, ?, ?)",
+                        [(usuario, chat_id, agora) for usuario, chat_id in novos.items()]
+                    )
+                    self._conexao.execute("INSERT OR REPLACE INTO estado (chave, valor) VALUES ('offset', ?)",
+                                          (str(offset),))
+                self.offset = offset
+            with self._novos_contatos:
+                self.contatos.update(novos)
+                self._novos_contatos.notify_all()
+            self.atualizacoes_lidas += len(atualizacoes)
+            return len(atualizacoes)
+
+    def _atualizar_continuamente(self):
+        falhas = 0
+        while not self._parar.is_set():
+            try:
+                self.atualizar_contatos(espera=TELEGRAM_LONG_POLLING_S)
+                falhas = 0
+            except Exception as e:
+                falhas += 1
+                espera = min(TELEGRAM_ESPERA_MAXIMA_ATUALIZACOES_S, 2 ** falhas)
+                logger.warning(f"Erro ao ler as atualizações do Telegram: {str(e)}; nova tentativa em {espera}s")
+                self._parar.wait(espera)
+
+    def iniciar(self):
+        """
+        Inicia a atualização do índice de contatos em segundo plano.
+
+        Apenas um processo por bot deve chamar este método: o Telegram recusa
+        chamadas simultâneas ao getUpdates.
+        """
+        self.abrir()
+        if not self.token or self.atualizando():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._atualizar_continuamente, name='registro-telegram', daemon=True)
+        self._thread.start()
+
+    def atualizando(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def encerrar(self):
+        # A thread pode estar aguardando o long polling; ela é daemon e termina com o processo
+        self._parar.set()
+        with self._lock:
+            if self._conexao is not None:
+                self._conexao.close()
+                self._conexao = None
+
+    def estatisticas(self):
+        return {
+            'usuarios_registrados': len(self.usuarios),
+            'contatos': len(self.contatos),
+            'offset': self.offset,
+            'atualizacoes_lidas': self.atualizacoes_lidas,
+            'atualizando': self.atualizando(),
+        }
@@ -0,0 +1,207 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from app.analise import inicializar_worker
+from app.detector import processar_video
+from app.deteccoes import ArmazemDeteccoes
+from app.metricas import mesclar_metricas
+
+logger = logging.getLogger(__name__)
+
+# Duração mínima (em segundos) de cada segmento; trechos menores não compensam
+# o custo de iniciar um worker e carregar o modelo
+DURACAO_MINIMA_SEGMENTO = float(os.environ.get('DURACAO_MINIMA_SEGMENTO', 10))
+
+
+def dividir_segmentos(total_frames, num_segmentos, frames_minimos=1):
+    """
+    Divide os frames [0, total_frames) em até `num_segmentos` intervalos contíguos.
+
+    Returns:
+        list: Lista de tuplas (frame_inicial, frame_final); o último intervalo
+        termina em None para ler até o fim real do vídeo, já que a contagem de
+        frames informada pelo container pode ser imprecisa
+    """
+    num_segmentos = max(1, min(int(num_segmentos), total_frames // max(1, frames_minimos) or 1))
+    tamanho = total_frames // num_segmentos
+    limites = [i * tamanho for i in range(num_segmentos)]
+    return [(inicio, limites[i + 1] if i + 1 < num_segmentos else None) for i, inicio in enumerate(limites)]
+
+
+def _processar_segmento(modelo_path, input_path, frame_inicial, frame_final, output_path, opcoes):
+    # Executado em um processo worker, com sua própria instância do modelo.
+    # As detecções voltam ao processo principal, então ficam em memória
+    estatisticas = {}
+    video, deteccoes = processar_video(
+        modelo_path, input_path, output_path=output_path, estatisticas=estatisticas,
+        frame_inicial=frame_inicial, frame_final=frame_final, ao_progredir=lambda evento: None,
+        memoria_limitada=False, **opcoes
+    )
+    return frame_inicial, video, deteccoes, estatisticas
+
+
+def juntar_videos(partes, destino, fps, largura, altura):
+    """
+    Concatena os vídeos `partes`, na ordem, em `destino`. Usa o ffmpeg (cópia
+    dos streams, sem recodificar) se estiver instalado; caso contrário,
+    regrava os frames com o OpenCV.
+    """
+    os.makedirs(os.path.dirname(destino) or '.', exist_ok=True)
+    if shutil.which('ffmpeg'):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as lista:
+            for parte in partes:
+                caminho = os.path.abspath(parte).replace("'", "'\\''")
+                lista.write(f"file '{caminho}'\n")
+        try:
+            subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', lista.name, '-c', 'copy', destino],
+                check=True
+            )
+            return destino
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Falha ao concatenar com ffmpeg, usando OpenCV: {str(e)}")
+        finally:
+            os.remove(lista.name)
+
+    out = cv2.VideoWriter(destino, cv2.VideoWriter_fourcc(*'mp4v'), fps, (largura, altura))
+    try:
+        for parte in partes:
+            cap = cv2.VideoCapture(parte)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+    return destino
+
+
+def processar_video_segmentado(modelo_path, input_path, output_path=None, limiar_confianca=0.25, salvar_frames=False,
+                               frames_dir=None, num_segmentos=None, max_workers=None, estatisticas=None,
+                               cancelar=None, ao_progredir=None, exportar_deteccoes=None, **opcoes):
+    """
+    Processa um vídeo longo dividindo-o em segmentos de tempo processados em
+    paralelo, cada um em um processo com sua própria instância do modelo.
+
+    Cada segmento posiciona a leitura com CAP_PROP_POS_FRAMES, então as
+    detecções já saem com `frame_num`/`tempo` relativos ao vídeo completo; os
+    vídeos anotados de cada segmento são concatenados em `output_path`.
+
+    Args:
+        modelo_path: Caminho para o modelo treinado
+        input_path: Caminho para o vídeo de entrada
+        output_path: Caminho para salvar o vídeo processado (opcional)
+        limiar_confianca: Limiar de confiança para considerar uma detecção
+        salvar_frames: Se deve salvar os frames onde foram detectados objetos
+        frames_dir: Diretório para salvar os frames com detecções
+        num_segmentos: Quantidade de segmentos (padrão: núcleos disponíveis)
+        max_workers: Processos em paralelo (padrão: quantidade de segmentos)
+        estatisticas: Dicionário opcional preenchido com as métricas da execução
+        cancelar: Event opcional; quando sinalizado, interrompe os segmentos
+        ao_progredir: Função opcional chamada a cada segmento concluído
+        exportar_deteccoes: Caminho opcional (.npz ou .parquet) para salvar as
+            detecções de todos os segmentos
+        **opcoes: Demais opções de `processar_video` (tamanho_lote, filtro_movimento...)
+
+    Returns:
+        tuple: (caminho do vídeo processado, lista de detecções)
+    """
+    inicio = time.perf_counter()
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise ValueError(f"Não foi possível abrir o vídeo: {input_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    largura = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    altura = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    nucleos = os.cpu_count() or 1
+    segmentos = dividir_segmentos(total_frames, num_segmentos or nucleos,
+                                  frames_minimos=int(DURACAO_MINIMA_SEGMENTO * fps) if fps > 0 else 1)
+    max_workers = max(1, min(max_workers or len(segmentos), len(segmentos)))
+    threads_por_worker = max(1, nucleos // max_workers)
+
+    opcoes.update(limiar_confianca=limiar_confianca, salvar_frames=salvar_frames, frames_dir=frames_dir,
+                  cancelar=cancelar)
+
+    pasta_partes = tempfile.mkdtemp(prefix='segmentos_')
+    resultados = {}
+    try:
+        contexto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto, initializer=inicializar_worker,
+                                 initargs=(modelo_path, threads_por_worker)) as executor:
+            futuros = []
+            for i, (frame_inicial, frame_final) in enumerate(segmentos):
+                parte = os.path.join(pasta_partes, f"segmento_{i:03d}.mp4") if output_path else None
+                opcoes_segmento = opcoes
+                if exportar_deteccoes:
+                    opcoes_segmento = dict(opcoes, exportar_deteccoes=os.path.join(pasta_partes, f"segmento_{i:03d}.npz"))
+                futuros.append(executor.submit(_processar_segmento, modelo_path, input_path, frame_inicial,
+                                               frame_final, parte, opcoes_segmento))
+
+            try:
+                for futuro in as_completed(futuros):
+                    frame_inicial, parte, deteccoes, estatisticas_segmento = futuro.result()
+                    resultados[frame_inicial] = (parte, deteccoes, estatisticas_segmento)
+                    if ao_progredir:
+                        ao_progredir({
+                            'tipo': 'progresso',
+                            'segmentos_concluidos': len(resultados),
+                            'total_segmentos': len(segmentos),
+                            'percentual': round(len(resultados) / len(segmentos) * 100, 1),
+                        })
+            except BaseException:
+                for futuro in futuros:
+                    futuro.cancel()
+                raise
+
+        # Juntar os resultados na ordem dos segmentos
+        ordem = sorted(resultados)
+        deteccoes = [deteccao for frame_inicial in ordem for deteccao in resultados[frame_inicial][1]]
+        if output_path:
+            juntar_videos([resultados[frame_inicial][0] for frame_inicial in ordem], output_path, fps, largura, altura)
+        if exportar_deteccoes:
+            partes_deteccoes = [os.path.join(pasta_partes, f"segmento_{i:03d}.npz") for i in range(len(segmentos))]
+            armazem = ArmazemDeteccoes.concatenar(ArmazemDeteccoes.carregar_npz(parte) for parte in partes_deteccoes)
+            armazem.exportar(exportar_deteccoes)
+    finally:
+        shutil.rmtree(pasta_partes, ignore_errors=True)
+
+    if estatisticas is not None:
+        tempo_total = time.perf_counter() - inicio
+        por_segmento = [resultados[frame_inicial][2] for frame_inicial in sorted(resultados)]
+        frames = sum(e.get('frames', 0) for e in por_segmento)
+        frames_inferidos = sum(e.get('frames_inferidos', 0) for e in por_segmento)
+        tempo_inferencia = sum((e.get('ms_inferencia_por_frame') or 0) * e.get('frames_inferidos', 0)
+                               for e in por_segmento)
+        estatisticas.update({
+            'frames': frames,
+            'frames_inferidos': frames_inferidos,
+            'frames_ignorados': sum(e.get('frames_ignorados', 0) for e in por_segmento),
+            'segmentos': len(segmentos),
+            'workers': max_workers,
+            'resolucao_inferencia': next((e.get('resolucao_inferencia') for e in por_segmento), None),
+            'ms_inferencia_por_frame': round(tempo_inferencia / frames_inferidos, 2) if frames_inferidos else None,
+            'tempo_total': round(tempo_total, 3),
+            'fps_processamento': round(frames / tempo_total, 2) if tempo_total > 0 else 0,
+            'por_segmento': por_segmento,
+            'metricas': mesclar_metricas(*(e.pop('metricas', None) for e in por_segmento)),
+        })
+        if any('linha_tempo' in e for e in por_segmento):
+            # Os tempos de cada segmento são relativos ao início do seu próprio pipeline
+            estatisticas['linha_tempo'] = [dict(item, segmento=i) for i, e in enumerate(por_segmento)
+                                           for item in e.pop('linha_tempo', None) or []]
+
+    return output_path, deteccoes
@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.metricas import SerieHistograma
+from app.rastreamento import calcular_iou
+
+logger = logging.getLogger(__name__)
+
+# Qualidade JPEG e largura máxima (0 mantém a resolução original) dos frames salvos
+SNAPSHOT_QUALIDADE_JPEG = int(os.environ.get('SNAPSHOT_QUALIDADE_JPEG', 85))
+SNAPSHOT_LARGURA_MAXIMA = int(os.environ.get('SNAPSHOT_LARGURA_MAXIMA', 1280))
+
+# Frames cujo dHash difere em até N bits de um frame salvo recentemente são
+# considerados quase idênticos e não são salvos (-1 desativa a supressão)
+SNAPSHOT_DISTANCIA_HASH = int(os.environ.get('SNAPSHOT_DISTANCIA_HASH', 6))
+
+# Janela (em segundos de vídeo) em que um frame salvo suprime os quase idênticos
+SNAPSHOT_JANELA_S = float(os.environ.get('SNAPSHOT_JANELA_S', 10))
+
+# IoU mínimo entre as caixas de dois frames para considerá-los a mesma cena;
+# o dHash não distingue objetos pequenos, então caixas novas ou deslocadas
+# sempre geram um novo frame salvo
+SNAPSHOT_IOU_DUPLICADO = float(os.environ.get('SNAPSHOT_IOU_DUPLICADO', 0.5))
+
+# Limite de frames salvos por vídeo
+SNAPSHOT_MAXIMO_POR_VIDEO = int(os.environ.get('SNAPSHOT_MAXIMO_POR_VIDEO', 200))
+
+# Threads de codificação e frames aguardando gravação; acima disso o frame é
+# descartado em vez de atrasar a inferência
+SNAPSHOT_THREADS = int(os.environ.get('SNAPSHOT_THREADS', 2))
+SNAPSHOT_PENDENTES_MAXIMO = int(os.environ.get('SNAPSHOT_PENDENTES_MAXIMO', 16))
+
+
+def calcular_dhash(frame, tamanho=8):
+    """
+    Hash perceptual por diferença (dHash) de 64 bits: compara o brilho de
+    pixels vizinhos em uma versão 9x8 do frame em tons de cinza.
+
+    Returns:
+        int: Hash do frame
+    """
+    cinza = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    reduzido = cv2.resize(cinza, (tamanho + 1, tamanho), interpolation=cv2.INTER_AREA)
+    bits = (reduzido[:, 1:] > reduzido[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class GravadorSnapshots:
+    """
+    Salva os frames com detecções sem bloquear o laço de inferência.
+
+    A codificação JPEG (com redução para SNAPSHOT_LARGURA_MAXIMA) e a gravação
+    rodam em um pool de threads. Antes disso, frames quase idênticos a um frame
+    salvo nos últimos SNAPSHOT_JANELA_S segundos (dHash do frame original
+    próximo e caixas nas mesmas posições) são descartados, e no máximo
+    SNAPSHOT_MAXIMO_POR_VIDEO frames são salvos.
+    """
+
+    def __init__(self, frames_dir, qualidade=None, largura_maxima=None, distancia_hash=None, janela=None,
+                 maximo=None, threads=None, pendentes_maximo=None):
+        """
+        Args:
+            frames_dir: Diretório onde os frames são salvos
+            qualidade: Qualidade JPEG (padrão: SNAPSHOT_QUALIDADE_JPEG)
+            largura_maxima: Largura máxima dos frames salvos (padrão: SNAPSHOT_LARGURA_MAXIMA)
+            distancia_hash: Distância de Hamming máxima entre quase idênticos
+                (padrão: SNAPSHOT_DISTANCIA_HASH)
+            janela: Segundos em que um frame salvo suprime os quase idênticos
+                (padrão: SNAPSHOT_JANELA_S)
+            maximo: Limite de frames salvos (padrão: SNAPSHOT_MAXIMO_POR_VIDEO)
+            threads: Threads de codificação (padrão: SNAPSHOT_THREADS)
+            pendentes_maximo: Frames aguardando gravação (padrão: SNAPSHOT_PENDENTES_MAXIMO)
+        """
+        self.frames_dir = frames_dir
+        self.qualidade = qualidade or SNAPSHOT_QUALIDADE_JPEG
+        self.largura_maxima = SNAPSHOT_LARGURA_MAXIMA if largura_maxima is None else largura_maxima
+        self.distancia_hash = SNAPSHOT_DISTANCIA_HASH if distancia_hash is None else distancia_hash
+        self.janela = SNAPSHOT_JANELA_S if janela is None else janela
+        self.maximo = SNAPSHOT_MAXIMO_POR_VIDEO if maximo is None else maximo
+        self.pendentes = threading.BoundedSemaphore(pendentes_maximo or SNAPSHOT_PENDENTES_MAXIMO)
+        self.executor = ThreadPoolExecutor(max_workers=threads or SNAPSHOT_THREADS, thread_name_prefix='snapshot')
+        self.recentes = []  # (tempo, dhash, caixas) dos frames salvos dentro da janela
+        self.contadores = {'salvos': 0, 'duplicados': 0, 'acima_limite': 0, 'descartados_fila': 0, 'erros': 0}
+        self.falhas = set()  # Caminhos retornados por `salvar` cuja gravação falhou
+        self.tempo_codificacao = 0.0
+        self.serie_gravacao = SerieHistograma()  # Duração de cada gravação
+        self._lock = threading.Lock()
+        os.makedirs(frames_dir, exist_ok=True)
+
+    def _mesmas_caixas(self, caixas, salvas):
+        if caixas is None or salvas is None:
+            return True
+        if len(caixas) != len(salvas):
+            return False
+        return len(caixas) == 0 or bool((calcular_iou(caixas, salvas).max(axis=1) >= SNAPSHOT_IOU_DUPLICADO).all())
+
+    def deve_salvar(self, frame, tempo, caixas=None):
+        """
+        Decide se um frame deve ser salvo e, em caso positivo, reserva a sua
+        vaga na fila de gravação. Deve ser chamado na ordem dos frames e, se
+        retornar True, seguido de `salvar`.
+
+        Args:
+            frame: Frame original (sem anotações), usado no dHash
+            tempo: Instante do frame em segundos
+            caixas: Caixas x1, y1, x2, y2 detectadas no frame (opcional)
+
+        Returns:
+            bool: False se o limite foi atingido, se o frame é quase idêntico a
+            um frame salvo recentemente ou se a fila de gravação está cheia
+        """
+        if self.contadores['salvos'] >= self.maximo:
+            self.contadores['acima_limite'] += 1
+            return False
+        dhash = None
+        if self.distancia_hash >= 0:
+            dhash = calcular_dhash(frame)
+            self.recentes = [r for r in self.recentes if tempo - r[0] <= self.janela]
+            if any(bin(dhash ^ h).count('1') <= self.distancia_hash and self._mesmas_caixas(caixas, c)
+                   for _, h, c in self.recentes):
+                self.contadores['duplicados'] += 1
+                return False
+        if not self.pendentes.acquire(blocking=False):
+            self.contadores['descartados_fila'] += 1
+            return False
+        if dhash is not None:
+            self.recentes.append((tempo, dhash, caixas))
+        self.contadores['salvos'] += 1
+        return True
+
+    def salvar(self, frame_num, frame_anotado):
+        """
+        Agenda a gravação de um frame aprovado por `deve_salvar`.
+
+        Returns:
+            str: Caminho em que o frame será gravado. Se a gravação falhar, o
+            caminho entra em `falhas`, que deve ser consultado após `concluir`
+        """
+        caminho = os.path.join(self.frames_dir, f"frame_{frame_num:06d}.jpg")
+        futuro = self.executor.submit(self._gravar, caminho, frame_anotado)
+        futuro.add_done_callback(lambda _: self.pendentes.release())
+        return caminho
+
+    def _gravar(self, caminho, frame):
+        inicio = time.perf_counter()
+        try:
+            altura, largura = frame.shape[:2]
+            if self.largura_maxima and largura > self.largura_maxima:
+                frame = cv2.resize(frame, (self.largura_maxima, round(altura * self.largura_maxima / largura)),
+                                   interpolation=cv2.INTER_AREA)
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.qualidade])
+            if not ok:
+                raise ValueError("falha na codificação JPEG")
+            with open(caminho, 'wb') as arquivo:
+                arquivo.write(buffer.tobytes())
+        except Exception as e:
+            logger.error(f"Erro ao salvar o frame {caminho}: {str(e)}")
+            # Não deixar um JPEG truncado no lugar do frame
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+            with self._lock:
+                self.contadores['erros'] += 1
+                self.falhas.add(caminho)
+        finally:
+            duracao = time.perf_counter() - inicio
+            with self._lock:
+                self.tempo_codificacao += duracao
+                self.serie_gravacao.observar(duracao)
+
+    def concluir(self, armazem=None):
+        """
+        Aguarda a gravação dos frames pendentes e encerra as threads.
+
+        Args:
+            armazem: `ArmazemDeteccoes` cujos frame_paths devem perder os
+                caminhos que não foram gravados, para que detecções, eventos e
+                alertas não apontem para arquivos inexistentes
+        """
+        self.executor.shutdown(wait=True)
+        if armazem is not None and self.falhas:
+            armazem.descartar_frame_paths(self.falhas)
+
+    def estatisticas(self):
+        """Frames salvos, suprimidos (quase idênticos, acima do limite, fila cheia) e tempo de codificação."""
+        return dict(self.contadores, tempo_codificacao=round(self.tempo_codificacao, 3))
@@ -1,47 +1,441 @@
 import os
+import re
+import glob
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
 from ultralytics import YOLO
+from app.indice_dataset import indexar_dataset, verificar_dataset, EXTENSOES_IMAGEM
 
-def criar_config_yaml(caminho_dataset, nome_arquivo="data.yaml"):
+logger = logging.getLogger(__name__)
+
+# Formatos de exportação suportados para inferência em CPU
+FORMATOS_EXPORTACAO = ('onnx', 'openvino')
+
+# Diretório dos treinamentos em segundo plano: um subdiretório por
+# treinamento, com os pesos da última e da melhor época
+TREINAMENTOS_DIR = os.environ.get('TREINAMENTOS_DIR', os.path.join('runs', 'detect'))
+
+
+class TreinamentoCancelado(Exception):
+    """Lançada pelo callback do treinamento quando o job é cancelado."""
+
+
+def criar_config_yaml(caminho_dataset, nome_arquivo="data.yaml", resumo=None):
+    """
+    Cria o data.yaml do dataset, se ainda não existir, com o número de
+    classes obtido do índice dos rótulos (ver `app.indice_dataset`).
+
+    Args:
+        caminho_dataset: Raiz do dataset
+        nome_arquivo: Nome do arquivo de configuração
+        resumo: Resumo do índice, se já calculado
+
+    Returns:
+        str: Caminho do data.yaml
+    """
     config_path = os.path.join(caminho_dataset, nome_arquivo)
     if not os.path.exists(config_path):
-        classes = set()
-        labels_path = os.path.join(caminho_dataset, 'train', 'labels')
-        for arquivo in os.listdir(labels_path):
-            if arquivo.endswith('.txt'):
-                with open(os.path.join(labels_path, arquivo), 'r') as f:
-                    for linha in f:
-                        if linha.strip():
-                            classe = int(linha.strip().split()[0])
-                            classes.add(classe)
+        # Pelo menos a classe objeto_cortante, mesmo sem rótulos
+        nc = max(1, (resumo or indexar_dataset(caminho_dataset))['nc'])
+        nomes = ['objeto_cortante'] + [f'classe_{classe}' for classe in range(1, nc)]
 
         with open(config_path, 'w') as f:
             f.write(f"train: {os.path.join(caminho_dataset, 'train', 'images')}\n")
             f.write(f"val: {os.path.join(caminho_dataset, 'valid', 'images')}\n")
-            f.write(f"nc: {len(classes)}\n")
-            f.write("names: ['objeto_cortante']\n")
+            f.write(f"nc: {nc}\n")
+            f.write(f"names: {nomes}\n")
 
     return config_path
 
-def treinar_modelo(config_path, modelo_pre_treinado='yolov8n.pt', epochs=80, imgsz=640, batch=16):
+def _registrar_callbacks(modelo, callbacks):
+    for evento, funcao in (callbacks or {}).items():
+        modelo.add_callback(evento, funcao)
+
+def treinar_modelo(config_path, modelo_pre_treinado='yolov8n.pt', epochs=80, imgsz=640, batch=16, callbacks=None,
+                   **opcoes):
     modelo = YOLO(modelo_pre_treinado)
+    _registrar_callbacks(modelo, callbacks)
+    opcoes.setdefault('name', 'objeto_cortante_detector')
     resultados = modelo.train(
         data=config_path,
         epochs=epochs,
         imgsz=imgsz,
         batch=batch,
-        name='objeto_cortante_detector',
-        augment=True
+        augment=True,
+        **opcoes
     )
     return resultados
 
-def continuar_treinamento(modelo_path, config_path, epochs=80, imgsz=640, batch=16):
+def continuar_treinamento(modelo_path, config_path, epochs=80, imgsz=640, batch=16, retomar=False, callbacks=None,
+                          **opcoes):
+    """
+    Continua o treinamento de um modelo. Com `retomar`, `modelo_path` é o
+    last.pt de um treinamento interrompido, que prossegue da última época
+    salva com os argumentos originais (dataset, épocas, diretório).
+    """
     modelo = YOLO(modelo_path)
+    _registrar_callbacks(modelo, callbacks)
+    if retomar:
+        return modelo.train(resume=True)
+    opcoes.setdefault('name', 'objeto_cortante_detector_continuado')
+    opcoes.setdefault('exist_ok', True)
     resultados = modelo.train(
         data=config_path,
         epochs=epochs,
         imgsz=imgsz,
         batch=batch,
-        name='objeto_cortante_detector_continuado',
-        exist_ok=True
+        **opcoes
     )
     return resultados
+
+
+def validar_nome_treinamento(nome):
+    """O nome vira diretório: apenas letras, números, '_', '-' e '.'."""
+    if not nome or not re.fullmatch(r'[\w-][\w.-]*', str(nome)):
+        raise ValueError(f"Nome de treinamento inválido: {nome}")
+    return str(nome)
+
+
+def caminho_treinamento(nome):
+    return os.path.join(os.path.abspath(TREINAMENTOS_DIR), validar_nome_treinamento(nome))
+
+
+def _metricas_epoca(trainer):
+    """Perdas, mAP e tempo de uma época, a partir do trainer do ultralytics."""
+    metricas = {**trainer.label_loss_items(trainer.tloss, prefix='train'), **(trainer.metrics or {})}
+
+    def arredondar(valor):
+        return round(float(valor), 5) if valor is not None else None
+
+    return {
+        'tipo': 'epoca',
+        'epoca': trainer.epoch + 1,
+        'epocas': trainer.epochs,
+        'tempo_epoca': round(trainer.epoch_time, 2) if trainer.epoch_time else None,
+        'perdas': {chave.split('/', 1)[1]: arredondar(valor) for chave, valor in metricas.items()
+                   if chave.startswith('train/')},
+        'perdas_validacao': {chave.split('/', 1)[1]: arredondar(valor) for chave, valor in metricas.items()
+                             if chave.startswith('val/')},
+        'precisao': arredondar(metricas.get('metrics/precision(B)')),
+        'recall': arredondar(metricas.get('metrics/recall(B)')),
+        'map50': arredondar(metricas.get('metrics/mAP50(B)')),
+        'map50_95': arredondar(metricas.get('metrics/mAP50-95(B)')),
+    }
+
+
+def executar_treinamento(dataset_path, nome, epochs=80, imgsz=640, batch=16, modelo_base=None, continuar=False,
+                         retomar=False, modelo_destino=None, exportar=(), int8=False, cancelar=None, progresso=None):
+    """
+    Treina o modelo dentro de um worker do gerenciador de jobs, informando as
+    métricas de cada época.
+
+    Args:
+        dataset_path: Raiz do dataset
+        nome: Nome do treinamento (subdiretório de TREINAMENTOS_DIR)
+        epochs: Quantidade de épocas
+        imgsz: Tamanho das imagens de treinamento
+        batch: Imagens por lote
+        modelo_base: Modelo inicial (padrão: yolov8n.pt; com `continuar`, o
+            modelo cujo treinamento continua)
+        continuar: Se deve continuar o treinamento de `modelo_base` (ver
+            `continuar_treinamento`) em vez de partir do modelo pré-treinado
+        retomar: Se deve retomar o treinamento `nome`, interrompido ou
+            cancelado, a partir da última época salva
+        modelo_destino: Caminho para onde o melhor modelo é copiado ao final
+        exportar: Formatos para os quais o modelo copiado é exportado
+        int8: Se os modelos exportados devem ser quantizados
+        cancelar: Event sinalizado quando o job é cancelado; o treinamento
+            para ao fim do lote atual
+        progresso: Função que recebe o evento de início e um evento por época
+            (perdas, mAP, precisão, recall e tempo da época)
+
+    Returns:
+        dict: Nome e diretório do treinamento, métricas de cada época, resumo
+        do dataset, melhor modelo e, com `modelo_destino`, o modelo salvo e os
+        exportados
+    """
+    progresso = progresso or (lambda evento: None)
+    diretorio = caminho_treinamento(nome)
+
+    resumo_dataset = indexar_dataset(dataset_path)
+    problemas = verificar_dataset(resumo_dataset)
+    if problemas:
+        raise ValueError(f"Dataset inválido para o treinamento: {'; '.join(problemas)}")
+    config_path = criar_config_yaml(dataset_path, resumo=resumo_dataset)
+
+    epocas = []
+
+    def ao_fim_epoca(trainer):
+        evento = _metricas_epoca(trainer)
+        if evento['epoca'] > evento['epocas']:
+            # A validação final do melhor modelo chama o mesmo callback após a última época
+            return
+        epocas.append(evento)
+        progresso(evento)
+
+    def ao_fim_lote(trainer):
+        if cancelar is not None and cancelar.is_set():
+            raise TreinamentoCancelado(f"Treinamento {nome} cancelado na época {trainer.epoch + 1}")
+
+    callbacks = {'on_fit_epoch_end': ao_fim_epoca, 'on_train_batch_end': ao_fim_lote}
+    progresso({'tipo': 'inicio', 'treinamento': nome, 'diretorio': diretorio, 'epocas': epochs, 'retomado': retomar})
+    if retomar:
+        ultimo = os.path.join(diretorio, 'weights', 'last.pt')
+        if not os.path.exists(ultimo):
+            raise ValueError(f"Nenhuma época salva para retomar o treinamento {nome}")
+        continuar_treinamento(ultimo, config_path, retomar=True, callbacks=callbacks)
+    else:
+        # Cada treinamento no seu diretório: treinamentos simultâneos não se sobrescrevem
+        opcoes = {'project': os.path.dirname(diretorio), 'name': nome, 'exist_ok': True}
+        if continuar:
+            continuar_treinamento(modelo_base, config_path, epochs, imgsz, batch, callbacks=callbacks, **opcoes)
+        else:
+            treinar_modelo(config_path, modelo_base or 'yolov8n.pt', epochs, imgsz, batch, callbacks=callbacks,
+                           **opcoes)
+
+    melhor = os.path.join(diretorio, 'weights', 'best.pt')
+    resultado = {
+        'treinamento': nome,
+        'diretorio': diretorio,
+        'epocas': epocas,
+        'dataset': resumo_dataset,
+        'modelo_treinado': melhor if os.path.exists(melhor) else None,
+    }
+    if modelo_destino and resultado['modelo_treinado']:
+        # Substituir o modelo de uma só vez: as análises em andamento não leem um arquivo pela metade
+        os.makedirs(os.path.dirname(os.path.abspath(modelo_destino)), exist_ok=True)
+        temporario = modelo_destino + '.tmp'
+        shutil.copy(melhor, temporario)
+        os.replace(temporario, modelo_destino)
+        resultado['modelo_salvo_em'] = modelo_destino
+        # Exportar para os backends de CPU, calibrando o INT8 com o split de validação
+        resultado['modelos_exportados'] = [exportar_modelo(modelo_destino, formato, int8=int8, config_path=config_path)
+                                           for formato in exportar]
+    return resultado
+
+
+def caminho_exportado(modelo_path, formato='onnx', int8=False):
+    """
+    Retorna o caminho do modelo exportado ao lado de `modelo_path`
+    (ex.: models/objeto_cortante_int8.onnx ou models/objeto_cortante_openvino_model).
+    """
+    base = os.path.splitext(modelo_path)[0] + ('_int8' if int8 else '')
+    if formato == 'onnx':
+        return base + '.onnx'
+    if formato == 'openvino':
+        return base + '_openvino_model'
+    raise ValueError(f"Formato de exportação não suportado: {formato}")
+
+
+def exportacao_atualizada(exportado, modelo_path):
+    """O modelo exportado só vale se existir e for mais novo que o .pt de origem."""
+    return os.path.exists(exportado) and os.path.getmtime(exportado) >= os.path.getmtime(modelo_path)
+
+
+@contextmanager
+def _trava_exportacao(destino):
+    """
+    Lock exclusivo entre processos para a exportação de `destino`, em um
+    arquivo `<destino>.lock` ao lado dele. Os workers de análise rodam em
+    processos separados, então um lock de thread não impediria duas
+    exportações simultâneas do mesmo modelo.
+    """
+    with open(destino + '.lock', 'a+b') as arquivo:
+        if os.name == 'nt':
+            import msvcrt
+            arquivo.seek(0)
+            while True:
+                try:
+                    # LK_LOCK tenta por ~10s antes de desistir
+                    msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                arquivo.seek(0)
+                msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+
+
+def imagens_validacao(config_path, limite=None):
+    """
+    Lista as imagens do split de validação definido no data.yaml do dataset.
+    """
+    import yaml
+
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    base = config.get('path') or ''
+    entradas = config.get('val') or config.get('valid')
+    entradas = entradas if isinstance(entradas, list) else [entradas]
+
+    imagens = []
+    for entrada in entradas:
+        caminho = os.path.join(base, entrada) if base and not os.path.isabs(entrada) else entrada
+        if not os.path.exists(caminho):
+            # Caminhos relativos ao diretório do data.yaml
+            caminho = os.path.join(os.path.dirname(config_path), entrada)
+        if os.path.isdir(caminho):
+            imagens += sorted(p for p in glob.glob(os.path.join(caminho, '**', '*'), recursive=True)
+                              if p.lower().endswith(EXTENSOES_IMAGEM))
+        elif os.path.isfile(caminho):
+            with open(caminho, 'r') as f:
+                imagens += [linha.strip() for linha in f if linha.strip()]
+    return imagens[:limite] if limite else imagens
+
+
+def quantizar_onnx(onnx_path, destino, config_path, imgsz=640, imagens_calibracao=200):
+    """
+    Quantiza um modelo ONNX para INT8 (quantização estática do ONNX Runtime),
+    calibrando as ativações com imagens do split de validação.
+
+    O pós-processamento da cabeça de detecção (DFL, concatenação e sigmoides)
+    continua em FP32, onde a quantização mais afeta a precisão das caixas.
+
+    Args:
+        onnx_path: Modelo ONNX em FP32
+        destino: Caminho do modelo quantizado
+        config_path: data.yaml do dataset (usado para localizar o split de validação)
+        imgsz: Tamanho de entrada usado na calibração
+        imagens_calibracao: Quantidade máxima de imagens de calibração
+
+    Returns:
+        str: Caminho do modelo quantizado
+    """
+    import cv2
+    import numpy as np
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+    from ultralytics.data.augment import LetterBox
+
+    imagens = imagens_validacao(config_path, imagens_calibracao)
+    if not imagens:
+        raise ValueError(f"Nenhuma imagem de validação encontrada para calibração em {config_path}")
+
+    modelo = onnx.load(onnx_path)
+    nome_entrada = modelo.graph.input[0].name
+    letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)
+
+    class LeitorCalibracao(CalibrationDataReader):
+        # Mesmo pré-processamento do predictor: letterbox, BGR -> RGB, CHW, [0, 1]
+        def __init__(self):
+            self.imagens = iter(imagens)
+
+        def get_next(self):
+            for caminho in self.imagens:
+                imagem = cv2.imread(caminho)
+                if imagem is None:
+                    continue
+                imagem = letterbox(image=imagem)[..., ::-1].transpose(2, 0, 1)
+                return {nome_entrada: np.ascontiguousarray(imagem[None], dtype=np.float32) / 255.0}
+            return None
+
+    # Inferência de formas e otimizações recomendadas antes da quantização
+    preprocessado = os.path.splitext(destino)[0] + '_pre.onnx'
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(onnx_path, preprocessado)
+        grafo = onnx.load(preprocessado).graph
+    except Exception as e:
+        logger.warning(f"Pré-processamento da quantização ignorado: {str(e)}")
+        preprocessado = onnx_path
+        grafo = modelo.graph
+
+    # Nós da cabeça de detecção (último módulo do modelo) que não são convoluções
+    indice_cabeca = max((int(no.name.split('/')[1].split('.')[1]) for no in grafo.node
+                         if no.name.startswith('/model.')), default=None)
+    excluir = [no.name for no in grafo.node
+               if indice_cabeca is not None and no.name.startswith(f'/model.{indice_cabeca}/') and no.op_type != 'Conv']
+
+    try:
+        quantize_static(
+            preprocessado, destino, LeitorCalibracao(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax,
+            nodes_to_exclude=excluir,
+        )
+    finally:
+        if preprocessado != onnx_path and os.path.exists(preprocessado):
+            os.remove(preprocessado)
+
+    # Manter os metadados do ultralytics (classes, stride, imgsz) no modelo quantizado
+    quantizado = onnx.load(destino)
+    del quantizado.metadata_props[:]
+    quantizado.metadata_props.extend(modelo.metadata_props)
+    onnx.save(quantizado, destino)
+    logger.info(f"Modelo INT8 salvo em {destino} ({len(imagens)} imagens de calibração)")
+    return destino
+
+
+def exportar_modelo(modelo_path, formato='onnx', int8=False, config_path=None, imgsz=640, imagens_calibracao=200,
+                    se_desatualizado=False):
+    """
+    Exporta o modelo treinado para inferência em CPU com ONNX Runtime ou OpenVINO.
+
+    A exportação é feita em um diretório temporário e o resultado é movido para
+    `caminho_exportado(modelo_path, formato, int8)` ao final, então processos
+    que exportem o mesmo modelo ao mesmo tempo não corrompem o arquivo. Além
+    disso, as exportações para o mesmo destino são serializadas entre
+    processos por um arquivo de lock.
+
+    Args:
+        modelo_path: Caminho do modelo .pt
+        formato: 'onnx' ou 'openvino'
+        int8: Se deve quantizar para INT8, calibrando com o split de validação
+        config_path: data.yaml do dataset (obrigatório com int8)
+        imgsz: Tamanho de entrada de referência (as entradas são dinâmicas)
+        imagens_calibracao: Quantidade máxima de imagens de calibração
+        se_desatualizado: Se deve manter o modelo exportado que, ao obter o
+            lock, já estiver mais novo que o .pt (exportado por outro processo)
+
+    Returns:
+        str: Caminho do modelo exportado
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação não suportado: {formato}")
+    if int8 and not config_path:
+        raise ValueError("A quantização INT8 requer o data.yaml do dataset para calibração")
+
+    destino = caminho_exportado(modelo_path, formato, int8)
+    with _trava_exportacao(destino):
+        if se_desatualizado and exportacao_atualizada(destino, modelo_path):
+            return destino
+        temporario = tempfile.mkdtemp(prefix='exportacao_', dir=os.path.dirname(os.path.abspath(modelo_path)))
+        try:
+            copia = os.path.join(temporario, os.path.basename(modelo_path))
+            shutil.copy(modelo_path, copia)
+            modelo = YOLO(copia)
+
+            if formato == 'onnx':
+                # Entradas dinâmicas: lotes de frames e resoluções diferentes da exportação
+                exportado = modelo.export(format='onnx', dynamic=True, imgsz=imgsz, device='cpu')
+                if int8:
+                    exportado = quantizar_onnx(exportado, os.path.join(temporario, 'int8.onnx'), config_path,
+                                               imgsz=imgsz, imagens_calibracao=imagens_calibracao)
+            else:
+                # O OpenVINO quantiza com o NNCF, calibrando com o split de validação do data.yaml
+                opcoes = {'int8': True, 'data': config_path} if int8 else {}
+                exportado = modelo.export(format='openvino', dynamic=True, imgsz=imgsz, device='cpu', **opcoes)
+
+            if os.path.isdir(destino):
+                shutil.rmtree(destino)
+            os.replace(exportado, destino)
+        finally:
+            shutil.rmtree(temporario, ignore_errors=True)
+
+    logger.info(f"Modelo exportado para {destino}")
+    return destino
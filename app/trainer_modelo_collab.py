@@ -6,6 +6,7 @@
 import os
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
 from google.colab import drive
 import matplotlib.pyplot as plt
@@ -32,20 +33,22 @@ def criar_arquivo_config(nome_arquivo="data.yaml"):
     # Verifica se o arquivo já existe
     if not os.path.exists(f"{caminho_dataset}/{nome_arquivo}"):
         print(f"Arquivo {nome_arquivo} não encontrado. Criando arquivo de configuração...")
-        # Obter o número de classes contando os arquivos na pasta train/labels
-        arquivos_labels = os.listdir(f"{caminho_dataset}/train/labels")
-        
-        # Lê um dos arquivos para determinar as classes
+        # Obter o número de classes lendo todos os arquivos da pasta train/labels
+        # (em paralelo: no Drive, o custo é abrir cada arquivo)
+        arquivos_labels = [arquivo for arquivo in os.listdir(f"{caminho_dataset}/train/labels")
+                           if arquivo.endswith('.txt')]
+
+        def classes_do_arquivo(arquivo):
+            with open(f"{caminho_dataset}/train/labels/{arquivo}", 'r') as f:
+                return {int(linha.split()[0]) for linha in f if linha.strip()}
+
         classes = set()
-        for arquivo in arquivos_labels[:10]:  # Verificar os 10 primeiros arquivos
-            if arquivo.endswith('.txt'):
-                with open(f"{caminho_dataset}/train/labels/{arquivo}", 'r') as f:
-                    for linha in f:
-                        if linha.strip():
-                            classe = int(linha.strip().split()[0])
-                            classes.add(classe)
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            for classes_arquivo in executor.map(classes_do_arquivo, arquivos_labels):
+                classes |= classes_arquivo
         
-        num_classes = len(classes)
+        # Os ids das classes são índices: com as classes 0 e 2, nc precisa ser 3
+        num_classes = max(classes) + 1 if classes else 1
         print(f"Número de classes detectadas: {num_classes}")
         
         # Cria o arquivo de configuração
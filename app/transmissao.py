@@ -0,0 +1,524 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from app import metricas
+from app.modelos import obter_modelo
+from app.detector import escolher_resolucao
+from app.rastreamento import RastreadorEventos
+from app.alerta_telegram import enviar_alerta_telegram, gerar_mensagem_padrao
+
+logger = logging.getLogger(__name__)
+
+# Latência máxima (em segundos) entre a captura de um frame e o fim da sua
+# inferência; frames que não cabem nesse limite são descartados
+TRANSMISSAO_LATENCIA_MAXIMA_S = float(os.environ.get('TRANSMISSAO_LATENCIA_MAXIMA_S', 1.0))
+
+# Frames (de transmissões diferentes) inferidos em uma mesma chamada ao modelo
+TRANSMISSAO_TAMANHO_LOTE = int(os.environ.get('TRANSMISSAO_TAMANHO_LOTE', 8))
+
+# Espera (em segundos) antes de reconectar uma transmissão interrompida
+TRANSMISSAO_ESPERA_RECONEXAO_S = float(os.environ.get('TRANSMISSAO_ESPERA_RECONEXAO_S', 2))
+
+# Detecções de um evento antes do alerta; evita alertar por falsos positivos de um frame
+TRANSMISSAO_DETECCOES_ALERTA = int(os.environ.get('TRANSMISSAO_DETECCOES_ALERTA', 3))
+
+# Alertas aguardando entrega à fila de envio; acima disso novos alertas são
+# descartados em vez de se acumularem enquanto o Telegram estiver lento
+TRANSMISSAO_ALERTAS_PENDENTES = int(os.environ.get('TRANSMISSAO_ALERTAS_PENDENTES', 32))
+
+# Diretório dos frames enviados nos alertas
+TRANSMISSAO_FRAMES_DIR = os.environ.get('TRANSMISSAO_FRAMES_DIR', 'videos/transmissoes')
+
+# Estados de uma transmissão
+CONECTANDO = 'conectando'
+ATIVA = 'ativa'
+RECONECTANDO = 'reconectando'
+ENCERRADA = 'encerrada'
+ERRO = 'erro'
+
+
+class FonteTransmissao:
+    """
+    Transmissão ao vivo (RTSP/HTTP, índice de webcam ou arquivo local).
+
+    Uma thread lê os frames continuamente e mantém apenas o mais recente: se a
+    inferência não acompanha a transmissão, os frames intermediários são
+    substituídos (descartados) em vez de acumular atraso. Arquivos locais são
+    reproduzidos no ritmo do seu FPS, simulando uma câmera ao vivo.
+    """
+
+    def __init__(self, url, nome=None, fonte_id=None, chat_id=None, limiar_confianca=0.25, tempo_real=None,
+                 repetir=False):
+        """
+        Args:
+            url: URL RTSP/HTTP, índice da webcam (ex.: "0") ou caminho de um vídeo
+            nome: Nome exibido nos alertas (padrão: a própria URL)
+            fonte_id: Identificador da transmissão (padrão: gerado)
+            chat_id: Chat do Telegram que recebe os alertas (opcional)
+            limiar_confianca: Limiar mínimo de confiança para detecção
+            tempo_real: Se deve limitar a leitura ao FPS do vídeo (padrão: True
+                para arquivos locais)
+            repetir: Se deve recomeçar um arquivo local ao chegar ao fim
+        """
+        self.url = str(url)
+        self.nome = nome or self.url
+        self.fonte_id = fonte_id or uuid.uuid4().hex[:8]
+        self.chat_id = chat_id
+        self.limiar_confianca = limiar_confianca
+        self.arquivo = os.path.isfile(self.url)
+        self.origem = int(self.url) if self.url.isdigit() else self.url
+        self.tempo_real = self.arquivo if tempo_real is None else tempo_real
+        self.repetir = repetir
+        self.estado = CONECTANDO
+        self.iniciada_em = time.monotonic()
+        self.atendida_em = 0.0  # Última vez em que um frame entrou em um lote
+
+        # Último frame lido e ainda não inferido
+        self._frame = None
+        self._frame_num = None
+        self._capturado_em = None
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+        self.rastreador = RastreadorEventos()
+        self.alertados = set()  # Eventos que já geraram alerta
+        self.eventos_recentes = deque(maxlen=100)  # Eventos encerrados
+        self.total_eventos = 0
+        self.contadores = {'capturados': 0, 'processados': 0, 'substituidos': 0, 'descartados_latencia': 0,
+                           'reconexoes': 0, 'alertas': 0, 'alertas_descartados': 0}
+        self.latencias = deque(maxlen=1000)
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._capturar, name=f'transmissao-{self.fonte_id}', daemon=True)
+        self._thread.start()
+
+    def parar(self, tempo_limite=5.0):
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(tempo_limite)
+        if self.estado != ERRO:
+            self.estado = ENCERRADA
+
+    def _capturar(self):
+        while not self._parar.is_set():
+            cap = cv2.VideoCapture(self.origem)
+            if not cap.isOpened():
+                cap.release()
+                if self.arquivo:
+                    logger.error(f"Não foi possível abrir o vídeo da transmissão {self.fonte_id}: {self.url}")
+                    self.estado = ERRO
+                    return
+                self._aguardar_reconexao()
+                continue
+
+            self.estado = ATIVA
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            fps = fps if fps and fps > 0 else 30
+            inicio = time.monotonic()
+            lidos = 0
+            while not self._parar.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.tempo_real:
+                    # Entregar cada frame no instante em que uma câmera o entregaria
+                    espera = inicio + lidos / fps - time.monotonic()
+                    if espera > 0 and self._parar.wait(espera):
+                        break
+                lidos += 1
+                self._publicar(frame)
+            cap.release()
+
+            if self._parar.is_set():
+                break
+            if self.arquivo and not self.repetir:
+                logger.info(f"Transmissão {self.fonte_id} chegou ao fim do vídeo")
+                self.estado = ENCERRADA
+                return
+            if not self.arquivo:
+                self._aguardar_reconexao()
+
+    def _aguardar_reconexao(self):
+        self.estado = RECONECTANDO
+        self.contadores['reconexoes'] += 1
+        logger.warning(f"Transmissão {self.fonte_id} indisponível; reconectando em {TRANSMISSAO_ESPERA_RECONEXAO_S}s")
+        self._parar.wait(TRANSMISSAO_ESPERA_RECONEXAO_S)
+
+    def _publicar(self, frame):
+        with self._lock:
+            if self._frame is not None:
+                self.contadores['substituidos'] += 1
+            self._frame = frame
+            self._frame_num = self.contadores['capturados']
+            self._capturado_em = time.monotonic()
+            self.contadores['capturados'] += 1
+
+    def capturado_em(self):
+        """Instante (time.monotonic) da captura do frame pendente, ou None."""
+        with self._lock:
+            return self._capturado_em if self._frame is not None else None
+
+    def retirar_frame(self):
+        """
+        Retira o frame pendente.
+
+        Returns:
+            tuple: (frame_num, frame, capturado_em), ou None se não há frame novo
+        """
+        with self._lock:
+            if self._frame is None:
+                return None
+            item = (self._frame_num, self._frame, self._capturado_em)
+            self._frame = None
+            return item
+
+    def finalizada(self):
+        return self.estado in (ENCERRADA, ERRO)
+
+    def resumo(self):
+        latencias = np.array(self.latencias) if self.latencias else None
+        return {
+            'fonte_id': self.fonte_id,
+            'nome': self.nome,
+            'url': self.url,
+            'estado': self.estado,
+            'tempo_real': self.tempo_real,
+            'limiar_confianca': self.limiar_confianca,
+            **self.contadores,
+            'latencia_media_ms': round(float(latencias.mean()) * 1000, 1) if latencias is not None else None,
+            'latencia_p95_ms': round(float(np.percentile(latencias, 95)) * 1000, 1) if latencias is not None else None,
+            'latencia_maxima_ms': round(float(latencias.max()) * 1000, 1) if latencias is not None else None,
+            'eventos_ativos': len(self.rastreador.ativos),
+            'total_eventos': self.total_eventos + len(self.rastreador.ativos),
+            'eventos_recentes': list(self.eventos_recentes)[-10:],
+        }
+
+
+def mensagem_alerta(fonte, evento):
+    """Mensagem do Telegram para um evento de uma transmissão."""
+    return gerar_mensagem_padrao(fonte.nome, True, confianca=evento['confianca_maxima'],
+                                 frame_num=evento['melhor_frame'], inicio=evento['inicio'], fim=evento['fim'])
+
+
+class ProcessadorTransmissoes:
+    """
+    Processa várias transmissões ao vivo com um único modelo compartilhado.
+
+    Uma thread de inferência junta o frame mais recente de cada transmissão em
+    um lote (uma chamada ao modelo para todas as câmeras). Frames que já
+    passaram de `latencia_maxima` ou que não terminariam a inferência dentro do
+    limite (pela estimativa do tempo por frame) são descartados, então a
+    latência entre a captura e a detecção se mantém limitada mesmo com mais
+    câmeras do que o modelo consegue processar. As detecções de cada
+    transmissão são agrupadas em eventos, e um alerta é enviado assim que um
+    evento acumula TRANSMISSAO_DETECCOES_ALERTA detecções.
+    """
+
+    def __init__(self, modelo_path, latencia_maxima=None, tamanho_lote=None, resolucao=None, alertar=None,
+                 token_telegram=None, frames_dir=None, despachante=None, loop=None):
+        """
+        Args:
+            modelo_path: Caminho para o modelo treinado
+            latencia_maxima: Segundos entre a captura e o fim da inferência
+                (padrão: TRANSMISSAO_LATENCIA_MAXIMA_S)
+            tamanho_lote: Máximo de frames por chamada ao modelo
+                (padrão: TRANSMISSAO_TAMANHO_LOTE)
+            resolucao: Perfil de resolução (ver `escolher_resolucao`); no modo
+                "auto", desce um perfil conforme o número de transmissões
+            alertar: Função `alertar(fonte, evento, frame_path)` chamada em uma
+                thread separada para cada novo evento (padrão: alerta pelo
+                Telegram para `fonte.chat_id`)
+            token_telegram: Token do bot usado pelo alerta padrão sem
+                despachante (padrão: variável TOKEN_TELEGRAM)
+            frames_dir: Diretório dos frames dos alertas (padrão: TRANSMISSAO_FRAMES_DIR)
+            despachante: `DespachanteTelegram` do alerta padrão, com os
+                limites de envio e as métricas dos demais alertas; sem ele
+                (linha de comando), o alerta é enviado diretamente
+            loop: Event loop em que o despachante roda (ex.: o da API)
+        """
+        self.modelo_path = modelo_path
+        self.latencia_maxima = latencia_maxima or TRANSMISSAO_LATENCIA_MAXIMA_S
+        self.tamanho_lote = tamanho_lote or TRANSMISSAO_TAMANHO_LOTE
+        self.resolucao = resolucao
+        escolher_resolucao(resolucao)  # Validar o perfil antes de iniciar
+        self.alertar = alertar or self._alertar_telegram
+        self.token_telegram = token_telegram or os.environ.get('TOKEN_TELEGRAM')
+        self.frames_dir = frames_dir or TRANSMISSAO_FRAMES_DIR
+        self.despachante = despachante
+        self.loop = loop
+
+        self.fontes = {}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._inferindo = threading.Lock()  # Protege os rastreadores durante a inferência de um lote
+        self._alertas = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alerta-transmissao')
+        self._alertas_pendentes = threading.BoundedSemaphore(TRANSMISSAO_ALERTAS_PENDENTES)
+        self.tempo_por_frame = None  # Média móvel do tempo de inferência por frame
+        self.lotes = 0
+
+    def adicionar(self, url, **opcoes):
+        """
+        Adiciona uma transmissão e inicia a sua captura.
+
+        Args:
+            url: URL RTSP/HTTP, índice da webcam ou caminho de um vídeo
+            **opcoes: Parâmetros de `FonteTransmissao` (nome, chat_id,
+                limiar_confianca, tempo_real, repetir)
+
+        Returns:
+            FonteTransmissao: Transmissão adicionada
+        """
+        fonte = FonteTransmissao(url, **opcoes)
+        self.iniciar()
+        with self._lock:
+            if fonte.fonte_id in self.fontes:
+                raise ValueError(f"Transmissão {fonte.fonte_id} já existe")
+            self.fontes[fonte.fonte_id] = fonte
+        fonte.iniciar()
+        logger.info(f"Transmissão {fonte.fonte_id} adicionada: {fonte.url}")
+        return fonte
+
+    def remover(self, fonte_id):
+        """
+        Encerra e remove uma transmissão.
+
+        Returns:
+            FonteTransmissao: Transmissão removida, ou None se não existe
+        """
+        with self._lock:
+            fonte = self.fontes.pop(fonte_id, None)
+        if fonte is not None:
+            fonte.parar()
+            with self._inferindo:
+                self._encerrar_eventos(fonte)
+        return fonte
+
+    def iniciar(self):
+        """Carrega e aquece o modelo e inicia a thread de inferência."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            # O primeiro lote não deve pagar a carga do modelo
+            obter_modelo(self.modelo_path, aquecer=True)
+            self._parar.clear()
+            self._thread = threading.Thread(target=self._laco, name='inferencia-transmissoes', daemon=True)
+            self._thread.start()
+
+    def encerrar(self, tempo_limite=10.0):
+        """Encerra todas as transmissões e aguarda os alertas pendentes."""
+        for fonte_id in list(self.fontes):
+            self.remover(fonte_id)
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(tempo_limite)
+        self._alertas.shutdown(wait=True)
+
+    def _selecionar_lote(self):
+        # Frames pendentes, começando pelas transmissões atendidas há mais tempo,
+        # para nenhuma ficar sempre de fora do lote
+        with self._lock:
+            fontes = list(self.fontes.values())
+        pendentes = []
+        for fonte in fontes:
+            capturado_em = fonte.capturado_em()
+            if capturado_em is not None:
+                pendentes.append((fonte.atendida_em, capturado_em, fonte))
+            elif fonte.finalizada() and fonte.rastreador.ativos:
+                # Fim do vídeo: encerrar os eventos em andamento
+                self._encerrar_eventos(fonte)
+        pendentes.sort(key=lambda item: item[:2])
+
+        agora = time.monotonic()
+        lote = []
+        for _, capturado_em, fonte in pendentes:
+            previsto = (agora - capturado_em) + (self.tempo_por_frame or 0) * (len(lote) + 1)
+            if agora - capturado_em > self.latencia_maxima:
+                # Já passou do limite: descartar e aguardar o próximo frame
+                if fonte.retirar_frame() is not None:
+                    fonte.contadores['descartados_latencia'] += 1
+                continue
+            if lote and (previsto > self.latencia_maxima or len(lote) >= self.tamanho_lote):
+                # Não cabe neste lote; fica para o próximo (ou é substituído por um mais novo)
+                continue
+            item = fonte.retirar_frame()
+            if item is not None:
+                fonte.atendida_em = agora
+                lote.append((fonte, *item))
+        return lote
+
+    def _laco(self):
+        while not self._parar.is_set():
+            lote = self._selecionar_lote()
+            if not lote:
+                self._parar.wait(0.005)
+                continue
+            try:
+                with self._inferindo:
+                    self._inferir(lote)
+            except Exception as e:
+                logger.error(f"Erro na inferência das transmissões: {str(e)}")
+                self._parar.wait(1)
+
+    def _inferir(self, lote):
+        modelo = obter_modelo(self.modelo_path)
+        resolucao = escolher_resolucao(self.resolucao, profundidade_fila=max(0, len(self.fontes) - 1))
+        opcoes = {'imgsz': resolucao} if resolucao else {}
+        frames = [frame for _, _, frame, _ in lote]
+
+        inicio = time.perf_counter()
+        resultados = modelo.prever(frames if len(frames) > 1 else frames[0],
+                                   conf=min(fonte.limiar_confianca for fonte, _, _, _ in lote), verbose=False,
+                                   **opcoes)
+        metricas.DURACAO_ETAPA.observar(time.perf_counter() - inicio, origem='transmissao', etapa='inferencia')
+        metricas.FRAMES.incrementar(len(frames), origem='transmissao')
+        duracao = (time.perf_counter() - inicio) / len(frames)
+        self.tempo_por_frame = duracao if self.tempo_por_frame is None else 0.8 * self.tempo_por_frame + 0.2 * duracao
+        self.lotes += 1
+
+        concluido_em = time.monotonic()
+        for (fonte, frame_num, frame, capturado_em), resultado in zip(lote, resultados):
+            fonte.latencias.append(concluido_em - capturado_em)
+            fonte.contadores['processados'] += 1
+            self._registrar(fonte, frame_num, frame, capturado_em, resultado)
+
+    def _registrar(self, fonte, frame_num, frame, capturado_em, resultado):
+        visivel = resultado[resultado.boxes.conf > fonte.limiar_confianca]
+        tempo = capturado_em - fonte.iniciada_em
+        deteccoes = []
+        if len(visivel.boxes) > 0:
+            # Colunas de boxes.data: x1, y1, x2, y2, [track_id], conf, cls
+            dados = visivel.boxes.data.cpu().numpy()
+            deteccoes = [
+                {
+                    'frame_num': frame_num,
+                    'tempo': tempo,
+                    'classe': visivel.names.get(int(linha[-1]), "objeto_cortante"),
+                    'confianca': float(linha[-2]),
+                    'coordenadas': linha[:4].tolist(),
+                    'frame_path': None,
+                }
+                for linha in dados
+            ]
+            metricas.DETECCOES.incrementar(len(deteccoes), origem='transmissao')
+
+        for evento in fonte.rastreador.atualizar(tempo, deteccoes):
+            self._evento_encerrado(fonte, evento)
+
+        # Alertar os eventos que acabaram de atingir o mínimo de detecções
+        novos = [evento for evento in fonte.rastreador.ativos
+                 if evento.total >= TRANSMISSAO_DETECCOES_ALERTA and evento.evento_id not in fonte.alertados
+                 and evento.frame_final == frame_num]
+        if novos:
+            frame_path = self._salvar_frame(fonte, frame_num, visivel.plot())
+            for evento in novos:
+                fonte.alertados.add(evento.evento_id)
+                if not self._alertas_pendentes.acquire(blocking=False):
+                    fonte.contadores['alertas_descartados'] += 1
+                    logger.warning(f"Alerta do evento {evento.evento_id} da transmissão {fonte.fonte_id} "
+                                   f"descartado: {TRANSMISSAO_ALERTAS_PENDENTES} alertas pendentes")
+                    continue
+                fonte.contadores['alertas'] += 1
+                self._alertas.submit(self._executar_alerta, fonte, evento.para_dict(), frame_path)
+
+    def _evento_encerrado(self, fonte, evento):
+        fonte.alertados.discard(evento['evento_id'])
+        fonte.eventos_recentes.append(evento)
+        fonte.total_eventos += 1
+
+    def _encerrar_eventos(self, fonte):
+        for evento in fonte.rastreador.finalizar():
+            self._evento_encerrado(fonte, evento)
+
+    def _salvar_frame(self, fonte, frame_num, frame_anotado):
+        diretorio = os.path.join(self.frames_dir, fonte.fonte_id)
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, f"frame_{frame_num:06d}.jpg")
+        if not cv2.imwrite(caminho, frame_anotado):
+            logger.error(f"Erro ao salvar o frame do alerta {caminho}")
+            return None
+        return caminho
+
+    def _executar_alerta(self, fonte, evento, frame_path):
+        futuro = None
+        try:
+            futuro = self.alertar(fonte, evento, frame_path)
+        except Exception as e:
+            logger.error(f"Erro ao enviar o alerta da transmissão {fonte.fonte_id}: {str(e)}")
+        finally:
+            # Entregue ao despachante, a vaga é liberada quando o alerta entra
+            # na fila dele (a thread de alertas não espera o event loop)
+            if futuro is not None and hasattr(futuro, 'add_done_callback'):
+                futuro.add_done_callback(lambda _: self._alertas_pendentes.release())
+            else:
+                self._alertas_pendentes.release()
+
+    def _alertar_telegram(self, fonte, evento, frame_path):
+        if fonte.chat_id and self.despachante is not None:
+            return asyncio.run_coroutine_threadsafe(
+                self.despachante.enfileirar(fonte.chat_id, mensagem_alerta(fonte, evento), frame_path), self.loop)
+        if fonte.chat_id and self.token_telegram:
+            inicio = time.perf_counter()
+            sucesso = enviar_alerta_telegram(fonte.chat_id, self.token_telegram, mensagem_alerta(fonte, evento),
+                                             frame_path)
+            metricas.ALERTAS.incrementar(canal='telegram', resultado='enviado' if sucesso else 'falha')
+            metricas.DURACAO_ALERTA.observar(time.perf_counter() - inicio, canal='telegram')
+        else:
+            logger.info(f"Evento {evento['evento_id']} na transmissão {fonte.fonte_id} "
+                        f"({evento['classe']}, confiança {evento['confianca_maxima']:.2f})")
+
+    def obter(self, fonte_id):
+        return self.fontes.get(fonte_id)
+
+    def estatisticas(self):
+        """Estado de cada transmissão, com frames descartados, latências e eventos."""
+        with self._lock:
+            fontes = list(self.fontes.values())
+        return {
+            'latencia_maxima_ms': round(self.latencia_maxima * 1000, 1),
+            'ms_inferencia_por_frame': round(self.tempo_por_frame * 1000, 2) if self.tempo_por_frame else None,
+            'lotes': self.lotes,
+            'transmissoes': [fonte.resumo() for fonte in fontes],
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description="Processa transmissões ao vivo (ou vídeos locais reproduzidos em tempo real).")
+    parser.add_argument("fontes", nargs="+", help="URLs RTSP/HTTP, índices de webcam ou caminhos de vídeos")
+    parser.add_argument("--modelo", default=os.environ.get('MODELO_PATH', 'models/objeto_cortante.pt'))
+    parser.add_argument("--limiar", type=float, default=0.25)
+    parser.add_argument("--latencia", type=float, default=TRANSMISSAO_LATENCIA_MAXIMA_S)
+    parser.add_argument("--resolucao", default=None, help="Tamanho em pixels ou 'auto'")
+    parser.add_argument("--chat-id", help="Chat do Telegram que recebe os alertas")
+    parser.add_argument("--repetir", action="store_true", help="Recomeçar os vídeos locais ao chegar ao fim")
+    parser.add_argument("--duracao", type=float, help="Encerrar após N segundos")
+    args = parser.parse_args()
+
+    processador = ProcessadorTransmissoes(args.modelo, latencia_maxima=args.latencia, resolucao=args.resolucao)
+    for url in args.fontes:
+        processador.adicionar(url, chat_id=args.chat_id, limiar_confianca=args.limiar, repetir=args.repetir)
+    limite = time.monotonic() + args.duracao if args.duracao else None
+    try:
+        while not all(fonte.finalizada() for fonte in processador.fontes.values()):
+            if limite and time.monotonic() > limite:
+                break
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    estatisticas = processador.estatisticas()
+    processador.encerrar()
+    print(json.dumps(estatisticas, indent=2, ensure_ascii=False, default=str))
@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import cv2
+import numpy as np
+
+# Diretório dos vídeos e do modelo sintéticos (gerados na primeira execução)
+DIRETORIO_DADOS = os.environ.get('BENCHMARK_DADOS_DIR', 'benchmarks/dados')
+
+# Diretório dos resultados em JSON
+DIRETORIO_RESULTADOS = os.environ.get('BENCHMARK_RESULTADOS_DIR', 'benchmarks/resultados')
+
+RESOLUCOES = {'240p': (320, 240), '480p': (640, 480), '720p': (1280, 720)}
+DURACOES = {'curto': 60, 'longo': 300}  # Frames, a 30 fps
+
+# Densidade de detecções, controlada pelo limiar de confiança sobre o modelo
+# sintético (a densidade medida em cada cenário é registrada no resultado)
+DENSIDADES = {'nenhuma': 0.999, 'baixa': 0.9, 'alta': 0.5}
+
+# Subconjunto usado com --rapido
+CENARIOS_RAPIDOS = ('240p_curto_nenhuma', '240p_curto_alta', '480p_curto_baixa', '480p_curto_alta')
+
+# Objetos desenhados nos vídeos sintéticos
+OBJETOS_POR_VIDEO = 4
+
+# Fator aplicado à saída de classe do modelo sintético: as ativações de um
+# modelo recém-inicializado são quase nulas e todas as confianças ficariam em
+# 0.5; ampliadas, elas variam com o conteúdo do frame
+ESCALA_CLASSE_MODELO_SINTETICO = 1e7
+
+
+def listar_cenarios():
+    """
+    Returns:
+        dict: Nome do cenário -> (resolução, frames, limiar de confiança)
+    """
+    return {
+        f"{resolucao}_{duracao}_{densidade}": (RESOLUCOES[resolucao], DURACOES[duracao], DENSIDADES[densidade])
+        for resolucao in RESOLUCOES for duracao in DURACOES for densidade in DENSIDADES
+    }
+
+
+def gerar_video_sintetico(caminho, largura, altura, frames, fps=30, objetos=OBJETOS_POR_VIDEO, semente=0):
+    """
+    Gera um vídeo determinístico: fundo em gradiente que se desloca, objetos
+    triangulares claros em movimento e ruído leve (para o codec e o filtro de
+    movimento terem trabalho realista).
+
+    Returns:
+        str: Caminho do vídeo (reaproveitado se já existir)
+    """
+    if os.path.exists(caminho):
+        return caminho
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    rng = np.random.default_rng(semente)
+    y, x = np.mgrid[0:altura, 0:largura]
+    posicoes = rng.uniform([0, 0], [largura, altura], size=(objetos, 2))
+    velocidades = rng.uniform(-4, 4, size=(objetos, 2)) * largura / 640
+    tamanho = max(12, largura // 12)
+
+    temporario = caminho + '.tmp.mp4'
+    writer = cv2.VideoWriter(temporario, cv2.VideoWriter_fourcc(*'mp4v'), fps, (largura, altura))
+    try:
+        for i in range(frames):
+            deslocamento = i * 2
+            frame = np.dstack([
+                ((x + deslocamento) * 255 // largura) % 256,
+                (y * 255 // altura),
+                np.full((altura, largura), 90),
+            ]).astype(np.uint8)
+            for (cx, cy), (vx, vy) in zip(posicoes + velocidades * i, velocidades):
+                cx, cy = cx % largura, cy % altura
+                angulo = np.arctan2(vy, vx)
+                ponta = (cx + tamanho * np.cos(angulo), cy + tamanho * np.sin(angulo))
+                base = [(cx + tamanho / 5 * np.cos(angulo + lado * np.pi / 2),
+                         cy + tamanho / 5 * np.sin(angulo + lado * np.pi / 2)) for lado in (1, -1)]
+                cv2.fillPoly(frame, [np.array([ponta, *base], dtype=np.int32)], (230, 230, 230))
+            frame = cv2.add(frame, rng.integers(0, 12, frame.shape, dtype=np.uint8))
+            writer.write(frame)
+    finally:
+        writer.release()
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def criar_modelo_sintetico(caminho, semente=0):
+    """
+    Cria um YOLOv8n de uma classe (objeto_cortante) com pesos aleatórios de
+    semente fixa, para o benchmark rodar sem baixar nem treinar modelos. O
+    custo da inferência é o de um modelo real; as detecções não têm sentido.
+
+    Returns:
+        str: Caminho do modelo (reaproveitado se já existir)
+    """
+    if os.path.exists(caminho):
+        return caminho
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    torch.manual_seed(semente)
+    modelo = DetectionModel('yolov8n.yaml', nc=1, verbose=False)
+    modelo.names = {0: 'objeto_cortante'}
+    for camadas in modelo.model[-1].cv3:
+        camadas[-1].weight.data *= ESCALA_CLASSE_MODELO_SINTETICO
+        camadas[-1].bias.data[:] = 0
+    torch.save({'model': modelo, 'train_args': {}, 'date': None, 'version': None, 'epoch': -1}, caminho)
+    return caminho
+
+
+def _tamanho_arquivos(caminho):
+    if not caminho or not os.path.exists(caminho):
+        return 0
+    if os.path.isfile(caminho):
+        return os.path.getsize(caminho)
+    return sum(os.path.getsize(os.path.join(raiz, nome)) for raiz, _, nomes in os.walk(caminho) for nome in nomes)
+
+
+def _executar_cenario(modelo_path, video_path, limiar_confianca, saida_dir, threads=None, gerar_video=True,
+                      salvar_frames=True, **opcoes):
+    # Executado em um processo novo por cenário, para o pico de memória ser só dele
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    from app.modelos import obter_modelo
+    from app.detector import processar_video
+    from app.memoria import pico_rss_mb
+
+    # A carga e o aquecimento do modelo ficam fora da medição
+    obter_modelo(modelo_path, aquecer=True)
+
+    shutil.rmtree(saida_dir, ignore_errors=True)
+    output_path = os.path.join(saida_dir, 'video.mp4') if gerar_video else None
+    frames_dir = os.path.join(saida_dir, 'frames') if salvar_frames else None
+    estatisticas = {}
+    _, deteccoes = processar_video(modelo_path, video_path, output_path=output_path,
+                                   limiar_confianca=limiar_confianca, salvar_frames=salvar_frames,
+                                   frames_dir=frames_dir, estatisticas=estatisticas,
+                                   ao_progredir=lambda evento: None, **opcoes)
+
+    frames = estatisticas['frames']
+    pico_rss = pico_rss_mb()
+    resultado = {
+        'frames': frames,
+        'fps': estatisticas['fps_processamento'],
+        'tempo_total': estatisticas['tempo_total'],
+        'ms_inferencia_por_frame': estatisticas['ms_inferencia_por_frame'],
+        'resolucao_inferencia': estatisticas['resolucao_inferencia'],
+        'deteccoes': len(deteccoes),
+        'deteccoes_por_frame': round(len(deteccoes) / frames, 2) if frames else 0,
+        'estagios': {
+            nome: {chave: estagio[chave] for chave in ('ocupado', 'itens', 'p50_ms', 'p95_ms', 'p99_ms')}
+            for nome, estagio in estatisticas['pipeline']['estagios'].items()
+        },
+        'pico_rss_mb': round(pico_rss, 1) if pico_rss is not None else None,
+        'tamanho_video_bytes': _tamanho_arquivos(output_path),
+        'tamanho_frames_bytes': _tamanho_arquivos(frames_dir),
+    }
+    shutil.rmtree(saida_dir, ignore_errors=True)
+    return resultado
+
+
+def _metadados(modelo_path, opcoes):
+    def versao(modulo):
+        try:
+            return __import__(modulo).__version__
+        except Exception:
+            return None
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'processador': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'versoes': {modulo: versao(modulo) for modulo in ('torch', 'ultralytics', 'cv2', 'numpy')},
+        'modelo': modelo_path,
+        'opcoes': opcoes,
+    }
+
+
+def executar_benchmark(cenarios=None, modelo_path=None, repeticoes=1, threads=None, gerar_video=True,
+                       salvar_frames=True, **opcoes):
+    """
+    Executa os cenários na CPU, cada repetição em um processo novo.
+
+    Args:
+        cenarios: Nomes dos cenários (padrão: todos, ver `listar_cenarios`)
+        modelo_path: Modelo a medir (padrão: modelo sintético)
+        repeticoes: Execuções por cenário; o resultado é a de FPS mediano
+        threads: Threads do PyTorch (padrão: as do PyTorch)
+        gerar_video: Se deve gravar o vídeo anotado (estágio de codificação)
+        salvar_frames: Se deve salvar os frames com detecções
+        **opcoes: Parâmetros de `processar_video` (tamanho_lote, pipeline, resolucao...)
+
+    Returns:
+        dict: Metadados da execução e o resultado de cada cenário
+    """
+    # Medir apenas a CPU, mesmo em máquinas com GPU
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    todos = listar_cenarios()
+    cenarios = list(cenarios or todos)
+    desconhecidos = [nome for nome in cenarios if nome not in todos]
+    if desconhecidos:
+        raise ValueError(f"Cenários desconhecidos: {', '.join(desconhecidos)}")
+    modelo_path = modelo_path or criar_modelo_sintetico(os.path.join(DIRETORIO_DADOS, 'modelo_sintetico.pt'))
+
+    resultado = {
+        'metadados': _metadados(modelo_path, dict(opcoes, threads=threads, gerar_video=gerar_video,
+                                                  salvar_frames=salvar_frames, repeticoes=repeticoes)),
+        'cenarios': {},
+    }
+    contexto = multiprocessing.get_context('spawn')
+    for nome in cenarios:
+        (largura, altura), frames, limiar = todos[nome]
+        video_path = gerar_video_sintetico(os.path.join(DIRETORIO_DADOS, f"video_{largura}x{altura}_{frames}.mp4"),
+                                           largura, altura, frames)
+        execucoes = []
+        for _ in range(max(1, repeticoes)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+                execucoes.append(executor.submit(
+                    _executar_cenario, modelo_path, video_path, limiar, os.path.join(DIRETORIO_DADOS, 'saida', nome),
+                    threads, gerar_video, salvar_frames, **opcoes
+                ).result())
+        fps = [execucao['fps'] for execucao in execucoes]
+        mediana = sorted(execucoes, key=lambda execucao: execucao['fps'])[len(execucoes) // 2]
+        resultado['cenarios'][nome] = dict(mediana, largura=largura, altura=altura, limiar_confianca=limiar,
+                                           fps_execucoes=fps)
+        print(f"{nome:22s} {mediana['fps']:8.2f} fps  {mediana['deteccoes_por_frame']:7.2f} det/frame  "
+              f"pico RSS {mediana['pico_rss_mb']} MB", flush=True)
+    return resultado
+
+
+def comparar_resultados(atual, base, tolerancia=None):
+    """
+    Compara o FPS e o p95 da inferência de duas execuções.
+
+    Args:
+        atual: Resultado de `executar_benchmark`
+        base: Resultado anterior (ex.: lido de um JSON salvo)
+        tolerancia: Queda máxima de FPS (em %) aceita por cenário
+
+    Returns:
+        list: Nomes dos cenários com queda de FPS acima da tolerância
+    """
+    regressoes = []
+    print(f"\n{'cenário':22s} {'fps base':>9s} {'fps atual':>9s} {'variação':>9s} {'p95 inferência (ms)':>22s}")
+    for nome, cenario in atual['cenarios'].items():
+        anterior = base.get('cenarios', {}).get(nome)
+        if not anterior:
+            continue
+        variacao = (cenario['fps'] / anterior['fps'] - 1) * 100 if anterior['fps'] else 0
+        p95_base = anterior.get('estagios', {}).get('inferencia', {}).get('p95_ms')
+        p95_atual = cenario.get('estagios', {}).get('inferencia', {}).get('p95_ms')
+        print(f"{nome:22s} {anterior['fps']:9.2f} {cenario['fps']:9.2f} {variacao:+8.1f}% {str(p95_base):>10s} -> {str(p95_atual):<10s}")
+        if tolerancia is not None and variacao < -tolerancia:
+            regressoes.append(nome)
+    return regressoes
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de detecção em vídeos sintéticos (CPU).")
+    parser.add_argument("--cenarios", nargs="+", help=f"Cenários a executar (padrão: todos): {', '.join(listar_cenarios())}")
+    parser.add_argument("--rapido", action="store_true", help="Executar apenas os cenários curtos de 240p e 480p")
+    parser.add_argument("--modelo", help="Modelo a medir (padrão: modelo sintético de pesos aleatórios)")
+    parser.add_argument("--repeticoes", type=int, default=1)
+    parser.add_argument("--threads", type=int, help="Threads do PyTorch")
+    parser.add_argument("--tamanho-lote", type=int)
+    parser.add_argument("--resolucao", help="Resolução de inferência (320, 480, 640 ou auto)")
+    parser.add_argument("--sem-pipeline", action="store_true", help="Executar os estágios sequencialmente")
+    parser.add_argument("--sem-video", action="store_true", help="Não gravar o vídeo anotado")
+    parser.add_argument("--sem-frames", action="store_true", help="Não salvar os frames com detecções")
+    parser.add_argument("--saida", help="Arquivo JSON do resultado (padrão: benchmarks/resultados/deteccao_<data>.json)")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, help="Queda de FPS (%%) que faz o comando falhar com --comparar")
+    args = parser.parse_args()
+
+    opcoes = {}
+    if args.tamanho_lote:
+        opcoes['tamanho_lote'] = args.tamanho_lote
+    if args.resolucao:
+        opcoes['resolucao'] = args.resolucao
+    if args.sem_pipeline:
+        opcoes['pipeline'] = False
+
+    resultado = executar_benchmark(CENARIOS_RAPIDOS if args.rapido and not args.cenarios else args.cenarios,
+                                   args.modelo, args.repeticoes, args.threads, not args.sem_video,
+                                   not args.sem_frames, **opcoes)
+
+    saida = args.saida or os.path.join(DIRETORIO_RESULTADOS, f"deteccao_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(saida) or '.', exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, indent=2, ensure_ascii=False)
+    print(f"\nResultado salvo em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            regressoes = comparar_resultados(resultado, json.load(arquivo), args.tolerancia)
+        if regressoes:
+            print(f"\nQueda de FPS acima de {args.tolerancia}% em: {', '.join(regressoes)}")
+            sys.exit(1)